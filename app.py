@@ -1,17 +1,91 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 import requests # Make sure this is imported if not already via the main script part
+from requests.adapters import HTTPAdapter
 import json # For potential direct use, though jsonify handles most cases
+import os
 import time
+import sqlite3
+import struct
+import threading
+import bisect
+import math
+import random
+import gzip
+import hashlib
+import uuid
+from array import array
+from contextlib import contextmanager
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta, timezone as dt_timezone
-from collections import deque, defaultdict
+from collections import deque, defaultdict, OrderedDict, Counter
+from urllib.parse import urlencode
 
 # --- Configuration (Keep these at the top) ---
-BSCSCAN_API_URL = "https://api.bscscan.com/api"
-COINGECKO_API_URL = "https://api.coingecko.com/api/v3"
+# Both URLs can be pointed at a local stand-in (see bench/stub_server.py) to measure without spending API quota
+BSCSCAN_API_URL = os.environ.get("BSCSCAN_API_URL", "https://api.bscscan.com/api")
+COINGECKO_API_URL = os.environ.get("COINGECKO_API_URL", "https://api.coingecko.com/api/v3")
 BEP20_TRANSFER_EVENT_SIGNATURE = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
-API_CALL_DELAY = 0.25
-TOKEN_INFO_API_DELAY = 0.2
-COINGECKO_API_DELAY = 1
+BSCSCAN_CALLS_PER_SECOND = float(os.environ.get("BSCSCAN_CALLS_PER_SECOND", 5)) # BscScan free tier budget per API key, shared by every request in this process
+# Optional server-side key pool (comma-separated). Calls are spread over these keys plus the key sent by the user.
+BSCSCAN_API_KEYS = [key.strip() for key in os.environ.get("BSCSCAN_API_KEYS", "").split(",") if key.strip()]
+HTTP_POOL_MAXSIZE = 32 # Keep-alive connections per host in the shared HTTP session
+HTTP_TIMEOUT_SECONDS = 45
+API_MAX_RETRIES = 4 # Retries for rate-limit replies, 429/5xx and connection errors
+API_RETRY_BASE_DELAY = 0.5 # Seconds; doubled per attempt with +/-50% jitter
+API_RETRY_MAX_DELAY = 8
+COINGECKO_CALLS_PER_SECOND = float(os.environ.get("COINGECKO_CALLS_PER_SECOND", 1))
+RECEIPT_FETCH_WORKERS = 8 # Receipts fetched in parallel; the rate limiter still caps calls/sec
+BATCH_WALLET_WORKERS = 8 # Wallets whose txlist/tokentx pages are fetched in parallel in batch mode
+BATCH_MAX_WALLETS = 500
+TOKEN_METADATA_CACHE_MAX_ENTRIES = 10000 # In-memory LRU bound for token name/symbol/decimals
+TOKEN_METADATA_DB_MAX_ENTRIES = 200000 # Row bound of the persisted token metadata table
+TOKEN_METADATA_TTL_SECONDS = 7 * 86400
+TOKEN_METADATA_PLACEHOLDER_TTL_SECONDS = 600 # Tokens whose on-chain lookup failed are retried after this
+TOKEN_METADATA_PERSIST = True # Also keep token metadata in BSC_CACHE_DB_PATH so it survives restarts
+TOKEN_METADATA_FETCH_WORKERS = 6
+BNB_PRICE_MAX_GAP_SECONDS = 2 * 3600 # CoinGecko range data is hourly for spans up to 90 days (daily beyond); wider gaps mean no price
+BNB_PRICE_FETCH_CHUNK_SECONDS = 85 * 86400 # Longest span per market_chart/range call, so CoinGecko still answers hourly
+BNB_PRICE_REFRESH_SECONDS = 300 # A cached series this close to the requested end counts as covering it
+BNB_PRICE_FETCH_PADDING_SECONDS = 3600 # Fetched on both sides of a range so edge timestamps have a neighbour
+FIFO_USDT_DECIMALS = 12 # Fixed-point precision of FIFO lot costs, sale proceeds and realized PnL
+BNB_PRICE_RETRY_SECONDS = 60 # After a failed range fetch, lookups go without a price instead of retrying at once
+BSC_CACHE_DB_PATH = os.environ.get("BSC_CACHE_DB_PATH", "bsc_cache.sqlite3") # On-disk cache for immutable chain data
+RECEIPT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RECEIPT_CONFIRMATION_DEPTH = 15 # Receipts newer than head - depth are not cached (may still reorg)
+ACCOUNT_LIST_PAGE_SIZE = 1000
+ACCOUNT_LIST_RESULT_CAP = 10000 # BscScan answers at most page * offset <= 10000 rows per list query
+ACCOUNT_LIST_SHARD_BLOCKS = 120000 # ~25 h of BSC blocks per initial shard, so a one-day window plus resolver slack stays one shard
+ACCOUNT_LIST_SHARD_WORKERS = 8 # Shards of one list query fetched in parallel; the rate limiter still caps calls/sec
+ANALYSIS_MAX_RANGE_DAYS = 90 # Longest start_time/end_time range a request may ask for (CoinGecko stays hourly up to here)
+TRANSFER_INGESTION_MODE = "tokentx" # "tokentx": bulk BEP-20 download per window; "receipts": one receipt call per tx
+# Where chain data comes from: "bscscan" (REST API, quota-bound) or "rpc" (eth_getLogs & co. against our own node at BSC_RPC_URL)
+BSC_DATA_SOURCE = os.environ.get("BSC_DATA_SOURCE", "bscscan")
+BSC_RPC_URL = os.environ.get("BSC_RPC_URL", "http://127.0.0.1:8545")
+RPC_CALLS_PER_SECOND = float(os.environ.get("RPC_CALLS_PER_SECOND", 0)) # HTTP requests/sec to the node (a batch counts once); 0 = unlimited
+RPC_BATCH_MAX_REQUESTS = 100 # JSON-RPC calls per batched HTTP request
+RPC_BATCH_WORKERS = 4 # Batched HTTP requests in flight at once for one lookup
+RPC_LOG_RANGE_BLOCKS = 5000 # Initial eth_getLogs span; a span the node rejects is split in half, and later queries start from there
+RPC_LOG_CACHE_TTL_SECONDS = 60 # One analysis reads the same wallet logs for its tx list and its transfers
+RPC_LOG_CACHE_MAX_ENTRIES = 16
+RPC_BLOCK_SEARCH_PROBES = 16 # Blocks probed per batched round of the block-by-timestamp search
+BSC_BLOCKS_PER_SECOND = 1 / 0.75 # Fallback block rate until the anchor index has enough history to measure it
+BLOCK_ANCHOR_MAX_COUNT = 5000 # (timestamp, block) anchors kept for local block-by-timestamp resolution
+BLOCK_RESOLVER_SLACK_BLOCKS = 5 # Widening applied to every anchor-derived bound
+BLOCK_RESOLVER_MAX_UNCERTAINTY_BLOCKS = 1000 # Wider bounds than this are refined with a getblocknobytime call
+WALLET_SYNC_MAX_CHECKPOINTS = 500 # (wallet, window) ledgers kept in memory for incremental sync
+ANALYSIS_JOB_WORKERS = 4 # Single-wallet analyses run at once in the background job pool, independent of web workers
+ANALYSIS_JOB_MAX_PENDING = 200 # Queued + running jobs; further distinct submissions are rejected with 503
+ANALYSIS_JOB_RESULT_TTL_SECONDS = 600 # Finished jobs stay pollable this long
+ANALYSIS_JOB_MAX_RETAINED = 500 # Finished jobs kept for polling regardless of TTL (oldest dropped first)
+ANALYSIS_JOB_MAX_WAIT_SECONDS = 60 # Longest ?wait= a job poll may block for
+RESULT_CACHE_FINALITY_SECONDS = 300 # A window counts as closed this long after its end (blocks final and indexed by BscScan)
+RESULT_CACHE_OPEN_WINDOW_TTL_SECONDS = 30 # Results for a window that is still open are reused this long
+RESULT_CACHE_MAX_MEMORY_BYTES = 32 * 1024 * 1024 # Gzipped /get_transactions responses kept in memory
+RESULT_CACHE_MAX_DB_BYTES = 256 * 1024 * 1024 # Gzipped closed-window responses kept in BSC_CACHE_DB_PATH
+TABLE_CACHE_MAX_ENTRIES = 32 # Analyses kept as columnar tables for /tables paging
+TABLE_PAGE_DEFAULT_ROWS = 100
+TABLE_PAGE_MAX_ROWS = 500
 
 ZKJ_ADDRESS = "0xc71b5f6313554be6853efe9c3ab6b9590f8302e81"
 WBNB_ADDRESS = "0xbb4cdb9cbd36b01bd1cbaebf2de08d9173bc095c"
@@ -20,9 +94,876 @@ BUSD_ADDRESS = "0xe9e7cea3dedca5984780bafc599bd69add087d56"
 QUOTE_TOKEN_ADDRESSES = [WBNB_ADDRESS, USDT_ADDRESS, BUSD_ADDRESS]
 BEIJING_TIMEZONE_OFFSET = timedelta(hours=8)
 
-# Global caches (cleared on app restart - for a more persistent cache, use Redis, etc.)
-token_info_cache = {}
-bnb_price_cache = {}
+# Global caches: token_info_cache (TokenMetadataCache) and bnb_price_series (BnbPriceSeries) are created
+# below with the other cache objects and persist to BSC_CACHE_DB_PATH
+
+
+class MetricsRegistry:
+    # Minimal in-process Prometheus registry: labelled counters and histograms, plus collectors that
+    # report the caches' own hit/miss counters at scrape time. render() produces the text exposition format.
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.definitions = OrderedDict() # name -> (kind, help text, buckets)
+        self.values = defaultdict(dict) # name -> {label tuple: counter value | [bucket counts..., sum, count]}
+        self.collectors = []
+
+    def counter(self, name, help_text):
+        self.definitions[self.prefix + name] = ("counter", help_text, None)
+
+    def histogram(self, name, help_text, buckets):
+        self.definitions[self.prefix + name] = ("histogram", help_text, tuple(buckets))
+
+    def inc(self, name, labels=None, amount=1):
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            series = self.values[self.prefix + name]
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        name = self.prefix + name
+        buckets = self.definitions[name][2]
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            state = self.values[name].get(key)
+            if state is None: state = self.values[name][key] = [0] * len(buckets) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound: state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def register_collector(self, collect):
+        # collect() returns [(name, kind, help text, [(labels, value), ...]), ...] read fresh on every scrape
+        self.collectors.append(collect)
+
+    def render(self):
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs: return ""
+            escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+            return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+        lines = []
+        with self.lock:
+            snapshot = {name: {key: (list(value) if isinstance(value, list) else value) for key, value in series.items()}
+                        for name, series in self.values.items()}
+        for name, (kind, help_text, buckets) in self.definitions.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for key, value in sorted(snapshot.get(name, {}).items()):
+                if kind == "counter":
+                    lines.append(f"{name}{label_text(key)} {value}")
+                    continue
+                for bound, count in zip(buckets, value):
+                    lines.append(f"{name}_bucket{label_text(key, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{label_text(key, [('le', '+Inf')])} {value[-1]}")
+                lines.append(f"{name}_sum{label_text(key)} {value[-2]}")
+                lines.append(f"{name}_count{label_text(key)} {value[-1]}")
+        for collect in self.collectors:
+            for name, kind, help_text, samples in collect():
+                lines += [f"# HELP {self.prefix}{name} {help_text}", f"# TYPE {self.prefix}{name} {kind}"]
+                lines += [f"{self.prefix}{name}{label_text(sorted(labels.items()))} {value}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry("bsc_analyzer_")
+metrics.counter("api_requests_total", "Upstream API attempts by source, endpoint and outcome (ok, retryable, error).")
+metrics.histogram("api_request_duration_seconds", "Latency of single upstream API attempts.",
+                  (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+metrics.counter("api_retries_total", "Upstream API attempts retried after a transient failure.")
+metrics.counter("api_retry_backoff_seconds_total", "Seconds slept in retry backoff.")
+metrics.counter("rate_limit_wait_seconds_total", "Seconds spent waiting for rate limiter budget before API calls.")
+metrics.histogram("analysis_stage_duration_seconds", "Per-request time spent in each analysis stage.",
+                  (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+metrics.counter("analyses_total", "Completed wallet analyses by mode.")
+
+
+@contextmanager
+def timed_stage(stage_seconds, stage):
+    # Adds the wall time of the block to stage_seconds[stage] (a per-request timing breakdown)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds[stage] += time.perf_counter() - started
+
+
+def record_analysis_metrics(mode, timing_breakdown):
+    for stage, seconds in timing_breakdown.items():
+        metrics.observe("analysis_stage_duration_seconds", seconds, {"stage": stage})
+    metrics.inc("analyses_total", {"mode": mode})
+
+
+def api_endpoint_label(url, params, json_payload=None):
+    # A JSON-RPC batch is labelled by every method in it (sorted, "+"-joined), not just the first
+    if json_payload:
+        if not isinstance(json_payload, list): return json_payload.get("method")
+        return "+".join(sorted({call.get("method") or "unknown" for call in json_payload}))
+    return params.get("action") or url.rstrip("/").rsplit("/", 1)[-1]
+
+
+class TokenBucketRateLimiter:
+    # Process-wide token bucket. Callers reserve a token and sleep until it is due,
+    # so concurrent workers share one calls-per-second budget instead of sleeping blindly.
+    def __init__(self, rate_per_second, burst=1):
+        self.rate = float(rate_per_second)
+        self.capacity = float(burst)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def reserve(self):
+        # Takes a token and returns how long the caller must wait before using it
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def next_available_delay(self):
+        with self.lock:
+            self._refill()
+            return max(0.0, (1 - self.tokens) / self.rate)
+
+    def penalize(self, seconds):
+        # Pushes this bucket's next token back, e.g. after the server said we were over its limit
+        with self.lock:
+            self._refill()
+            self.tokens -= seconds * self.rate
+
+    def acquire(self):
+        wait_seconds = self.reserve()
+        if wait_seconds > 0: time.sleep(wait_seconds)
+
+
+class ApiKeyPool:
+    # One token bucket per BscScan API key. Each call goes to whichever candidate key frees up first, so
+    # throughput grows with the number of keys. Candidates are the configured server keys plus the key
+    # the current request brought; per-request keys get their own bucket, kept in a bounded LRU.
+    # A key BscScan rejected as invalid is left out of the rotation while any other candidate remains.
+    def __init__(self, configured_keys, rate_per_second, max_dynamic_keys=1000):
+        self.configured_keys = list(configured_keys)
+        self.rate_per_second = rate_per_second
+        self.max_dynamic_keys = max_dynamic_keys
+        self.limiters = OrderedDict((key, TokenBucketRateLimiter(rate_per_second)) for key in self.configured_keys)
+        self.invalid_keys = OrderedDict() # key -> None, bounded like the per-request limiters
+        self.lock = threading.Lock()
+
+    def _limiter(self, key):
+        limiter = self.limiters.get(key)
+        if limiter is None:
+            limiter = self.limiters[key] = TokenBucketRateLimiter(self.rate_per_second)
+            dynamic_keys = [k for k in self.limiters if k not in self.configured_keys]
+            for old_key in dynamic_keys[:max(0, len(dynamic_keys) - self.max_dynamic_keys)]:
+                del self.limiters[old_key]
+        elif key not in self.configured_keys:
+            self.limiters.move_to_end(key)
+        return limiter
+
+    def _candidates_locked(self, request_key):
+        candidates = list(self.configured_keys)
+        if request_key and request_key not in candidates: candidates.append(request_key)
+        return [key for key in candidates if key not in self.invalid_keys] or candidates
+
+    def acquire(self, request_key=None):
+        # Returns the key to use; blocks until that key has budget
+        with self.lock:
+            candidates = self._candidates_locked(request_key)
+            if not candidates: return request_key
+            limiters = [(key, self._limiter(key)) for key in candidates]
+            key, limiter = min(limiters, key=lambda item: item[1].next_available_delay())
+            wait_seconds = limiter.reserve()
+        if wait_seconds > 0: time.sleep(wait_seconds)
+        return key
+
+    def penalize(self, key, seconds):
+        with self.lock:
+            limiter = self.limiters.get(key)
+        if limiter: limiter.penalize(seconds)
+
+    def mark_invalid(self, key, request_key=None):
+        # Drops a rejected key from the rotation. Returns True if another usable candidate remains for the
+        # request, i.e. the call is worth retrying with a different key.
+        with self.lock:
+            self.invalid_keys[key] = None
+            self.invalid_keys.move_to_end(key)
+            while len(self.invalid_keys) > self.max_dynamic_keys + len(self.configured_keys):
+                self.invalid_keys.popitem(last=False)
+            return any(candidate not in self.invalid_keys for candidate in self._candidates_locked(request_key))
+
+
+bscscan_api_key_pool = ApiKeyPool(BSCSCAN_API_KEYS, BSCSCAN_CALLS_PER_SECOND)
+api_rate_limiters = {
+    "CoinGecko": TokenBucketRateLimiter(COINGECKO_CALLS_PER_SECOND),
+}
+if RPC_CALLS_PER_SECOND > 0: api_rate_limiters["RPC"] = TokenBucketRateLimiter(RPC_CALLS_PER_SECOND)
+
+
+def create_http_session():
+    # Shared keep-alive session; requests.Session is safe for concurrent GETs from the worker pools
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+http_session = create_http_session()
+
+
+class TransientApiError(Exception):
+    # Failure worth retrying: rate-limit replies, HTTP 429/5xx, timeouts and dropped connections
+    pass
+
+
+class InvalidApiKeyError(Exception):
+    # BscScan rejected the API key itself; the call can still succeed with another key from the pool
+    pass
+
+
+def open_cache_db_connection(db_path):
+    # One connection per cache object, shared across threads behind the object's own lock
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+class ReceiptStore:
+    # SQLite cache of finalized receipts keyed by tx hash. Only the BEP-20 Transfer logs are kept,
+    # packed as token(20) + from(20) + to(20) + data length(2) + data, which is all the classifier reads.
+    # A second table keeps finalized txlist-shaped tx summaries as JSON, for sources that have no txlist.
+    LOG_HEADER = struct.Struct(">20s20s20sH")
+
+    def __init__(self, db_path, max_bytes, confirmation_depth):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.confirmation_depth = confirmation_depth
+        self.lock = threading.Lock()
+        self.conn = None
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = open_cache_db_connection(self.db_path)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS receipts (tx_hash TEXT PRIMARY KEY, block_number INTEGER NOT NULL, "
+                "payload BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS receipts_last_access ON receipts (last_access)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS tx_summaries (tx_hash TEXT PRIMARY KEY, block_number INTEGER NOT NULL, "
+                "payload TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS tx_summaries_last_access ON tx_summaries (last_access)")
+        return self.conn
+
+    @classmethod
+    def encode_receipt(cls, receipt_data):
+        # Returns None for receipts that cannot be represented faithfully; those are simply not cached
+        parts = []
+        for log_entry in receipt_data.get("logs", []):
+            log_topics = log_entry.get("topics", [])
+            if not (log_topics and len(log_topics) == 3 and log_topics[0].lower() == BEP20_TRANSFER_EVENT_SIGNATURE): continue
+            token_addr = log_entry.get("address") or ""
+            raw_amount_hex = log_entry.get("data")
+            if len(token_addr) != 42 or len(log_topics[1]) < 64 or len(log_topics[2]) < 64 or raw_amount_hex is None: return None
+            try:
+                data_bytes = bytes.fromhex(raw_amount_hex[2:] if raw_amount_hex.startswith("0x") else raw_amount_hex)
+                parts.append(cls.LOG_HEADER.pack(bytes.fromhex(token_addr[2:]), bytes.fromhex(log_topics[1][-40:]),
+                                                 bytes.fromhex(log_topics[2][-40:]), len(data_bytes)))
+            except (ValueError, struct.error):
+                return None
+            parts.append(data_bytes)
+        return b"".join(parts)
+
+    @classmethod
+    def decode_receipt(cls, block_number, payload):
+        logs = []
+        offset = 0
+        while offset < len(payload):
+            token_bytes, from_bytes, to_bytes, data_len = cls.LOG_HEADER.unpack_from(payload, offset)
+            offset += cls.LOG_HEADER.size
+            logs.append({
+                "address": "0x" + token_bytes.hex(),
+                "topics": [BEP20_TRANSFER_EVENT_SIGNATURE, "0x" + "0" * 24 + from_bytes.hex(), "0x" + "0" * 24 + to_bytes.hex()],
+                "data": "0x" + payload[offset:offset + data_len].hex(),
+            })
+            offset += data_len
+        return {"blockNumber": hex(block_number), "logs": logs}
+
+    def get_many(self, tx_hashes):
+        return {tx_hash: self.decode_receipt(block_number, payload)
+                for tx_hash, (block_number, payload) in self._get_payloads("receipts", tx_hashes).items()}
+
+    def put_many(self, receipts_by_hash, chain_head_block):
+        # chain_head_block must not exceed the real head, otherwise unconfirmed receipts could be cached
+        rows = []
+        for tx_hash, receipt_data in receipts_by_hash.items():
+            if not tx_hash or not isinstance(receipt_data, dict) or "logs" not in receipt_data: continue
+            payload = self.encode_receipt(receipt_data)
+            if payload is not None: rows.append((tx_hash, hex_to_int(receipt_data.get("blockNumber") or ""), payload))
+        self._put_payloads("receipts", rows, chain_head_block)
+
+    def get_tx_summaries(self, tx_hashes):
+        # txlist-shaped rows kept by sources that build them from several calls (see JsonRpcDataSource)
+        return {tx_hash: json.loads(payload) for tx_hash, (_, payload) in self._get_payloads("tx_summaries", tx_hashes).items()}
+
+    def put_tx_summaries(self, rows, chain_head_block):
+        self._put_payloads("tx_summaries", [(row["hash"], int(row["blockNumber"]), json.dumps(row, separators=(",", ":")))
+                                            for row in rows], chain_head_block)
+
+    def _get_payloads(self, table, tx_hashes):
+        # {tx_hash: (block_number, payload)} for the cached hashes
+        keys = list(dict.fromkeys(tx_hash.lower() for tx_hash in tx_hashes if tx_hash))
+        found = {}
+        if not keys: return found
+        try:
+            with self.lock:
+                conn = self._connection()
+                for i in range(0, len(keys), 500): # Stay under SQLite's bound-parameter limit
+                    chunk = keys[i:i + 500]
+                    rows = conn.execute(
+                        f"SELECT tx_hash, block_number, payload FROM {table} WHERE tx_hash IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                    for tx_hash, block_number, payload in rows:
+                        found[tx_hash] = (block_number, payload)
+                if found:
+                    now = time.time()
+                    conn.executemany(f"UPDATE {table} SET last_access = ? WHERE tx_hash = ?", [(now, tx_hash) for tx_hash in found])
+                    conn.commit()
+                self.hits += len(found)
+                self.misses += len(keys) - len(found)
+        except sqlite3.Error as e:
+            app.logger.warning(f"Receipt cache read failed, fetching from API instead: {e}")
+            return {}
+        return found
+
+    def _put_payloads(self, table, payload_rows, chain_head_block):
+        # payload_rows: (tx_hash, block number, payload); rows less than confirmation_depth below the head are skipped
+        if chain_head_block is None: return
+        max_cacheable_block = chain_head_block - self.confirmation_depth
+        now = time.time()
+        rows = [(tx_hash.lower(), block_number, payload, len(payload) + len(tx_hash), now)
+                for tx_hash, block_number, payload in payload_rows
+                if tx_hash and block_number is not None and block_number <= max_cacheable_block]
+        if not rows: return
+        try:
+            with self.lock:
+                conn = self._connection()
+                conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?, ?)", rows)
+                self.stores += len(rows)
+                self._evict_if_needed(conn, table)
+                conn.commit()
+        except sqlite3.Error as e:
+            app.logger.warning(f"Receipt cache write failed: {e}")
+
+    def _evict_if_needed(self, conn, table):
+        # Each table is bounded by max_bytes on its own
+        total_bytes = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0]
+        if total_bytes <= self.max_bytes: return
+        bytes_to_free = total_bytes - int(self.max_bytes * 0.9) # Evict down to 90% so we don't evict on every insert
+        victims = []
+        for tx_hash, size in conn.execute(f"SELECT tx_hash, size FROM {table} ORDER BY last_access"):
+            victims.append((tx_hash,))
+            bytes_to_free -= size
+            if bytes_to_free <= 0: break
+        conn.executemany(f"DELETE FROM {table} WHERE tx_hash = ?", victims)
+        self.evictions += len(victims)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "evictions": self.evictions}
+
+
+receipt_store = ReceiptStore(BSC_CACHE_DB_PATH, RECEIPT_CACHE_MAX_BYTES, RECEIPT_CONFIRMATION_DEPTH)
+
+
+class BlockTimestampResolver:
+    # Persistent index of (timestamp, block) anchors learned from getblocknobytime answers and txlist rows.
+    # bounds() brackets the last block at or before a timestamp by interpolating between anchors on BSC's
+    # near-constant block time; callers only hit the API when the bracket is too wide. Exact window
+    # boundaries (e.g. today's 08:00 Beijing start) are memoized so every wallet shares one lookup.
+    def __init__(self, db_path, max_anchors):
+        self.db_path = db_path
+        self.max_anchors = max_anchors
+        self.lock = threading.Lock()
+        self.conn = None
+        self.timestamps = [] # Parallel lists sorted by block; timestamps are non-decreasing
+        self.blocks = []
+        self.boundaries = {} # (timestamp, closest) -> block
+        self.index_answers = 0
+        self.api_lookups = 0
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = open_cache_db_connection(self.db_path)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS block_anchors (block_number INTEGER PRIMARY KEY, timestamp INTEGER NOT NULL)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS block_boundaries (timestamp INTEGER NOT NULL, closest TEXT NOT NULL, "
+                "block_number INTEGER NOT NULL, PRIMARY KEY (timestamp, closest))")
+            rows = self.conn.execute(
+                "SELECT timestamp, block_number FROM block_anchors ORDER BY block_number DESC LIMIT ?", (self.max_anchors,)).fetchall()
+            for timestamp, block_number in reversed(rows):
+                self.timestamps.append(timestamp)
+                self.blocks.append(block_number)
+            since = int(time.time()) - 7 * 86400
+            for timestamp, closest, block_number in self.conn.execute(
+                    "SELECT timestamp, closest, block_number FROM block_boundaries WHERE timestamp >= ?", (since,)):
+                self.boundaries[(timestamp, closest)] = block_number
+        return self.conn
+
+    def _run_locked(self, fn, default=None):
+        # Index failures degrade to "unknown" so callers fall back to the API
+        try:
+            with self.lock:
+                self._connection()
+                return fn()
+        except sqlite3.Error as e:
+            app.logger.warning(f"Block anchor index unavailable: {e}")
+            return default
+
+    def learn(self, timestamp_block_pairs):
+        def _learn():
+            new_rows = []
+            for timestamp, block_number in timestamp_block_pairs:
+                i = bisect.bisect_left(self.blocks, block_number)
+                if i < len(self.blocks) and self.blocks[i] == block_number: continue
+                self.blocks.insert(i, block_number)
+                self.timestamps.insert(i, timestamp)
+                new_rows.append((block_number, timestamp))
+            if new_rows:
+                self.conn.executemany("INSERT OR IGNORE INTO block_anchors VALUES (?, ?)", new_rows)
+                if len(self.blocks) > self.max_anchors: self._thin()
+                self.conn.commit()
+        self._run_locked(_learn)
+
+    def _thin(self):
+        # Keep the newer half intact and every other anchor of the older half; old ranges need less precision
+        half = len(self.blocks) // 2
+        dropped = self.blocks[1:half:2]
+        self.blocks = self.blocks[:half:2] + self.blocks[half:]
+        self.timestamps = self.timestamps[:half:2] + self.timestamps[half:]
+        self.conn.executemany("DELETE FROM block_anchors WHERE block_number = ?", [(b,) for b in dropped])
+
+    def _blocks_per_second(self):
+        # Measured over roughly the last hour of anchors, falling back to the nominal BSC block rate
+        if len(self.blocks) >= 2:
+            last = len(self.blocks) - 1
+            k = max(0, min(bisect.bisect_left(self.timestamps, self.timestamps[last] - 3600), last - 1))
+            elapsed = self.timestamps[last] - self.timestamps[k]
+            if elapsed >= 60: return max((self.blocks[last] - self.blocks[k]) / elapsed, BSC_BLOCKS_PER_SECOND / 4)
+        return BSC_BLOCKS_PER_SECOND
+
+    def bounds(self, timestamp):
+        # (lower, upper) for the last block with time <= timestamp, or None without anchors. lower is always
+        # an existing block minus slack, so it is also safe as a "chain head is at least here" value.
+        def _bounds():
+            if not self.blocks: return None
+            slack = BLOCK_RESOLVER_SLACK_BLOCKS
+            i = bisect.bisect_right(self.timestamps, timestamp) - 1 # Last anchor at or before timestamp
+            j = i + 1 # First anchor after timestamp
+            rate = self._blocks_per_second() * 1.1
+            if i < 0:
+                lower = self.blocks[j] - math.ceil((self.timestamps[j] - timestamp) * rate) - slack
+                upper = self.blocks[j] - 1 + slack
+            elif j >= len(self.blocks):
+                lower = self.blocks[i] - slack
+                upper = self.blocks[i] + math.ceil((timestamp - self.timestamps[i]) * rate) + slack
+            else:
+                lower = self.blocks[i] - slack
+                upper = self.blocks[j] - 1 + slack
+            return max(0, lower), upper
+        return self._run_locked(_bounds)
+
+    def exact_timestamps(self, block_numbers):
+        # {block: timestamp} for the blocks that are anchors themselves
+        def _exact():
+            found = {}
+            for block_number in block_numbers:
+                i = bisect.bisect_left(self.blocks, block_number)
+                if i < len(self.blocks) and self.blocks[i] == block_number: found[block_number] = self.timestamps[i]
+            return found
+        return self._run_locked(_exact, {})
+
+    def get_boundary(self, timestamp, closest):
+        return self._run_locked(lambda: self.boundaries.get((timestamp, closest)))
+
+    def remember_boundary(self, timestamp, closest, block_number):
+        def _remember():
+            self.boundaries[(timestamp, closest)] = block_number
+            self.conn.execute("INSERT OR REPLACE INTO block_boundaries VALUES (?, ?, ?)", (timestamp, closest, block_number))
+            self.conn.commit()
+        self._run_locked(_remember)
+
+    def stats(self):
+        return {"anchors": len(self.blocks), "index_answers": self.index_answers, "api_lookups": self.api_lookups}
+
+
+block_timestamp_resolver = BlockTimestampResolver(BSC_CACHE_DB_PATH, BLOCK_ANCHOR_MAX_COUNT)
+
+
+class TokenMetadataCache:
+    # Process-wide LRU of token metadata ({"name", "symbol", "decimals"}) with per-entry TTL, optionally
+    # backed by SQLite. Placeholder entries (lookup failed) get a short TTL so they are retried later.
+    # The SQLite table is pruned on every write: expired rows go, then the soonest-expiring ones past max_db_entries.
+    def __init__(self, max_entries, db_path=None, max_db_entries=TOKEN_METADATA_DB_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.max_db_entries = max_db_entries
+        self.entries = OrderedDict() # token_address -> (info, expires_at, is_placeholder)
+        self.lock = threading.Lock()
+        self.conn = None
+        self.hits = 0
+        self.misses = 0
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = open_cache_db_connection(self.db_path)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_metadata (token_address TEXT PRIMARY KEY, name TEXT, symbol TEXT, "
+                "decimals INTEGER NOT NULL, expires_at REAL NOT NULL, is_placeholder INTEGER NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS token_metadata_expires_at ON token_metadata (expires_at)")
+        return self.conn
+
+    def _entry(self, token_address):
+        # Returns (info, is_placeholder) for a live entry, loading it from disk on a memory miss
+        entry = self.entries.get(token_address)
+        if entry is None and self.db_path:
+            try:
+                row = self._connection().execute(
+                    "SELECT name, symbol, decimals, expires_at, is_placeholder FROM token_metadata WHERE token_address = ?",
+                    (token_address,)).fetchone()
+            except sqlite3.Error as e:
+                app.logger.warning(f"Token metadata cache read failed: {e}")
+                row = None
+            if row:
+                entry = ({"name": row[0], "symbol": row[1], "decimals": row[2]}, row[3], bool(row[4]))
+                self.entries[token_address] = entry
+        if entry is None: return None
+        if entry[1] < time.time():
+            del self.entries[token_address]
+            return None
+        self.entries.move_to_end(token_address)
+        return entry[0], entry[2]
+
+    def get(self, token_address, allow_placeholder=True):
+        entry = self.lookup(token_address, allow_placeholder)
+        return entry[0] if entry is not None else None
+
+    def lookup(self, token_address, allow_placeholder=True):
+        # Returns (info, is_placeholder), or None on a miss
+        with self.lock:
+            entry = self._entry(token_address.lower())
+            if entry is None or (entry[1] and not allow_placeholder):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def put(self, token_address, info, is_placeholder=False):
+        token_address = token_address.lower()
+        ttl = TOKEN_METADATA_PLACEHOLDER_TTL_SECONDS if is_placeholder else TOKEN_METADATA_TTL_SECONDS
+        expires_at = time.time() + ttl
+        with self.lock:
+            self.entries[token_address] = (info, expires_at, is_placeholder)
+            self.entries.move_to_end(token_address)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            if self.db_path:
+                try:
+                    conn = self._connection()
+                    conn.execute("INSERT OR REPLACE INTO token_metadata VALUES (?, ?, ?, ?, ?, ?)",
+                                 (token_address, info["name"], info["symbol"], info["decimals"], expires_at, int(is_placeholder)))
+                    conn.execute("DELETE FROM token_metadata WHERE expires_at < ?", (time.time(),))
+                    excess_rows = conn.execute("SELECT COUNT(*) FROM token_metadata").fetchone()[0] - self.max_db_entries
+                    if excess_rows > 0:
+                        conn.execute("DELETE FROM token_metadata WHERE token_address IN "
+                                     "(SELECT token_address FROM token_metadata ORDER BY expires_at LIMIT ?)", (excess_rows,))
+                    conn.commit()
+                except sqlite3.Error as e:
+                    app.logger.warning(f"Token metadata cache write failed: {e}")
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+token_info_cache = TokenMetadataCache(TOKEN_METADATA_CACHE_MAX_ENTRIES, BSC_CACHE_DB_PATH if TOKEN_METADATA_PERSIST else None)
+
+
+class BnbPriceSeries:
+    # Persistent BNB/USD price series. ensure_range() fills a time range with one CoinGecko market_chart/range
+    # call per BNB_PRICE_FETCH_CHUNK_SECONDS (nothing if the range is already cached); price_at() then
+    # interpolates between the two neighbouring points, so WBNB and native BNB legs are valued at the tx
+    # time instead of a daily price.
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.fetch_lock = threading.Lock() # Serializes range fetches so concurrent requests share one call
+        self.conn = None
+        self.timestamps = [] # Parallel sorted lists
+        self.prices = []
+        self.ranges = [] # Sorted, merged [start_ts, end_ts] intervals that have been fetched
+        self.retry_after = 0
+        self.hits = 0 # price_at() answered from the series
+        self.misses = 0 # no point close enough to the timestamp
+        self.api_calls = 0
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = open_cache_db_connection(self.db_path)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS bnb_prices (timestamp INTEGER PRIMARY KEY, price REAL NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS bnb_price_ranges (start_ts INTEGER NOT NULL, end_ts INTEGER NOT NULL)")
+            for timestamp, price in self.conn.execute("SELECT timestamp, price FROM bnb_prices ORDER BY timestamp"):
+                self.timestamps.append(timestamp)
+                self.prices.append(price)
+            for start_ts, end_ts in self.conn.execute("SELECT start_ts, end_ts FROM bnb_price_ranges ORDER BY start_ts"):
+                self._add_range(start_ts, end_ts)
+        return self.conn
+
+    def _add_range(self, start_ts, end_ts):
+        merged = []
+        for range_start, range_end in sorted(self.ranges + [[start_ts, end_ts]]):
+            if merged and range_start <= merged[-1][1]: merged[-1][1] = max(merged[-1][1], range_end)
+            else: merged.append([range_start, range_end])
+        self.ranges = merged
+
+    def _covers(self, start_ts, end_ts):
+        return any(range_start <= start_ts and end_ts <= range_end for range_start, range_end in self.ranges)
+
+    def ensure_range(self, start_ts, end_ts):
+        now = int(time.time())
+        end_ts = min(end_ts, now)
+        with self.fetch_lock:
+            try:
+                with self.lock:
+                    self._connection()
+                    if self._covers(start_ts, max(start_ts, end_ts - BNB_PRICE_REFRESH_SECONDS)): return
+            except sqlite3.Error as e:
+                app.logger.warning(f"BNB price cache read failed: {e}")
+            if now < self.retry_after: return
+
+            fetch_from = start_ts - BNB_PRICE_FETCH_PADDING_SECONDS
+            fetch_to = min(end_ts + BNB_PRICE_FETCH_PADDING_SECONDS, now)
+            for chunk_from in range(fetch_from, fetch_to, BNB_PRICE_FETCH_CHUNK_SECONDS):
+                chunk_to = min(chunk_from + BNB_PRICE_FETCH_CHUNK_SECONDS, fetch_to)
+                with self.lock:
+                    if self._covers(chunk_from, chunk_to): continue
+                if not self._fetch_range(chunk_from, chunk_to, now): return
+
+    def _fetch_range(self, fetch_from, fetch_to, now):
+        # One market_chart/range call; returns False if it failed. The span only counts as covered when the
+        # points came back close enough together for price_at(), otherwise later requests fetch it again.
+        self.api_calls += 1
+        try:
+            data = make_api_request_server(f"{COINGECKO_API_URL}/coins/binancecoin/market_chart/range",
+                                           {"vs_currency": "usd", "from": fetch_from, "to": fetch_to},
+                                           current_bsc_api_key=None, source="CoinGecko") # No BscScan key needed
+            points = {int(ms) // 1000: float(price) for ms, price in (data or {}).get("prices", [])}
+        except Exception as e:
+            app.logger.warning(f"BNB price range fetch failed: {e}")
+            points = None
+        if not points:
+            self.retry_after = now + BNB_PRICE_RETRY_SECONDS
+            return False
+        point_timestamps = sorted(points)
+        max_spacing = max((t1 - t0 for t0, t1 in zip(point_timestamps, point_timestamps[1:])), default=0)
+        if max_spacing > BNB_PRICE_MAX_GAP_SECONDS:
+            app.logger.warning(f"BNB prices for {fetch_from}-{fetch_to} are {max_spacing}s apart; range not marked as cached")
+
+        with self.lock:
+            merged = dict(zip(self.timestamps, self.prices))
+            merged.update(points)
+            self.timestamps = sorted(merged)
+            self.prices = [merged[timestamp] for timestamp in self.timestamps]
+            if max_spacing <= BNB_PRICE_MAX_GAP_SECONDS: self._add_range(fetch_from, fetch_to)
+            try:
+                conn = self._connection()
+                conn.executemany("INSERT OR REPLACE INTO bnb_prices VALUES (?, ?)", points.items())
+                conn.execute("DELETE FROM bnb_price_ranges")
+                conn.executemany("INSERT INTO bnb_price_ranges VALUES (?, ?)", self.ranges)
+                conn.commit()
+            except sqlite3.Error as e:
+                app.logger.warning(f"BNB price cache write failed: {e}")
+        return True
+
+    def price_at(self, timestamp):
+        # Linear interpolation between neighbouring points; the nearest point alone if only one side is close enough
+        if not timestamp: return None
+        with self.lock:
+            price = self._interpolate(timestamp)
+            if price is None: self.misses += 1
+            else: self.hits += 1
+            return price
+
+    def _interpolate(self, timestamp):
+        i = bisect.bisect_left(self.timestamps, timestamp)
+        before = i - 1 if i > 0 else None
+        after = i if i < len(self.timestamps) else None
+        if after is not None and self.timestamps[after] == timestamp: return self.prices[after]
+        if before is not None and timestamp - self.timestamps[before] > BNB_PRICE_MAX_GAP_SECONDS: before = None
+        if after is not None and self.timestamps[after] - timestamp > BNB_PRICE_MAX_GAP_SECONDS: after = None
+        if before is not None and after is not None:
+            t0, t1 = self.timestamps[before], self.timestamps[after]
+            return self.prices[before] + (self.prices[after] - self.prices[before]) * (timestamp - t0) / (t1 - t0)
+        if before is not None: return self.prices[before]
+        if after is not None: return self.prices[after]
+        return None
+
+    def stats(self):
+        return {"points": len(self.timestamps), "ranges": len(self.ranges), "hits": self.hits, "misses": self.misses, "api_calls": self.api_calls}
+
+
+bnb_price_series = BnbPriceSeries(BSC_CACHE_DB_PATH)
+
+
+class CachedResponse:
+    __slots__ = ("body_gzip", "etag", "final", "expires_at")
+
+    def __init__(self, body_gzip, etag, final, expires_at=None):
+        self.body_gzip = body_gzip
+        self.etag = etag
+        self.final = final
+        self.expires_at = expires_at # None for final results, which never change
+
+
+class AnalysisResultCache:
+    # Serialized, gzip-compressed /get_transactions responses keyed by (wallet, window start, window end).
+    # Final results (closed window, fully valued) are kept in an in-memory LRU and in SQLite, both bounded
+    # by size. Any other result is only reused from memory for open_window_ttl_seconds.
+    def __init__(self, db_path, max_memory_bytes, max_db_bytes, open_window_ttl_seconds):
+        self.db_path = db_path
+        self.max_memory_bytes = max_memory_bytes
+        self.max_db_bytes = max_db_bytes
+        self.open_window_ttl_seconds = open_window_ttl_seconds
+        self.entries = OrderedDict() # key -> CachedResponse, least recently used first
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.conn = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = open_cache_db_connection(self.db_path)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS analysis_results (cache_key TEXT PRIMARY KEY, etag TEXT NOT NULL, "
+                "body BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS analysis_results_last_access ON analysis_results (last_access)")
+        return self.conn
+
+    @staticmethod
+    def db_key(key):
+        return ":".join(str(part) for part in key)
+
+    def get(self, key, count_lookup=True):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at is not None and entry.expires_at <= time.time():
+                self._remove_locked(key)
+                entry = None
+            if entry is None:
+                entry = self._load_locked(key)
+                if entry is not None: self._remember_locked(key, entry)
+            if entry is None:
+                if count_lookup: self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            if count_lookup: self.hits += 1
+            return entry
+
+    def put(self, key, result, final):
+        # Serialized like jsonify so cached and uncached responses are byte-identical
+        body = app.json.dumps(result).encode("utf-8")
+        entry = CachedResponse(gzip.compress(body, compresslevel=6, mtime=0), '"' + hashlib.sha256(body).hexdigest()[:32] + '"',
+                               final, None if final else time.time() + self.open_window_ttl_seconds)
+        with self.lock:
+            self._remember_locked(key, entry)
+            if final: self._store_locked(key, entry)
+        return entry
+
+    def _remember_locked(self, key, entry):
+        self._remove_locked(key)
+        self.entries[key] = entry
+        self.memory_bytes += len(entry.body_gzip)
+        while self.memory_bytes > self.max_memory_bytes and len(self.entries) > 1:
+            self._remove_locked(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove_locked(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None: self.memory_bytes -= len(entry.body_gzip)
+
+    def _load_locked(self, key):
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT etag, body FROM analysis_results WHERE cache_key = ?", (self.db_key(key),)).fetchone()
+            if row is None: return None
+            conn.execute("UPDATE analysis_results SET last_access = ? WHERE cache_key = ?", (time.time(), self.db_key(key)))
+            conn.commit()
+            return CachedResponse(row[1], row[0], True)
+        except sqlite3.Error as e:
+            app.logger.warning(f"Result cache read failed, recomputing instead: {e}")
+            return None
+
+    def _store_locked(self, key, entry):
+        try:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO analysis_results VALUES (?, ?, ?, ?, ?)",
+                         (self.db_key(key), entry.etag, entry.body_gzip, len(entry.body_gzip), time.time()))
+            total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM analysis_results").fetchone()[0]
+            if total_bytes > self.max_db_bytes:
+                bytes_to_free = total_bytes - int(self.max_db_bytes * 0.9) # Evict down to 90%, like the receipt cache
+                victims = []
+                for cache_key, size in conn.execute("SELECT cache_key, size FROM analysis_results ORDER BY last_access"):
+                    victims.append((cache_key,))
+                    bytes_to_free -= size
+                    if bytes_to_free <= 0: break
+                conn.executemany("DELETE FROM analysis_results WHERE cache_key = ?", victims)
+                self.evictions += len(victims)
+            conn.commit()
+        except sqlite3.Error as e:
+            app.logger.warning(f"Result cache write failed: {e}")
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self.entries), "memory_bytes": self.memory_bytes}
+
+
+analysis_result_cache = AnalysisResultCache(BSC_CACHE_DB_PATH, RESULT_CACHE_MAX_MEMORY_BYTES, RESULT_CACHE_MAX_DB_BYTES,
+                                            RESULT_CACHE_OPEN_WINDOW_TTL_SECONDS)
+
+
+def collect_cache_metrics():
+    receipts = receipt_store.stats()
+    tokens = token_info_cache.stats()
+    prices = bnb_price_series.stats()
+    results = analysis_result_cache.stats()
+    return [
+        ("cache_lookups_total", "counter", "Cache lookups by cache and result; misses cost API calls.", [
+            ({"cache": "receipts", "result": "hit"}, receipts["hits"]), ({"cache": "receipts", "result": "miss"}, receipts["misses"]),
+            ({"cache": "token_metadata", "result": "hit"}, tokens["hits"]), ({"cache": "token_metadata", "result": "miss"}, tokens["misses"]),
+            ({"cache": "bnb_price", "result": "hit"}, prices["hits"]), ({"cache": "bnb_price", "result": "miss"}, prices["misses"]),
+            ({"cache": "block_anchors", "result": "hit"}, block_timestamp_resolver.index_answers),
+            ({"cache": "block_anchors", "result": "miss"}, block_timestamp_resolver.api_lookups),
+            ({"cache": "analysis_results", "result": "hit"}, results["hits"]), ({"cache": "analysis_results", "result": "miss"}, results["misses"]),
+        ]),
+        ("cache_evictions_total", "counter", "Entries evicted from size-bounded caches.", [
+            ({"cache": "receipts"}, receipts["evictions"]), ({"cache": "analysis_results"}, results["evictions"]),
+        ]),
+        ("cache_entries", "gauge", "Entries currently held in memory.", [
+            ({"cache": "token_metadata"}, tokens["entries"]), ({"cache": "bnb_price"}, prices["points"]),
+            ({"cache": "block_anchors"}, len(block_timestamp_resolver.blocks)),
+            ({"cache": "analysis_results"}, results["entries"]),
+        ]),
+        ("bnb_price_range_fetches_total", "counter", "CoinGecko price range fetches.", [({}, prices["api_calls"])]),
+    ]
+
+
+metrics.register_collector(collect_cache_metrics)
 
 app = Flask(__name__)
 
@@ -37,24 +978,70 @@ def hex_to_int(hex_string):
     try: return int(hex_string, 16)
     except: return None
 
-def decode_address_from_topic(topic):
-    if not topic or len(topic) < 64: return None
-    return "0x" + topic[-40:]
+def make_api_request_server(url, params, current_bsc_api_key, source="BscScan", is_proxied_block_request=False, json_payload=None):
+    # BscScan calls rotate over the API key pool (an explicit 'apikey' param is left alone).
+    # Transient failures are retried with jittered exponential backoff before the error reaches the caller.
+    # A json_payload is POSTed instead of a GET (JSON-RPC).
+    for attempt in range(API_MAX_RETRIES + 1):
+        request_params = dict(params)
+        api_key = None
+        endpoint = api_endpoint_label(url, params, json_payload)
+        wait_started = time.perf_counter()
+        if source == "BscScan" and 'apikey' not in params:
+            api_key = bscscan_api_key_pool.acquire(current_bsc_api_key)
+            request_params['apikey'] = api_key
+        else:
+            rate_limiter = api_rate_limiters.get(source)
+            if rate_limiter: rate_limiter.acquire()
+        request_started = time.perf_counter()
+        metrics.inc("rate_limit_wait_seconds_total", {"source": source}, request_started - wait_started)
 
-def make_api_request_server(url, params, current_bsc_api_key, source="BscScan", is_proxied_block_request=False):
-    # Modified to use passed API key
-    if source == "BscScan" and 'apikey' not in params:
-        params['apikey'] = current_bsc_api_key
+        outcome = "error"
+        try:
+            result = send_api_request_server(url, request_params, source, is_proxied_block_request, json_payload)
+            outcome = "ok"
+            return result
+        except TransientApiError as e:
+            outcome = "retryable"
+            if attempt >= API_MAX_RETRIES:
+                raise Exception(f"{e} (gave up after {attempt + 1} attempts)")
+        except InvalidApiKeyError:
+            # Otherwise only the calls that happen to rotate onto the bad key would fail, at random
+            if attempt >= API_MAX_RETRIES or not (api_key and bscscan_api_key_pool.mark_invalid(api_key, current_bsc_api_key)): raise
+            app.logger.warning(f"BscScan rejected API key ...{api_key[-4:]}; leaving it out of the rotation")
+            continue
+        finally:
+            labels = {"source": source, "endpoint": endpoint}
+            metrics.observe("api_request_duration_seconds", time.perf_counter() - request_started, labels)
+            metrics.inc("api_requests_total", dict(labels, outcome=outcome))
 
+        delay = min(API_RETRY_MAX_DELAY, API_RETRY_BASE_DELAY * (2 ** attempt)) * random.uniform(0.5, 1.5)
+        # Hold this key back so the pool prefers other keys while it cools down
+        if api_key: bscscan_api_key_pool.penalize(api_key, delay)
+        metrics.inc("api_retries_total", {"source": source, "endpoint": endpoint})
+        metrics.inc("api_retry_backoff_seconds_total", {"source": source}, delay)
+        time.sleep(delay)
+
+def send_api_request_server(url, params, source="BscScan", is_proxied_block_request=False, json_payload=None):
+    # Single attempt; raises TransientApiError for retryable failures and Exception for everything else
     try:
         # print(f"Backend Requesting ({source}): {url} with params keys: {list(params.keys())}")
-        response = requests.get(url, params=params, timeout=45)
+        if json_payload is not None:
+            response = http_session.post(url, json=json_payload, timeout=HTTP_TIMEOUT_SECONDS)
+        else:
+            response = http_session.get(url, params=params, timeout=HTTP_TIMEOUT_SECONDS)
         response.raise_for_status()
         data = response.json()
 
         if source == "BscScan":
             if is_proxied_block_request and isinstance(data.get("result"), str) and data.get("result") is None:
                  return None
+            if isinstance(data, dict) and data.get("status") == "0" and data.get("result") == [] and str(data.get("message", "")).startswith("No "):
+                return [] # "No transactions found" / "No records found" is an empty page, not an error
+            if isinstance(data, dict) and data.get("status") == "0" and "rate limit" in str(data.get("result", "")).lower():
+                raise TransientApiError(f"BscScan API Error: {data.get('message')} - {data.get('result')}")
+            if isinstance(data, dict) and data.get("status") == "0" and "invalid api key" in str(data.get("result", "")).lower():
+                raise InvalidApiKeyError(f"BscScan API Error: {data.get('message')} - {data.get('result')}")
             if isinstance(data, dict) and data.get("status") == "0":
                 # print(f"  BscScan API Error ({params.get('action', params.get('module'))}): {data.get('message')} - {data.get('result')}")
                 # Instead of printing, we might want to raise an exception or return an error structure
@@ -63,7 +1050,12 @@ def make_api_request_server(url, params, current_bsc_api_key, source="BscScan",
         return data
     except requests.exceptions.HTTPError as e:
         # print(f"  HTTP error ({source}) for {params.get('action', params.get('module'))}: {e}, Response: {response.text if 'response' in locals() else 'N/A'}")
-        raise Exception(f"HTTP error for {source}: {e} (Status: {e.response.status_code if e.response else 'N/A'})")
+        status_code = e.response.status_code if e.response is not None else None
+        message = f"HTTP error for {source}: {e} (Status: {status_code if status_code is not None else 'N/A'})"
+        if status_code == 429 or (status_code is not None and status_code >= 500): raise TransientApiError(message)
+        raise Exception(message)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        raise TransientApiError(f"Request error for {source}: {e}")
     except requests.exceptions.RequestException as e:
         # print(f"  Request error ({source}): {e}")
         raise Exception(f"Request error for {source}: {e}")
@@ -72,88 +1064,150 @@ def make_api_request_server(url, params, current_bsc_api_key, source="BscScan",
         raise Exception(f"JSON decode error for {source}: {e}")
     # Removed return None from general exceptions to ensure errors are propagated
 
+KNOWN_TOKEN_INFO = {
+    ZKJ_ADDRESS: {"name": "ZKJ", "symbol": "ZKJ", "decimals": 18},
+    WBNB_ADDRESS: {"name": "Wrapped BNB", "symbol": "WBNB", "decimals": 18},
+    USDT_ADDRESS: {"name": "Tether USD", "symbol": "USDT", "decimals": 18},
+    BUSD_ADDRESS: {"name": "BUSD Token", "symbol": "BUSD", "decimals": 18},
+}
+ERC20_NAME_SELECTOR = "0x06fdde03"
+ERC20_SYMBOL_SELECTOR = "0x95d89b41"
+ERC20_DECIMALS_SELECTOR = "0x313ce567"
+
+def decode_abi_string(result_hex):
+    # ABI-encoded `string` return value, or the legacy bytes32 form some older tokens use
+    if not isinstance(result_hex, str) or not result_hex.startswith("0x") or len(result_hex) < 66: return None
+    try:
+        raw = bytes.fromhex(result_hex[2:])
+        if len(raw) >= 64:
+            offset = int.from_bytes(raw[0:32], "big")
+            if offset + 32 <= len(raw):
+                length = int.from_bytes(raw[offset:offset + 32], "big")
+                if offset + 32 + length <= len(raw):
+                    return raw[offset + 32:offset + 32 + length].decode("utf-8", errors="replace").strip() or None
+        return raw[:32].rstrip(b"\x00").decode("utf-8", errors="replace").strip() or None
+    except ValueError:
+        return None
+
+def eth_call_server(contract_address, call_data, current_bsc_api_key):
+    return chain_data_source.eth_call(contract_address, call_data, current_bsc_api_key)
+
+def fetch_token_metadata_onchain_server(token_address, current_bsc_api_key):
+    # Returns (info, is_placeholder). decimals is what matters for amounts, so without it we fall back to placeholders.
+    def call(selector):
+        try: return eth_call_server(token_address, selector, current_bsc_api_key)
+        except Exception as e:
+            app.logger.warning(f"eth_call {selector} failed for {token_address}: {e}")
+            return None
+
+    decimals_hex, name_hex, symbol_hex = (call(selector) for selector in (ERC20_DECIMALS_SELECTOR, ERC20_NAME_SELECTOR, ERC20_SYMBOL_SELECTOR))
+    decimals = hex_to_int(decimals_hex) if decimals_hex and decimals_hex != "0x" else None
+    placeholder = {"name": f"Token ({token_address[-4:]})", "symbol": f"TKN-{token_address[-4:]}", "decimals": 18}
+    if decimals is None or decimals > 255:
+        app.logger.warning(f"Token info for {token_address} could not be read on-chain, using placeholders")
+        return placeholder, True
+    return {"name": decode_abi_string(name_hex) or placeholder["name"],
+            "symbol": decode_abi_string(symbol_hex) or placeholder["symbol"], "decimals": decimals}, False
+
+def prefetch_token_info_server(token_addresses, current_bsc_api_key):
+    # Resolves every uncached token in one concurrent pass (the API key pool and rate limiter bound the calls)
+    missing = [address for address in dict.fromkeys(a.lower() for a in token_addresses if a)
+               if address not in KNOWN_TOKEN_INFO and token_info_cache.get(address) is None]
+    if not missing: return
+    with ThreadPoolExecutor(max_workers=max(1, min(TOKEN_METADATA_FETCH_WORKERS, len(missing)))) as executor:
+        for address, (info, is_placeholder) in zip(missing, executor.map(
+                lambda address: fetch_token_metadata_onchain_server(address, current_bsc_api_key), missing)):
+            token_info_cache.put(address, info, is_placeholder=is_placeholder)
+
 def get_token_info_server(token_address, current_bsc_api_key):
-    # Modified to use passed API key and global cache
-    global token_info_cache
+    # Returns (info, is_placeholder) from known tokens, then the process-wide metadata cache, then an
+    # on-chain name/symbol/decimals lookup
     token_address_lower = token_address.lower()
 
-    if token_address_lower == ZKJ_ADDRESS:
-        return {"name": "ZKJ", "symbol": "ZKJ", "decimals": 18}
-    if token_address_lower in token_info_cache:
-        return token_info_cache[token_address_lower]
+    if token_address_lower in KNOWN_TOKEN_INFO:
+        return KNOWN_TOKEN_INFO[token_address_lower], False
+    entry = token_info_cache.lookup(token_address_lower)
+    if entry is not None:
+        return entry
 
     # print(f"    Backend: Fetching token info for: {token_address_lower}...")
-    time.sleep(TOKEN_INFO_API_DELAY) # Still respect delay
-    info = {}
-    # Prioritize known tokens to avoid unnecessary API calls or if BscScan API for general token info is unreliable
-    if token_address_lower == WBNB_ADDRESS: info = {"name": "Wrapped BNB", "symbol": "WBNB", "decimals": 18}
-    elif token_address_lower == USDT_ADDRESS: info = {"name": "Tether USD", "symbol": "USDT", "decimals": 18}
-    elif token_address_lower == BUSD_ADDRESS: info = {"name": "BUSD Token", "symbol": "BUSD", "decimals": 18}
-    else:
-        # Attempt BscScan API (Note: free tier might not have a reliable generic token info endpoint)
-        # For simplicity, this example relies on the pre-defined list or placeholders.
-        # A real app might try 'action=token' with 'contractaddress' or other PRO endpoints if available.
-        # As 'tokensupply' doesn't reliably give name/symbol for all, we'll use placeholders.
-        print(f"    Token info for {token_address_lower} not pre-defined. Using placeholders on server.")
-        info = {"name": f"Token ({token_address_lower[-4:]})", "symbol": f"TKN-{token_address_lower[-4:]}", "decimals": 18}
-
-    token_info_cache[token_address_lower] = info
-    return info
-
-
-def get_historical_bnb_price_server(date_str_ddmmyyyy):
-    # Uses global cache
-    global bnb_price_cache
-    if not date_str_ddmmyyyy: return None
-    if date_str_ddmmyyyy in bnb_price_cache:
-        return bnb_price_cache[date_str_ddmmyyyy]
-
-    # print(f"    Backend: Fetching BNB price for date: {date_str_ddmmyyyy} from CoinGecko...")
-    url = f"{COINGECKO_API_URL}/coins/binancecoin/history"
-    params = {"date": date_str_ddmmyyyy, "localization": "false"}
-    # CoinGecko doesn't need the user's BscScan API key
-    data = make_api_request_server(url, params, current_bsc_api_key=None, source="CoinGecko") # No BscScan key needed
-    time.sleep(COINGECKO_API_DELAY)
-
-    if data and data.get("market_data", {}).get("current_price", {}).get("usd") is not None:
-        price = data["market_data"]["current_price"]["usd"]
-        bnb_price_cache[date_str_ddmmyyyy] = price
-        # print(f"      BNB price on {date_str_ddmmyyyy}: ${price:.2f}")
-        return price
-    else:
-        # print(f"      Could not fetch BNB price for {date_str_ddmmyyyy}.")
-        bnb_price_cache[date_str_ddmmyyyy] = None
-        return None
+    info, is_placeholder = fetch_token_metadata_onchain_server(token_address_lower, current_bsc_api_key)
+    token_info_cache.put(token_address_lower, info, is_placeholder=is_placeholder)
+    return info, is_placeholder
+
 
 def get_block_number_by_timestamp_bsc_server(timestamp_utc_unix, closest_option, current_bsc_api_key):
-    # print(f"  Backend: Fetching block for ts {timestamp_utc_unix}, closest={closest_option}...")
-    params = {
-        "module": "block", "action": "getblocknobytime",
-        "timestamp": timestamp_utc_unix, "closest": closest_option
-    }
-    result = make_api_request_server(BSCSCAN_API_URL, params, current_bsc_api_key)
-    time.sleep(API_CALL_DELAY)
-    if result and isinstance(result, str) and result.isdigit():
-        return int(result)
-    # print(f"    Backend: Could not fetch block for ts {timestamp_utc_unix}. Result: {result}")
-    return None
+    # closest_option 'before': last block at or before the timestamp; 'after': first block at or after it
+    return chain_data_source.block_number_by_timestamp(timestamp_utc_unix, closest_option, current_bsc_api_key)
 
 
-def fetch_wallet_transactions_by_blockrange_server(wallet_address, start_block, end_block, current_bsc_api_key):
-    # print(f"\nBackend: Fetching txs for {wallet_address} from block {start_block} to {end_block}...")
+
+def resolve_block_range_server(start_timestamp_unix_utc, end_timestamp_unix_utc, current_bsc_api_key):
+    # Returns (start_block, end_block, confirmed_end_block). [start_block, end_block] covers every block in the
+    # window (callers still filter txs by timestamp); confirmed_end_block is an existing block no later than the
+    # window end, safe to use as the chain head for receipt caching and as an incremental-sync checkpoint.
+    resolver = block_timestamp_resolver
+
+    start_block = resolver.get_boundary(start_timestamp_unix_utc, 'after')
+    if start_block is None:
+        bounds = resolver.bounds(start_timestamp_unix_utc)
+        if bounds and bounds[1] - bounds[0] <= BLOCK_RESOLVER_MAX_UNCERTAINTY_BLOCKS:
+            start_block = bounds[0]
+            resolver.index_answers += 1
+        else:
+            start_block = get_block_number_by_timestamp_bsc_server(start_timestamp_unix_utc, 'after', current_bsc_api_key)
+            resolver.api_lookups += 1
+            if start_block is not None: resolver.learn([(start_timestamp_unix_utc, start_block)])
+        if start_block is not None: resolver.remember_boundary(start_timestamp_unix_utc, 'after', start_block)
+
+    end_block = resolver.get_boundary(end_timestamp_unix_utc, 'before')
+    confirmed_end_block = end_block
+    if end_block is None:
+        bounds = resolver.bounds(end_timestamp_unix_utc)
+        if bounds and bounds[1] - bounds[0] <= BLOCK_RESOLVER_MAX_UNCERTAINTY_BLOCKS:
+            confirmed_end_block, end_block = bounds
+            resolver.index_answers += 1
+        else:
+            end_block = get_block_number_by_timestamp_bsc_server(end_timestamp_unix_utc, 'before', current_bsc_api_key)
+            confirmed_end_block = end_block
+            resolver.api_lookups += 1
+            if end_block is not None:
+                resolver.learn([(end_timestamp_unix_utc, end_block)])
+                resolver.remember_boundary(end_timestamp_unix_utc, 'before', end_block)
+
+    return start_block, end_block, confirmed_end_block
+
+
+def receipt_cache_head_block(end_block, confirmed_end_block, end_timestamp_unix_utc):
+    # Chain head to measure receipt confirmation depth against. While the window is open only confirmed_end_block
+    # is known to exist. Once it has been closed for RESULT_CACHE_FINALITY_SECONDS the real head is far more than
+    # RECEIPT_CONFIRMATION_DEPTH past every block in it, so all of its receipts are final.
+    if time.time() >= end_timestamp_unix_utc + RESULT_CACHE_FINALITY_SECONDS:
+        return end_block + RECEIPT_CONFIRMATION_DEPTH
+    return confirmed_end_block
+
+
+def split_block_range(start_block, end_block, shard_count):
+    shard_count = max(1, min(shard_count, end_block - start_block + 1))
+    step = (end_block - start_block + 1) / shard_count
+    bounds = [start_block + round(i * step) for i in range(shard_count)] + [end_block + 1]
+    return [(bounds[i], bounds[i + 1] - 1) for i in range(shard_count)]
+
+def fetch_account_rows_shard_server(action, wallet_address, start_block, end_block, current_bsc_api_key):
+    # Pages one shard up to the API's result cap. Returns (rows, resume_block): resume_block is None when the
+    # shard is complete, otherwise rows stop before it and [resume_block, end_block] still has to be fetched.
     all_txs_in_range = []
     current_page = 1
-    max_offset = 1000 # Max 10000, but 1000 is safer for multiple pages
+    max_offset = ACCOUNT_LIST_PAGE_SIZE # Max 10000, but 1000 is safer for multiple pages
     
     while True:
         # print(f"  Backend: Fetching page {current_page}...")
         params = {
-            "module": "account", "action": "txlist", "address": wallet_address,
+            "module": "account", "action": action, "address": wallet_address,
             "startblock": start_block, "endblock": end_block,
             "page": current_page, "offset": max_offset, "sort": "asc",
         }
         transactions_page = make_api_request_server(BSCSCAN_API_URL, params, current_bsc_api_key)
-        time.sleep(API_CALL_DELAY)
 
         if transactions_page and isinstance(transactions_page, list):
             all_txs_in_range.extend(transactions_page)
@@ -163,129 +1217,844 @@ def fetch_wallet_transactions_by_blockrange_server(wallet_address, start_block,
         else:
             # print(f"  Backend: Error fetching page {current_page} or no more txs.")
             raise Exception(f"Failed to fetch transactions page {current_page} for wallet {wallet_address}") # Propagate error
-        if current_page > 20: # Safety break
-            # print("  Backend: Reached max page limit (20).")
-            break
-    return all_txs_in_range
-
-def get_bep20_transfers_and_classify_server(tx_hash, wallet_address_main, tx_date_for_price, tx_timestamp_unix, current_bsc_api_key):
-    # print(f"    Backend: Processing Tx Receipt: {tx_hash}...")
-    params_tx_receipt = {"module": "proxy", "action": "eth_getTransactionReceipt", "txhash": tx_hash}
-    receipt_data = make_api_request_server(BSCSCAN_API_URL, params_tx_receipt, current_bsc_api_key)
-    time.sleep(API_CALL_DELAY)
-
-    bep20_transfers = []
-    classification = {"type": "Other", "main_token_symbol": None, "main_token_quantity": 0.0, "main_token_address": None}
-    estimated_value = {"amount": None, "currency": None, "basis": "N/A"}
-
-    if not receipt_data or "logs" not in receipt_data:
-        # print(f"      Backend: No receipt/logs for {tx_hash}")
-        return bep20_transfers, classification, estimated_value
-
-    wallet_address_lower = wallet_address_main.lower()
-    sent_by_wallet = []
-    received_by_wallet = []
-
-    for log_entry in receipt_data.get("logs", []):
-        log_topics = log_entry.get("topics", [])
-        if log_topics and len(log_topics) == 3 and log_topics[0].lower() == BEP20_TRANSFER_EVENT_SIGNATURE:
+        if current_page * max_offset > ACCOUNT_LIST_RESULT_CAP:
+            # Result cap reached: keep whole blocks only and hand the rest of the shard back to be split
+            last_block = int(all_txs_in_range[-1]["blockNumber"])
+            if last_block <= start_block:
+                raise Exception(f"{action} for {wallet_address} has more than {ACCOUNT_LIST_RESULT_CAP} rows in block {start_block}")
+            return [row for row in all_txs_in_range if int(row["blockNumber"]) < last_block], last_block
+    return all_txs_in_range, None
+
+def fetch_account_rows_by_blockrange_server(action, wallet_address, start_block, end_block, current_bsc_api_key):
+    # Fetches every account/<action> row (txlist, tokentx, ...) in a block range. The range is split into
+    # ~1 day shards fetched in parallel; a shard that hits the result cap is split again from where it stopped.
+    # Shards never overlap, so rows come back in block order with nothing to deduplicate (tokentx rows have no
+    # logIndex, and a tx's identical transfers are separate rows).
+    rows_by_shard_start = {}
+    shards = split_block_range(start_block, end_block, math.ceil((end_block - start_block + 1) / ACCOUNT_LIST_SHARD_BLOCKS))
+    executor = ThreadPoolExecutor(max_workers=ACCOUNT_LIST_SHARD_WORKERS)
+    try:
+        pending = {executor.submit(fetch_account_rows_shard_server, action, wallet_address, shard_start, shard_end, current_bsc_api_key):
+                   (shard_start, shard_end) for shard_start, shard_end in shards}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                shard_start, shard_end = pending.pop(future)
+                rows, resume_block = future.result()
+                rows_by_shard_start[shard_start] = rows
+                if resume_block is None: continue
+                for sub_start, sub_end in split_block_range(resume_block, shard_end, 2):
+                    pending[executor.submit(fetch_account_rows_shard_server, action, wallet_address, sub_start, sub_end, current_bsc_api_key)] = \
+                        (sub_start, sub_end)
+    finally:
+        # On error, drop queued shards instead of spending API budget on a failed analysis
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return [row for shard_start in sorted(rows_by_shard_start) for row in rows_by_shard_start[shard_start]]
+
+class BscScanDataSource:
+    # Chain data from the BscScan REST API: account list queries, getblocknobytime and proxied receipts/eth_call.
+    # Every call goes through the API key pool and rate limiter, so throughput is bound by BscScan quota.
+    requires_api_key = True
+
+    def block_number_by_timestamp(self, timestamp_utc_unix, closest_option, current_bsc_api_key):
+        params = {"module": "block", "action": "getblocknobytime", "timestamp": timestamp_utc_unix, "closest": closest_option}
+        result = make_api_request_server(BSCSCAN_API_URL, params, current_bsc_api_key)
+        if result and isinstance(result, str) and result.isdigit():
+            return int(result)
+        return None
+
+    def wallet_transactions(self, wallet_address, start_block, end_block, current_bsc_api_key):
+        return fetch_account_rows_by_blockrange_server("txlist", wallet_address, start_block, end_block, current_bsc_api_key)
+
+    def wallet_token_transfers(self, wallet_address, start_block, end_block, current_bsc_api_key):
+        rows = fetch_account_rows_by_blockrange_server("tokentx", wallet_address, start_block, end_block, current_bsc_api_key)
+        return TransferLogBatch.from_tokentx_rows(wallet_address, rows)
+
+    def tx_receipt(self, tx_hash, current_bsc_api_key):
+        params_tx_receipt = {"module": "proxy", "action": "eth_getTransactionReceipt", "txhash": tx_hash}
+        return make_api_request_server(BSCSCAN_API_URL, params_tx_receipt, current_bsc_api_key)
+
+    def tx_receipts(self, tx_hashes, current_bsc_api_key, max_workers=RECEIPT_FETCH_WORKERS):
+        # Bounded worker pool; throughput is set by the shared BscScan rate limiter, not by per-call latency.
+        unique_hashes = list(dict.fromkeys(tx_hash for tx_hash in tx_hashes if tx_hash))
+        receipts_by_hash = {}
+        if not unique_hashes: return receipts_by_hash
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(unique_hashes))))
+        try:
+            future_to_hash = {executor.submit(self.tx_receipt, tx_hash, current_bsc_api_key): tx_hash for tx_hash in unique_hashes}
+            for future in as_completed(future_to_hash):
+                receipts_by_hash[future_to_hash[future]] = future.result()
+        finally:
+            # On error, drop queued fetches instead of spending API budget on a failed analysis
+            executor.shutdown(wait=True, cancel_futures=True)
+        return receipts_by_hash
+
+    def eth_call(self, contract_address, call_data, current_bsc_api_key):
+        params = {"module": "proxy", "action": "eth_call", "to": contract_address, "data": call_data, "tag": "latest"}
+        result = make_api_request_server(BSCSCAN_API_URL, params, current_bsc_api_key)
+        return result if isinstance(result, str) else None # JSON-RPC errors come back as a dict
+
+
+class JsonRpcDataSource:
+    # Chain data from a BSC JSON-RPC node. A wallet's activity is every ERC-20 Transfer log with the wallet as
+    # topic1 or topic2 (eth_getLogs over the block range); its txs, receipts and block timestamps are then
+    # fetched in batched requests. The API key is not used. Unlike txlist, the tx list misses the wallet's txs
+    # that move no tokens to or from it (plain BNB sends, approvals), since those leave no such log.
+    requires_api_key = False
+
+    def __init__(self, url):
+        self.url = url
+        self.lock = threading.Lock()
+        self.log_range_blocks = RPC_LOG_RANGE_BLOCKS # Shrinks to what the node accepts
+        self.log_cache = OrderedDict() # (wallet, start block, end block) -> (expires at, logs)
+
+    def call_batch(self, calls):
+        # calls: [(method, params)]. Returns [(result, error)] in the same order; a per-call JSON-RPC error is
+        # returned, not raised, so the caller can split or skip it. Chunks are sent in parallel.
+        chunks = [calls[i:i + RPC_BATCH_MAX_REQUESTS] for i in range(0, len(calls), RPC_BATCH_MAX_REQUESTS)]
+
+        def send(chunk):
+            payload = [{"jsonrpc": "2.0", "id": i, "method": method, "params": params} for i, (method, params) in enumerate(chunk)]
+            response = make_api_request_server(self.url, {}, None, source="RPC", json_payload=payload)
+            if not isinstance(response, list):
+                error = response.get("error") if isinstance(response, dict) else response
+                raise Exception(f"JSON-RPC batch rejected by {self.url}: {error}")
+            by_id = {item.get("id"): item for item in response if isinstance(item, dict)}
+            answers = []
+            for i in range(len(chunk)):
+                item = by_id.get(i, {"error": {"message": "no response in batch"}})
+                answers.append((item.get("result"), item.get("error")))
+            return answers
+
+        if len(chunks) <= 1:
+            return send(chunks[0]) if chunks else []
+        with ThreadPoolExecutor(max_workers=min(RPC_BATCH_WORKERS, len(chunks))) as executor:
+            return [answer for answers in executor.map(send, chunks) for answer in answers]
+
+    def call(self, method, params):
+        result, error = self.call_batch([(method, params)])[0]
+        if error is not None:
+            raise Exception(f"JSON-RPC {method} failed: {error.get('message') if isinstance(error, dict) else error}")
+        return result
+
+    def block_timestamps(self, block_numbers):
+        blocks = self.call_batch([("eth_getBlockByNumber", [hex(block_number), False]) for block_number in block_numbers])
+        timestamps = {}
+        for block_number, (block, error) in zip(block_numbers, blocks):
+            if error is not None or not block:
+                raise Exception(f"Block {block_number} not available from {self.url}: {error}")
+            timestamps[block_number] = int(block["timestamp"], 16)
+        return timestamps
+
+    def block_number_by_timestamp(self, timestamp_utc_unix, closest_option, current_bsc_api_key):
+        # Same answer as getblocknobytime, found by a k-ary search: each round probes RPC_BLOCK_SEARCH_PROBES
+        # blocks in one batch, and the anchor index's estimate is probed first so a good guess ends it quickly.
+        head = self.call("eth_getBlockByNumber", ["latest", False])
+        head_block, head_timestamp = int(head["number"], 16), int(head["timestamp"], 16)
+        if closest_option == 'before' and head_timestamp <= timestamp_utc_unix: return head_block
+        if closest_option == 'after' and head_timestamp < timestamp_utc_unix: return None
+
+        # Find the first block past the target ('before' answers the block below it): lo never is, hi always is
+        def is_past(block_timestamp):
+            return block_timestamp > timestamp_utc_unix if closest_option == 'before' else block_timestamp >= timestamp_utc_unix
+        lo, hi = -1, head_block
+        estimate = block_timestamp_resolver.bounds(timestamp_utc_unix)
+        probes = sorted({block for block in (estimate or ()) if 0 <= block < head_block})
+        while hi - lo > 1:
+            if not probes:
+                probe_count = min(RPC_BLOCK_SEARCH_PROBES, hi - lo - 1)
+                step = (hi - lo) / (probe_count + 1)
+                probes = sorted({min(hi - 1, lo + max(1, round(step * i))) for i in range(1, probe_count + 1)})
+            for block_number, block_timestamp in sorted(self.block_timestamps(probes).items()):
+                if is_past(block_timestamp):
+                    hi = min(hi, block_number)
+                    break
+                lo = max(lo, block_number)
+            probes = []
+        if closest_option == 'before': return hi - 1 if hi > 0 else None
+        return hi
+
+    def transfer_logs(self, wallet_address, start_block, end_block):
+        # Every ERC-20 Transfer log from or to the wallet in [start_block, end_block], in chain order. A range the
+        # node rejects (too many results, span too wide) is split in half and retried, and later queries start at
+        # that span. Cached briefly because an analysis asks for the tx list and the transfers separately.
+        wallet_address = wallet_address.lower()
+        cache_key = (wallet_address, start_block, end_block)
+        with self.lock:
+            cached = self.log_cache.get(cache_key)
+            if cached and cached[0] > time.monotonic():
+                self.log_cache.move_to_end(cache_key)
+                return cached[1]
+
+        wallet_topic = "0x" + "0" * 24 + wallet_address[2:]
+        topic_filters = ([BEP20_TRANSFER_EVENT_SIGNATURE, wallet_topic], [BEP20_TRANSFER_EVENT_SIGNATURE, None, wallet_topic])
+        shards = split_block_range(start_block, end_block, math.ceil((end_block - start_block + 1) / self.log_range_blocks))
+        pending = [(shard_start, shard_end, topics) for shard_start, shard_end in shards for topics in topic_filters]
+        logs_by_key = {}
+        while pending:
+            answers = self.call_batch([("eth_getLogs", [{"fromBlock": hex(shard_start), "toBlock": hex(shard_end), "topics": topics}])
+                                       for shard_start, shard_end, topics in pending])
+            retry = []
+            for (shard_start, shard_end, topics), (result, error) in zip(pending, answers):
+                if error is None and isinstance(result, list):
+                    for log_entry in result:
+                        if log_entry.get("removed") or len(log_entry.get("topics", [])) != 3: continue # ERC-721 Transfers have 4 topics
+                        # A transfer from the wallet to itself matches both filters
+                        logs_by_key[(log_entry["transactionHash"].lower(), log_entry["logIndex"])] = log_entry
+                    continue
+                if shard_start == shard_end:
+                    raise Exception(f"eth_getLogs failed for block {shard_start}: {error}")
+                with self.lock:
+                    self.log_range_blocks = max(1, min(self.log_range_blocks, (shard_end - shard_start + 1) // 2))
+                retry += [(sub_start, sub_end, topics) for sub_start, sub_end in split_block_range(shard_start, shard_end, 2)]
+            pending = retry
+
+        logs = sorted(logs_by_key.values(), key=lambda log_entry: (int(log_entry["blockNumber"], 16), int(log_entry["logIndex"], 16)))
+        with self.lock:
+            self.log_cache[cache_key] = (time.monotonic() + RPC_LOG_CACHE_TTL_SECONDS, logs)
+            while len(self.log_cache) > RPC_LOG_CACHE_MAX_ENTRIES: self.log_cache.popitem(last=False)
+        return logs
+
+    def wallet_transactions(self, wallet_address, start_block, end_block, current_bsc_api_key):
+        # txlist-shaped rows for the txs with a wallet Transfer log that the wallet sent or was called by, the
+        # same txs txlist returns (a third party's tx that only sends tokens to the wallet is left out).
+        # Finalized rows are kept in the receipt store, so a re-run only fetches txs it has not seen; for the
+        # others the tx, its receipt (also cached for the receipts ingestion mode) and the head go in one batch.
+        wallet_address = wallet_address.lower()
+        logs = self.transfer_logs(wallet_address, start_block, end_block)
+        tx_hashes = list(dict.fromkeys(log_entry["transactionHash"].lower() for log_entry in logs))
+        if not tx_hashes: return []
+        rows_by_hash = receipt_store.get_tx_summaries(tx_hashes)
+        missing_hashes = [tx_hash for tx_hash in tx_hashes if tx_hash not in rows_by_hash]
+        if missing_hashes: rows_by_hash.update(self._fetch_tx_summaries(missing_hashes, logs))
+
+        rows = [row for row in (rows_by_hash[tx_hash] for tx_hash in tx_hashes) if wallet_address in (row["from"], row["to"])]
+        rows.sort(key=lambda row: (int(row["blockNumber"]), int(row["transactionIndex"])))
+        return rows
+
+    def _fetch_tx_summaries(self, tx_hashes, logs):
+        missing = set(tx_hashes)
+        blocks = {int(log_entry["blockNumber"], 16) for log_entry in logs if log_entry["transactionHash"].lower() in missing}
+        block_timestamps = {int(log_entry["blockNumber"], 16): int(log_entry["blockTimestamp"], 16)
+                            for log_entry in logs if log_entry.get("blockTimestamp")} # Newer nodes include it in the log
+        block_timestamps.update(block_timestamp_resolver.exact_timestamps(sorted(blocks - set(block_timestamps))))
+        answers = self.call_batch([("eth_getTransactionByHash", [tx_hash]) for tx_hash in tx_hashes] +
+                                  [("eth_getTransactionReceipt", [tx_hash]) for tx_hash in tx_hashes] + [("eth_blockNumber", [])])
+        head_block = hex_to_int(answers[-1][0] or "") if answers[-1][1] is None else None
+        missing_blocks = sorted(blocks - set(block_timestamps))
+        if missing_blocks: block_timestamps.update(self.block_timestamps(missing_blocks))
+
+        rows_by_hash = {}
+        receipts_by_hash = {}
+        for tx_hash, (tx, tx_error), (receipt_data, _) in zip(tx_hashes, answers, answers[len(tx_hashes):]):
+            if tx_error is not None or not tx:
+                raise Exception(f"Transaction {tx_hash} not available from {self.url}: {tx_error}")
+            if receipt_data: receipts_by_hash[tx_hash] = receipt_data
+            block_number = int(tx["blockNumber"], 16)
+            rows_by_hash[tx_hash] = {
+                "blockNumber": str(block_number), "timeStamp": str(block_timestamps[block_number]), "hash": tx_hash,
+                "transactionIndex": str(int(tx.get("transactionIndex") or "0x0", 16)),
+                "from": (tx.get("from") or "").lower(), "to": (tx.get("to") or "").lower(), "value": str(int(tx.get("value") or "0x0", 16)),
+                "gasUsed": str(int(receipt_data["gasUsed"], 16)) if receipt_data and receipt_data.get("gasUsed") else None,
+                "isError": "1" if receipt_data and receipt_data.get("status") == "0x0" else "0",
+            }
+        # A row without its receipt has no gasUsed/isError yet, so it is not kept
+        receipt_store.put_many(receipts_by_hash, head_block)
+        receipt_store.put_tx_summaries([rows_by_hash[tx_hash] for tx_hash in receipts_by_hash], head_block)
+        return rows_by_hash
+
+    def wallet_token_transfers(self, wallet_address, start_block, end_block, current_bsc_api_key):
+        # The same transfers tokentx returns, from the same logs; logs carry no token metadata, so it is resolved
+        # for all new tokens in one concurrent pass up front
+        transfers_by_hash = defaultdict(list)
+        for log_entry in self.transfer_logs(wallet_address, start_block, end_block):
+            topics = log_entry["topics"]
+            try: raw_amount_int = int(log_entry.get("data"), 16)
+            except (TypeError, ValueError): raw_amount_int = None
+            transfers_by_hash[log_entry["transactionHash"].lower()].append(
+                (log_entry["address"].lower(), "0x" + topics[1][-40:].lower(), "0x" + topics[2][-40:].lower(), raw_amount_int))
+        prefetch_token_info_server({transfer[0] for transfers in transfers_by_hash.values() for transfer in transfers}, current_bsc_api_key)
+        transfer_batch = TransferLogBatch(wallet_address)
+        for tx_hash, transfers in transfers_by_hash.items():
+            transfer_batch.add_tx(tx_hash, transfers)
+        return transfer_batch
+
+    def tx_receipt(self, tx_hash, current_bsc_api_key):
+        return self.call("eth_getTransactionReceipt", [tx_hash])
+
+    def tx_receipts(self, tx_hashes, current_bsc_api_key):
+        unique_hashes = list(dict.fromkeys(tx_hash for tx_hash in tx_hashes if tx_hash))
+        answers = self.call_batch([("eth_getTransactionReceipt", [tx_hash]) for tx_hash in unique_hashes])
+        receipts_by_hash = {}
+        for tx_hash, (receipt_data, error) in zip(unique_hashes, answers):
+            if error is not None: raise Exception(f"JSON-RPC eth_getTransactionReceipt failed for {tx_hash}: {error}")
+            receipts_by_hash[tx_hash] = receipt_data
+        return receipts_by_hash
+
+    def eth_call(self, contract_address, call_data, current_bsc_api_key):
+        result = self.call("eth_call", [{"to": contract_address, "data": call_data}, "latest"])
+        return result if isinstance(result, str) else None
+
+
+def create_chain_data_source(name):
+    if name == "bscscan": return BscScanDataSource()
+    if name == "rpc": return JsonRpcDataSource(BSC_RPC_URL)
+    raise ValueError(f"Unknown BSC_DATA_SOURCE {name!r}; expected 'bscscan' or 'rpc'")
+
+
+chain_data_source = create_chain_data_source(BSC_DATA_SOURCE)
+
+def fetch_wallet_transactions_by_blockrange_server(wallet_address, start_block, end_block, current_bsc_api_key):
+    # txlist rows (hash, blockNumber, timeStamp, from, to, value, ...) for the wallet, in block order
+    return chain_data_source.wallet_transactions(wallet_address, start_block, end_block, current_bsc_api_key)
+
+def fetch_wallet_token_transfers_by_blockrange_server(wallet_address, start_block, end_block, current_bsc_api_key):
+    # Bulk BEP-20 ingestion: every transfer to/from the wallet in the range, decoded into a TransferLogBatch
+    return chain_data_source.wallet_token_transfers(wallet_address, start_block, end_block, current_bsc_api_key)
+
+def fetch_tx_receipt_server(tx_hash, current_bsc_api_key):
+    return chain_data_source.tx_receipt(tx_hash, current_bsc_api_key)
+
+def fetch_tx_receipts_concurrently_server(tx_hashes, current_bsc_api_key):
+    return chain_data_source.tx_receipts(tx_hashes, current_bsc_api_key)
+
+def get_tx_receipts_server(tx_hashes, current_bsc_api_key, chain_head_block=None):
+    # Receipt cache first; only misses go to the network, and confirmed ones are written back
+    receipts_by_hash = receipt_store.get_many(tx_hashes)
+    missing_hashes = [tx_hash for tx_hash in tx_hashes if tx_hash and tx_hash.lower() not in receipts_by_hash]
+    fetched = fetch_tx_receipts_concurrently_server(missing_hashes, current_bsc_api_key)
+    receipt_store.put_many(fetched, chain_head_block)
+    receipts_by_hash.update((tx_hash.lower(), receipt_data) for tx_hash, receipt_data in fetched.items())
+    return receipts_by_hash
+
+def iter_tx_receipts_in_order_server(tx_hashes, current_bsc_api_key, chain_head_block=None, max_workers=RECEIPT_FETCH_WORKERS):
+    # Yields (tx_hash, receipt) in input order while the pool keeps fetching ahead, so a caller can
+    # process the first tx as soon as its own receipt is in rather than after the whole batch.
+    cached = receipt_store.get_many(tx_hashes)
+    missing_hashes = list(dict.fromkeys(tx_hash for tx_hash in tx_hashes if tx_hash and tx_hash.lower() not in cached))
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing_hashes) or 1)))
+    pending_writes = {}
+    try:
+        futures = {tx_hash.lower(): executor.submit(fetch_tx_receipt_server, tx_hash, current_bsc_api_key) for tx_hash in missing_hashes}
+        for tx_hash in tx_hashes:
+            key = tx_hash.lower()
+            if key in cached:
+                yield tx_hash, cached[key]
+                continue
+            receipt_data = futures[key].result()
+            pending_writes[key] = receipt_data
+            if len(pending_writes) >= 64:
+                receipt_store.put_many(pending_writes, chain_head_block)
+                pending_writes = {}
+            yield tx_hash, receipt_data
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        receipt_store.put_many(pending_writes, chain_head_block)
+
+
+TX_TYPE_OTHER, TX_TYPE_BUY, TX_TYPE_SELL, TX_TYPE_SEND, TX_TYPE_RECEIVE, TX_TYPE_NO_TRANSFERS = range(6)
+TX_TYPE_NAMES = ("Other", "Buy", "Sell", "Send", "Receive", "Interaction / Native Tx") # Simplified types for frontend
+QUOTE_TOKEN_CURRENCIES = {USDT_ADDRESS: "USDT", BUSD_ADDRESS: "BUSD", WBNB_ADDRESS: "USDT (from WBNB)"}
+
+
+def token_numeric_amount(raw_amount_int, decimals):
+    if raw_amount_int is None or decimals is None: return 0.0
+    try: return raw_amount_int / (10**decimals)
+    except (TypeError, OverflowError): return 0.0
+
+
+class AddressIds(dict):
+    # Interns addresses as small ints: a hit is a plain dict lookup, a miss appends to .addresses
+    def __init__(self):
+        super().__init__()
+        self.addresses = []
+
+    def __missing__(self, address):
+        address_id = self[address] = len(self.addresses)
+        self.addresses.append(address)
+        return address_id
+
+
+class TransferLogBatch:
+    # The BEP-20 Transfer logs of many txs, decoded once into parallel arrays with one slot per transfer:
+    # token_ids, from_ids and to_ids (addresses interned as ids) and raw_amounts (ints; None where the log
+    # data is not a number). A tx's transfers occupy contiguous slots in log order, from tx_slot_starts[tx_id].
+    # classify() labels every tx from the wallet's side in one grouped pass over those arrays and values its
+    # quote leg; the bep20_token_transfers dicts and display strings are built by describe(), which is
+    # only called for txs that are actually returned.
+    def __init__(self, wallet_address):
+        self.wallet_address = wallet_address.lower()
+        self.address_ids = AddressIds()
+        self.addresses = self.address_ids.addresses
+        self.wallet_id = self.address_ids[self.wallet_address]
+        self.quote_token_ids = frozenset(self.address_ids[address] for address in QUOTE_TOKEN_ADDRESSES)
+        self.tx_ids_by_hash = {}
+        self.tx_slot_starts = array("l")
+        self.tx_decoded = bytearray() # 0 for txs without a receipt: their transfers are unknown, not empty
+        self.token_ids = array("l")
+        self.from_ids = array("l")
+        self.to_ids = array("l")
+        self.raw_amounts = []
+        # Per tx, filled by classify(); slots are -1 where there is no such leg
+        self.tx_types = array("b")
+        self.main_slots = array("l")
+        self.quote_slots = array("l")
+        self.quote_amounts = array("d")
+        self.token_infos = {} # token id -> (address, name, symbol, decimals, 10**decimals), resolved on first use
+        self.placeholder_token_ids = set() # Tokens whose metadata lookup failed; their amounts assume 18 decimals
+
+    @classmethod
+    def from_receipts(cls, wallet_address, tx_hashes, receipts_by_hash):
+        batch = cls(wallet_address)
+        for tx_hash in tx_hashes:
+            batch.add_receipt(tx_hash, receipts_by_hash.get(tx_hash.lower()))
+        return batch
+
+    @classmethod
+    def from_tokentx_rows(cls, wallet_address, rows):
+        # tokentx rows are per transfer; each tx's transfers are put in log order. A row repeated with the same
+        # logIndex is dropped, but rows without one (BscScan's tokentx has none) are all kept, since two identical
+        # transfers in one tx are both real. Token metadata from the payload seeds token_info_cache once per token.
+        rows_by_hash = defaultdict(list)
+        seen_log_indexes = set()
+        for row in rows:
+            tx_hash = row.get("hash", "").lower()
+            if not tx_hash: continue
+            log_index = str(row.get("logIndex", ""))
+            if log_index.isdigit():
+                if (tx_hash, int(log_index)) in seen_log_indexes: continue
+                seen_log_indexes.add((tx_hash, int(log_index)))
+            rows_by_hash[tx_hash].append(row)
+
+        batch = cls(wallet_address)
+        seeded_tokens = set()
+        for tx_hash, tx_rows in rows_by_hash.items():
+            tx_rows.sort(key=lambda r: int(r["logIndex"]) if str(r.get("logIndex", "")).isdigit() else 0) # Stable: API order without logIndex
+            transfers = []
+            for row in tx_rows:
+                token_addr = row.get("contractAddress", "").lower()
+                if not token_addr: continue
+                if token_addr not in seeded_tokens:
+                    if token_addr in KNOWN_TOKEN_INFO or token_info_cache.get(token_addr, allow_placeholder=False) is not None:
+                        seeded_tokens.add(token_addr)
+                    elif str(row.get("tokenDecimal", "")).isdigit():
+                        token_info_cache.put(token_addr, {"name": row.get("tokenName") or f"Token ({token_addr[-4:]})",
+                                                          "symbol": row.get("tokenSymbol") or f"TKN-{token_addr[-4:]}",
+                                                          "decimals": int(row["tokenDecimal"])})
+                        seeded_tokens.add(token_addr)
+                value = row.get("value", "")
+                transfers.append((token_addr, row.get("from", "").lower(), row.get("to", "").lower(),
+                                  int(value) if str(value).isdigit() else None))
+            batch.add_tx(tx_hash, transfers)
+        return batch
+
+    def add_tx(self, tx_hash, transfers):
+        # transfers: (token, from, to, raw amount) tuples with lowercase addresses, or None when unknown
+        tx_id = len(self.tx_slot_starts)
+        self.tx_ids_by_hash[tx_hash.lower()] = tx_id
+        self.tx_slot_starts.append(len(self.raw_amounts))
+        self.tx_decoded.append(transfers is not None)
+        address_ids = self.address_ids
+        for token_addr, from_addr, to_addr, raw_amount_int in transfers or ():
+            self.token_ids.append(address_ids[token_addr])
+            self.from_ids.append(address_ids[from_addr])
+            self.to_ids.append(address_ids[to_addr])
+            self.raw_amounts.append(raw_amount_int)
+        return tx_id
+
+    def add_receipt(self, tx_hash, receipt_data):
+        # Decodes straight into the slot arrays; no per-transfer tuples or dicts
+        if not receipt_data or "logs" not in receipt_data:
+            return self.add_tx(tx_hash, None)
+        tx_id = self.add_tx(tx_hash, ())
+        address_ids = self.address_ids
+        for log_entry in receipt_data["logs"]:
+            log_topics = log_entry.get("topics", [])
+            if len(log_topics) != 3: continue
+            signature = log_topics[0]
+            if signature != BEP20_TRANSFER_EVENT_SIGNATURE and signature.lower() != BEP20_TRANSFER_EVENT_SIGNATURE: continue
             token_addr = log_entry.get("address", "").lower()
-            from_addr = decode_address_from_topic(log_topics[1])
-            to_addr = decode_address_from_topic(log_topics[2])
+            from_topic, to_topic = log_topics[1], log_topics[2]
             raw_amount_hex = log_entry.get("data")
+            if not token_addr or not from_topic or len(from_topic) < 64 or not to_topic or len(to_topic) < 64 or raw_amount_hex is None: continue
+            try: raw_amount_int = int(raw_amount_hex, 16)
+            except (TypeError, ValueError): raw_amount_int = None
+            self.token_ids.append(address_ids[token_addr])
+            self.from_ids.append(address_ids["0x" + from_topic[-40:].lower()])
+            self.to_ids.append(address_ids["0x" + to_topic[-40:].lower()])
+            self.raw_amounts.append(raw_amount_int)
+        return tx_id
 
-            if not all([token_addr, from_addr, to_addr, raw_amount_hex is not None]): continue
-            
-            from_addr = from_addr.lower()
-            to_addr = to_addr.lower()
+    def token_info(self, token_id, current_bsc_api_key):
+        info = self.token_infos.get(token_id)
+        if info is None:
+            token_addr = self.addresses[token_id]
+            metadata, is_placeholder = get_token_info_server(token_addr, current_bsc_api_key)
+            if is_placeholder: self.placeholder_token_ids.add(token_id)
+            decimals = metadata.get("decimals")
+            try: divisor = 10**decimals
+            except TypeError: divisor = None
+            info = self.token_infos[token_id] = (token_addr, metadata["name"], metadata["symbol"], decimals, divisor)
+        return info
 
-            token_info = get_token_info_server(token_addr, current_bsc_api_key) # Pass API key if needed by underlying
-            raw_amount_int = hex_to_int(raw_amount_hex)
-            human_amount = 0.0
-            human_amount_str = "Error"
-            if raw_amount_int is not None and token_info.get("decimals") is not None:
-                try:
-                    human_amount = raw_amount_int / (10**token_info["decimals"])
-                    human_amount_str = f"{human_amount:.8f}".rstrip('0').rstrip('.') # Clean trailing zeros
-                except: human_amount_str = f"{raw_amount_int} (raw)"
-            
-            transfer = {
-                "token_address": token_addr, "token_name": token_info["name"],
-                "token_symbol": token_info["symbol"], "from": from_addr, "to": to_addr,
+    def slot_range(self, tx_id):
+        stop = self.tx_slot_starts[tx_id + 1] if tx_id + 1 < len(self.tx_slot_starts) else len(self.raw_amounts)
+        return self.tx_slot_starts[tx_id], stop
+
+    def transfer_count(self, tx_id):
+        start, stop = self.slot_range(tx_id)
+        return stop - start
+
+    def classify(self):
+        # Classifies the txs added since the last call in one pass over their slots. Per tx it records the
+        # first quote/main token sent and received by the wallet; Buy is quote out + main in, Sell is main out
+        # + quote in. Only quote legs resolve token metadata, and those are all in KNOWN_TOKEN_INFO.
+        first_tx, tx_count = len(self.tx_types), len(self.tx_slot_starts)
+        if first_tx == tx_count: return
+        wallet_id, quote_ids = self.wallet_id, self.quote_token_ids
+        token_ids, from_ids, to_ids = self.token_ids, self.from_ids, self.to_ids
+        slot_starts = self.tx_slot_starts[first_tx:]
+        slot_starts.append(len(self.raw_amounts))
+        for tx_id, start, stop in zip(range(first_tx, tx_count), slot_starts, slot_starts[1:]):
+            sent_quote = received_main = sent_main = received_quote = -1
+            sent_any = received_any = False
+            for slot in range(start, stop):
+                if from_ids[slot] == wallet_id:
+                    sent_any = True
+                    if token_ids[slot] in quote_ids:
+                        if sent_quote < 0: sent_quote = slot
+                    elif sent_main < 0: sent_main = slot
+                if to_ids[slot] == wallet_id:
+                    received_any = True
+                    if token_ids[slot] in quote_ids:
+                        if received_quote < 0: received_quote = slot
+                    elif received_main < 0: received_main = slot
+
+            main_slot = quote_slot = -1
+            if sent_quote >= 0 and received_main >= 0:
+                tx_type, main_slot, quote_slot = TX_TYPE_BUY, received_main, sent_quote
+            elif sent_main >= 0 and received_quote >= 0:
+                tx_type, main_slot, quote_slot = TX_TYPE_SELL, sent_main, received_quote
+            elif sent_any and not received_any:
+                tx_type = TX_TYPE_SEND
+            elif received_any and not sent_any:
+                tx_type = TX_TYPE_RECEIVE
+            elif start == stop and self.tx_decoded[tx_id]:
+                tx_type = TX_TYPE_NO_TRANSFERS
+            else:
+                tx_type = TX_TYPE_OTHER
+            quote_amount = 0.0
+            if quote_slot >= 0:
+                quote_amount = token_numeric_amount(self.raw_amounts[quote_slot], self.token_info(token_ids[quote_slot], None)[3])
+            self.tx_types.append(tx_type)
+            self.main_slots.append(main_slot)
+            self.quote_slots.append(quote_slot)
+            self.quote_amounts.append(quote_amount)
+
+    def transfer_rows(self, start, stop, current_bsc_api_key):
+        addresses, token_infos = self.addresses, self.token_infos
+        rows = []
+        for slot in range(start, stop):
+            token_id = self.token_ids[slot]
+            token_addr, token_name, token_symbol, decimals, divisor = token_infos.get(token_id) or self.token_info(token_id, current_bsc_api_key)
+            raw_amount_int = self.raw_amounts[slot]
+            if raw_amount_int is None or divisor is None:
+                human_amount, human_amount_str = token_numeric_amount(raw_amount_int, decimals), "Error"
+            else:
+                human_amount = raw_amount_int / divisor
+                human_amount_str = f"{human_amount:.8f}".rstrip('0').rstrip('.') # Clean trailing zeros
+            rows.append({
+                "token_address": token_addr, "token_name": token_name,
+                "token_symbol": token_symbol, "from": addresses[self.from_ids[slot]], "to": addresses[self.to_ids[slot]],
                 "raw_amount": str(raw_amount_int) if raw_amount_int is not None else "N/A",
-                "human_readable_amount": human_amount_str, "decimals": token_info.get("decimals"),
+                "human_readable_amount": human_amount_str, "decimals": decimals,
                 "numeric_amount": human_amount # For calculations
-            }
-            bep20_transfers.append(transfer)
+            })
+        return rows
 
-            if from_addr == wallet_address_lower: sent_by_wallet.append(transfer)
-            if to_addr == wallet_address_lower: received_by_wallet.append(transfer)
-    
-    # --- Transaction Classification & Value Estimation Logic (Simplified from previous version) ---
-    primary_sent_quote_token = next((t for t in sent_by_wallet if t['token_address'] in QUOTE_TOKEN_ADDRESSES), None)
-    primary_received_main_token = next((t for t in received_by_wallet if t['token_address'] not in QUOTE_TOKEN_ADDRESSES), None)
-    primary_sent_main_token = next((t for t in sent_by_wallet if t['token_address'] not in QUOTE_TOKEN_ADDRESSES), None)
-    primary_received_quote_token = next((t for t in received_by_wallet if t['token_address'] in QUOTE_TOKEN_ADDRESSES), None)
-
-    if primary_sent_quote_token and primary_received_main_token:
-        classification["type"] = f"Buy" # Simplified type for frontend
-        classification["main_token_symbol"] = primary_received_main_token['token_symbol']
-        classification["main_token_quantity"] = primary_received_main_token['numeric_amount']
-        classification["main_token_address"] = primary_received_main_token['token_address']
-        
-        quote_val = primary_sent_quote_token['numeric_amount']
-        basis_str = f"Sent {quote_val:.4f} {primary_sent_quote_token['token_symbol']}"
-        if primary_sent_quote_token['token_address'] == USDT_ADDRESS:
-            estimated_value = {"amount": str(quote_val), "currency": "USDT", "basis": basis_str}
-        elif primary_sent_quote_token['token_address'] == BUSD_ADDRESS:
-            estimated_value = {"amount": str(quote_val), "currency": "BUSD", "basis": basis_str}
-        elif primary_sent_quote_token['token_address'] == WBNB_ADDRESS:
-            bnb_price = get_historical_bnb_price_server(tx_date_for_price)
-            if bnb_price:
-                estimated_value = {"amount": str(quote_val * bnb_price), "currency": "USDT (from WBNB)", "basis": f"{basis_str} @ ${bnb_price:.2f}"}
-            else: estimated_value["basis"] = f"{basis_str}, BNB price N/A"
-
-    elif primary_sent_main_token and primary_received_quote_token:
-        classification["type"] = f"Sell" # Simplified type
-        classification["main_token_symbol"] = primary_sent_main_token['token_symbol']
-        classification["main_token_quantity"] = primary_sent_main_token['numeric_amount']
-        classification["main_token_address"] = primary_sent_main_token['token_address']
-
-        quote_val = primary_received_quote_token['numeric_amount']
-        basis_str = f"Received {quote_val:.4f} {primary_received_quote_token['token_symbol']}"
-        if primary_received_quote_token['token_address'] == USDT_ADDRESS:
-            estimated_value = {"amount": str(quote_val), "currency": "USDT", "basis": basis_str}
-        elif primary_received_quote_token['token_address'] == BUSD_ADDRESS:
-            estimated_value = {"amount": str(quote_val), "currency": "BUSD", "basis": basis_str}
-        elif primary_received_quote_token['token_address'] == WBNB_ADDRESS:
-            bnb_price = get_historical_bnb_price_server(tx_date_for_price)
-            if bnb_price:
-                estimated_value = {"amount": str(quote_val * bnb_price), "currency": "USDT (from WBNB)", "basis": f"{basis_str} @ ${bnb_price:.2f}"}
-            else: estimated_value["basis"] = f"{basis_str}, BNB price N/A"
-    
-    elif sent_by_wallet and not received_by_wallet:
-        classification["type"] = f"Send"
-    elif not sent_by_wallet and received_by_wallet:
-        classification["type"] = f"Receive"
-    elif not bep20_transfers:
-        classification["type"] = "Interaction / Native Tx"
-        
-    # print(f"      Backend: Tx {tx_hash[:10]} Classified: {classification['type']}. Val: {estimated_value.get('amount')}")
-    return bep20_transfers, classification, estimated_value
-
-
-def process_wallet_data(target_wallet_address, bsc_api_key):
-    # Clear caches for each new request if desired, or manage them for longer periods
-    global token_info_cache, bnb_price_cache
-    token_info_cache = {}
-    bnb_price_cache = {}
-
-# 定义北京时区 (UTC+8)
+    def describe(self, tx_hash, tx_timestamp_unix, current_bsc_api_key):
+        # Returns (bep20_transfers, classification, estimated_value, valuation_complete) for one tx. A hash the
+        # batch has never seen has no transfers; one added without a receipt classifies as "Other".
+        # valuation_complete is False when a transfer uses placeholder token metadata or the BNB price is missing.
+        if len(self.tx_types) < len(self.tx_slot_starts): self.classify()
+        classification = {"type": TX_TYPE_NAMES[TX_TYPE_NO_TRANSFERS], "main_token_symbol": None, "main_token_quantity": 0.0,
+                          "main_token_address": None, "main_token_raw_quantity": None, # Raw integer amount for the FIFO ledger
+                          "main_token_decimals": None}
+        estimated_value = {"amount": None, "currency": None, "basis": "N/A"}
+        tx_id = self.tx_ids_by_hash.get(tx_hash.lower())
+        if tx_id is None:
+            return [], classification, estimated_value, True
+
+        tx_type = self.tx_types[tx_id]
+        classification["type"] = TX_TYPE_NAMES[tx_type]
+        start, stop = self.slot_range(tx_id)
+        bep20_transfers = self.transfer_rows(start, stop, current_bsc_api_key)
+        placeholder_token_ids = self.placeholder_token_ids
+        valuation_complete = not placeholder_token_ids or placeholder_token_ids.isdisjoint(self.token_ids[start:stop])
+        if tx_type in (TX_TYPE_BUY, TX_TYPE_SELL):
+            main_transfer = bep20_transfers[self.main_slots[tx_id] - start]
+            classification["main_token_symbol"] = main_transfer['token_symbol']
+            classification["main_token_quantity"] = main_transfer['numeric_amount']
+            classification["main_token_address"] = main_transfer['token_address']
+            classification["main_token_raw_quantity"] = main_transfer['raw_amount']
+            classification["main_token_decimals"] = main_transfer['decimals']
+
+            quote_transfer = bep20_transfers[self.quote_slots[tx_id] - start]
+            quote_val = self.quote_amounts[tx_id]
+            basis_str = f"{'Sent' if tx_type == TX_TYPE_BUY else 'Received'} {quote_val:.4f} {quote_transfer['token_symbol']}"
+            currency = QUOTE_TOKEN_CURRENCIES[quote_transfer['token_address']]
+            if quote_transfer['token_address'] != WBNB_ADDRESS:
+                estimated_value = {"amount": str(quote_val), "currency": currency, "basis": basis_str}
+            else:
+                bnb_price = bnb_price_series.price_at(tx_timestamp_unix)
+                if bnb_price:
+                    estimated_value = {"amount": str(quote_val * bnb_price), "currency": currency, "basis": f"{basis_str} @ ${bnb_price:.2f}"}
+                else:
+                    estimated_value["basis"] = f"{basis_str}, BNB price N/A"
+                    valuation_complete = False
+        # print(f"      Backend: Tx {tx_hash[:10]} Classified: {classification['type']}. Val: {estimated_value.get('amount')}")
+        return bep20_transfers if self.tx_decoded[tx_id] else [], classification, estimated_value, valuation_complete
+
+class FifoLot:
+    # One open buy lot: the unsold raw token amount and the cost still attributed to it (fixed-point USDT)
+    __slots__ = ("raw_qty", "cost_scaled", "tx_hash", "timestamp")
+
+    def __init__(self, raw_qty, cost_scaled, tx_hash, timestamp):
+        self.raw_qty = raw_qty
+        self.cost_scaled = cost_scaled
+        self.tx_hash = tx_hash
+        self.timestamp = timestamp
+
+
+class FifoOrderError(ValueError):
+    # Raised by FifoLotLedger.apply_many for a tx older than one it has already applied
+    pass
+
+
+class FifoLotLedger:
+    # FIFO cost-basis engine. Quantities are raw integer token units and money is integer USDT scaled by
+    # 10**FIFO_USDT_DECIMALS, so a partial fill splits a lot's cost exactly and a lot is dropped when its raw
+    # amount reaches zero. Only open lots are held; matched trades are handed back to the caller, which
+    # decides whether to keep them, so memory follows open positions rather than the length of the history.
+    USDT_SCALE = 10 ** FIFO_USDT_DECIMALS
+
+    def __init__(self):
+        self.lots = {} # token_address -> deque of FifoLot, oldest first
+        self.tokens = {} # token_address -> (symbol, decimals)
+        self.realized_pnl_scaled = 0
+        self.realized_loss_scaled = 0
+        self.last_timestamp = None
+
+    def to_scaled_usdt(self, value):
+        return int((Decimal(str(value)) * self.USDT_SCALE).to_integral_value())
+
+    def apply(self, tx_hash, tx_timestamp_unix, classification_details, usdt_value):
+        # Returns the realized PnL of this tx (0.0 unless it is a Sell matched against earlier buys) and the trades it matched
+        tx_type = classification_details.get("type")
+        token_symbol = classification_details.get("main_token_symbol")
+        raw_qty_str = str(classification_details.get("main_token_raw_quantity") or "")
+        decimals = classification_details.get("main_token_decimals")
+        if tx_type not in ("Buy", "Sell") or not token_symbol or usdt_value <= 0 or decimals is None or not raw_qty_str.isdigit():
+            return 0.0, []
+        raw_qty = int(raw_qty_str)
+        value_scaled = self.to_scaled_usdt(usdt_value)
+        if raw_qty == 0 or value_scaled <= 0: return 0.0, []
+        token_address = classification_details.get("main_token_address") or token_symbol
+
+        if tx_type == "Buy":
+            self.tokens[token_address] = (token_symbol, decimals)
+            self.lots.setdefault(token_address, deque()).append(FifoLot(raw_qty, value_scaled, tx_hash, tx_timestamp_unix))
+            return 0.0, []
+
+        lots = self.lots.get(token_address)
+        if not lots: return 0.0, []
+        unit = 10 ** decimals
+        proceeds_pu_usdt = value_scaled * unit / (raw_qty * self.USDT_SCALE)
+        remaining_qty, remaining_proceeds = raw_qty, value_scaled
+        tx_pnl_scaled = 0
+        trades = []
+        while remaining_qty and lots:
+            lot = lots[0]
+            matched = min(remaining_qty, lot.raw_qty)
+            # Proportional integer splits; the last fragment takes the remainder so totals are conserved
+            cost = lot.cost_scaled if matched == lot.raw_qty else lot.cost_scaled * matched // lot.raw_qty
+            proceeds = remaining_proceeds if matched == remaining_qty else remaining_proceeds * matched // remaining_qty
+            pnl = proceeds - cost
+            trades.append({
+                "token_symbol": token_symbol, "buy_tx_hash": lot.tx_hash, "sell_tx_hash": tx_hash,
+                "buy_timestamp": lot.timestamp, "sell_timestamp": tx_timestamp_unix,
+                "quantity_matched": round(matched / unit, 8),
+                "buy_cost_per_unit_usdt": round(cost * unit / (matched * self.USDT_SCALE), 4),
+                "sell_proceeds_per_unit_usdt": round(proceeds_pu_usdt, 4),
+                "pnl": round(pnl / self.USDT_SCALE, 2)
+            })
+            # Running totals, so the summary never re-sums the trade log
+            tx_pnl_scaled += pnl
+            self.realized_pnl_scaled += pnl
+            if pnl < 0: self.realized_loss_scaled += pnl
+            lot.raw_qty -= matched
+            lot.cost_scaled -= cost
+            if lot.raw_qty == 0: lots.popleft()
+            remaining_qty -= matched
+            remaining_proceeds -= proceeds
+        if not lots: del self.lots[token_address]
+        return tx_pnl_scaled / self.USDT_SCALE, trades
+
+    def apply_many(self, sorted_txs):
+        # Applies (tx_hash, timestamp, classification_details, usdt_value, payload) tuples in time order and
+        # yields (payload, pnl, trades) per tx, pulling the next tx only after the previous one is consumed,
+        # so a long history streams through without buffering. payload is the caller's own per-tx data.
+        for tx_hash, tx_timestamp_unix, classification_details, usdt_value, payload in sorted_txs:
+            if self.last_timestamp is not None and tx_timestamp_unix < self.last_timestamp:
+                raise FifoOrderError(f"FIFO ledger input is not sorted by time at {tx_hash}")
+            self.last_timestamp = tx_timestamp_unix
+            pnl, trades = self.apply(tx_hash, tx_timestamp_unix, classification_details, usdt_value)
+            yield payload, pnl, trades
+
+    def realized_pnl_usdt(self):
+        return self.realized_pnl_scaled / self.USDT_SCALE
+
+    def realized_loss_usdt(self):
+        return self.realized_loss_scaled / self.USDT_SCALE
+
+    def outstanding_holdings(self):
+        # Open lots grouped by token symbol, in the shape the frontend renders
+        holdings = {}
+        for token_address, lots in self.lots.items():
+            token_symbol, decimals = self.tokens[token_address]
+            unit = 10 ** decimals
+            holdings.setdefault(token_symbol, []).extend({
+                "qty": lot.raw_qty / unit, "cost_pu_usdt": lot.cost_scaled * unit / (lot.raw_qty * self.USDT_SCALE),
+                "tx_hash_buy": lot.tx_hash, "timestamp_buy": lot.timestamp
+            } for lot in lots)
+        return holdings
+
+
+class WalletAnalysisState:
+    # Running state of one wallet's analysis for one time window. A fresh instance is used for a
+    # full rebuild; in incremental sync mode it is kept as a checkpoint and new txs are applied on top.
+    def __init__(self, wallet_address, start_timestamp_unix_utc, keep_details=True, window_end_unix=None):
+        self.wallet_address = wallet_address
+        self.start_timestamp_unix_utc = start_timestamp_unix_utc
+        self.window_end_unix = window_end_unix # Requested (unclamped) window end; part of the checkpoint key
+        self.keep_details = keep_details # False when rows are streamed out instead of returned at the end
+        self.first_block = None
+        self.last_queried_block = None
+        self.last_synced_block = None # Checkpoint: every block up to here has been applied
+        self.processed_tx_hashes = set()
+        self.seen_block_range_hashes = set()
+        self.all_txs_in_block_range_count = 0
+        self.transactions = []
+        self.transaction_count = 0
+        self.incomplete_valuation_count = 0 # Txs valued without a BNB price or with placeholder token metadata
+        self.ledger = FifoLotLedger()
+        self.realized_trades_log = []
+        self.buy_transaction_count = 0
+        self.sell_transaction_count = 0
+        self.total_usdt_volume_buys = 0.0
+        self.total_usdt_volume_all_txs = 0.0
+        self.stage_seconds = defaultdict(float) # Timing breakdown of the current request, see begin_request()
+        self.request_started = None
+        self.lock = threading.Lock() # Serializes syncs of the same checkpoint
+
+    def begin_request(self):
+        # Checkpointed states live across requests; the timing breakdown is per request
+        self.stage_seconds = defaultdict(float)
+        self.request_started = time.perf_counter()
+
+    def timing_breakdown(self):
+        breakdown = {stage: round(seconds, 4) for stage, seconds in self.stage_seconds.items()}
+        if self.request_started is not None:
+            breakdown["total"] = round(time.perf_counter() - self.request_started, 4)
+        return breakdown
+
+    def apply_fifo_many(self, sorted_txs):
+        # FifoLotLedger.apply_many over the sync's tx stream; the ledger (and its time-order check) carries across syncs
+        for payload, tx_pnl_current_tx, new_trades in self.ledger.apply_many(sorted_txs):
+            if self.keep_details: self.realized_trades_log.extend(new_trades)
+            yield payload, tx_pnl_current_tx, new_trades
+
+    def record_transaction(self, tx_detail, valuation_complete=True):
+        if self.keep_details: self.transactions.append(tx_detail)
+        self.transaction_count += 1
+        if not valuation_complete: self.incomplete_valuation_count += 1
+        self.processed_tx_hashes.add(tx_detail["hash"].lower())
+
+        classification_type = tx_detail.get("classification_details",{}).get("type","Other")
+        if classification_type == "Buy": self.buy_transaction_count += 1 # Use exact match from classification
+        elif classification_type == "Sell": self.sell_transaction_count += 1
+
+        est_val = tx_detail.get("estimated_transaction_value_usdt_equivalent", {})
+        val_amount_str = est_val.get("amount")
+        if val_amount_str:
+            try:
+                val_float = float(val_amount_str)
+                if "USDT" in est_val.get("currency","") or est_val.get("currency") == "BUSD":
+                    self.total_usdt_volume_all_txs += val_float
+                    if classification_type == "Buy": self.total_usdt_volume_buys += val_float
+            except: pass
+
+    def build_result(self, start_datetime_beijing, end_datetime_beijing, start_datetime_utc, end_datetime_utc):
+        start_block, end_block = self.first_block, self.last_queried_block
+        return {
+            "summary": {
+                "wallet_address": self.wallet_address,
+                "time_window_beijing": f"{start_datetime_beijing.strftime('%Y-%m-%d %H:%M:%S')} to {end_datetime_beijing.strftime('%Y-%m-%d %H:%M:%S')} CST",
+                "time_window_utc": f"{start_datetime_utc.strftime('%Y-%m-%d %H:%M:%S')} to {end_datetime_utc.strftime('%Y-%m-%d %H:%M:%S')} UTC",
+                "block_range_queried": f"{start_block} - {end_block}" if start_block and end_block else "N/A",
+                "transactions_in_block_range_initially_fetched": self.all_txs_in_block_range_count,
+                "transactions_in_precise_time_window_processed": self.transaction_count,
+                "transactions_with_incomplete_valuation": self.incomplete_valuation_count,
+                "buy_transaction_count": self.buy_transaction_count,
+                "sell_transaction_count": self.sell_transaction_count,
+                "total_estimated_usdt_volume_all_txs_in_window": f"{self.total_usdt_volume_all_txs:.2f} USDT",
+                "total_estimated_usdt_volume_buys_in_window": f"{self.total_usdt_volume_buys:.2f} USDT",
+                "total_realized_pnl_from_trades_usdt (差值总和)": f"{self.ledger.realized_pnl_usdt():.2f} USDT",
+                "total_realized_loss_value_usdt (损耗值)": f"{abs(self.ledger.realized_loss_usdt()):.2f} USDT",
+                "data_generation_date_utc": datetime.now(dt_timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC'),
+                "timing_breakdown_seconds": self.timing_breakdown(),
+            },
+            # Copies: a checkpointed state keeps appending to its lists while this result is still held and serialized
+            "realized_trades_log_fifo": list(self.realized_trades_log), # Renamed for clarity
+            "transactions_in_time_window": list(self.transactions),
+            "outstanding_holdings_fifo": self.ledger.outstanding_holdings()
+        }
+
+
+class WalletSyncCheckpoints:
+    # Process-wide LRU of WalletAnalysisState checkpoints keyed by (wallet, window start, requested window end)
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_or_create(self, wallet_address, start_timestamp_unix_utc, window_end_unix=None):
+        key = (wallet_address.lower(), start_timestamp_unix_utc, window_end_unix)
+        with self.lock:
+            state = self.entries.get(key)
+            if state is None:
+                state = WalletAnalysisState(wallet_address, start_timestamp_unix_utc, window_end_unix=window_end_unix)
+                self.entries[key] = state
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return state
+
+    def discard(self, state):
+        key = (state.wallet_address.lower(), state.start_timestamp_unix_utc, state.window_end_unix)
+        with self.lock:
+            if self.entries.get(key) is state: del self.entries[key]
+
+
+wallet_sync_checkpoints = WalletSyncCheckpoints(WALLET_SYNC_MAX_CHECKPOINTS)
+
+
+def get_beijing_day_window_server(now_utc):
+    # 定义北京时区 (UTC+8)
     beijing_tz = dt_timezone(BEIJING_TIMEZONE_OFFSET)
     
-    # 获取当前时间（带UTC时区）
-    now_utc = datetime.now(dt_timezone.utc)
-    
     # 转换为北京时间
     now_beijing = now_utc.astimezone(beijing_tz)
     today_beijing = now_beijing.date()
@@ -310,182 +2079,981 @@ def process_wallet_data(target_wallet_address, bsc_api_key):
     # 如果结束时间超过当前时间，则使用当前时间作为结束
     if end_datetime_utc > now_utc:
         end_datetime_utc = now_utc
+
+    return start_datetime_beijing, end_datetime_beijing, start_datetime_utc, end_datetime_utc
+
+
+def parse_request_time_server(value):
+    # Unix seconds or an ISO 8601 string; a time without a UTC offset is Beijing time, like the default window
+    if isinstance(value, bool): raise ValueError(f"Invalid time value: {value!r}")
+    if isinstance(value, (int, float)) or (isinstance(value, str) and value.strip().isdigit()):
+        try: return datetime.fromtimestamp(int(value), dt_timezone.utc)
+        except (OverflowError, OSError, ValueError): raise ValueError(f"Time value out of range: {value!r}")
+    if isinstance(value, str):
+        try: parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        except ValueError: raise ValueError(f"Invalid time value: {value!r}")
+        return parsed.replace(tzinfo=dt_timezone(BEIJING_TIMEZONE_OFFSET)) if parsed.tzinfo is None else parsed
+    raise ValueError(f"Invalid time value: {value!r}")
+
+
+def get_analysis_window_server(now_utc, start_time=None, end_time=None):
+    # Same tuple as get_beijing_day_window_server. Without start_time it is today's Beijing window;
+    # otherwise [start_time, end_time or now), with the UTC end clamped to now like the default window.
+    if start_time is None and end_time is None:
+        return get_beijing_day_window_server(now_utc)
+    if start_time is None:
+        raise ValueError("start_time is required when end_time is given.")
+    beijing_tz = dt_timezone(BEIJING_TIMEZONE_OFFSET)
+    start_datetime_utc = parse_request_time_server(start_time).astimezone(dt_timezone.utc)
+    end_datetime_utc = parse_request_time_server(end_time).astimezone(dt_timezone.utc) if end_time is not None else now_utc
+    if start_datetime_utc >= min(end_datetime_utc, now_utc):
+        raise ValueError("start_time must be in the past and before end_time.")
+    if end_datetime_utc - start_datetime_utc > timedelta(days=ANALYSIS_MAX_RANGE_DAYS):
+        raise ValueError(f"The time range may span at most {ANALYSIS_MAX_RANGE_DAYS} days.")
+    return (start_datetime_utc.astimezone(beijing_tz), end_datetime_utc.astimezone(beijing_tz),
+            start_datetime_utc, min(end_datetime_utc, now_utc))
+
+
+def process_wallet_data(target_wallet_address, bsc_api_key, incremental=False, window=None, checkpoint_key=None):
+
+    # 获取当前时间（带UTC时区）
+    now_utc = datetime.now(dt_timezone.utc)
+    start_datetime_beijing, end_datetime_beijing, start_datetime_utc, end_datetime_utc = window or get_beijing_day_window_server(now_utc)
     
     start_timestamp_unix_utc = int(start_datetime_utc.timestamp())
     end_timestamp_unix_utc = int(end_datetime_utc.timestamp())
 
-    start_block = get_block_number_by_timestamp_bsc_server(start_timestamp_unix_utc, 'after', bsc_api_key)
-    end_block = get_block_number_by_timestamp_bsc_server(end_timestamp_unix_utc, 'before', bsc_api_key)
+    if incremental:
+        # Keyed by the requested end as well, so two ranges sharing a start never share a checkpoint. checkpoint_key
+        # is the request's params["key"], whose end is None for an open-ended range: its clamped end moves with
+        # every poll, and each poll must still resume the same checkpoint.
+        _, _, window_end_unix = checkpoint_key or (None, None, int(end_datetime_beijing.timestamp()))
+        state = wallet_sync_checkpoints.get_or_create(target_wallet_address, start_timestamp_unix_utc, window_end_unix)
+    else:
+        state = WalletAnalysisState(target_wallet_address, start_timestamp_unix_utc)
+
+    with state.lock:
+        state.begin_request()
+        resumed = state.last_synced_block is not None
+        try:
+            new_tx_count = sync_wallet_analysis_state(state, bsc_api_key, start_timestamp_unix_utc, end_timestamp_unix_utc)
+        except Exception as e:
+            # A half-applied sync would corrupt the FIFO ledger; drop the checkpoint so the next poll rebuilds it
+            if incremental: wallet_sync_checkpoints.discard(state)
+            # A tx older than the checkpoint's newest one (indexed after the previous sync) cannot be applied on
+            # top of it, so the window is rebuilt right away instead
+            if not (resumed and isinstance(e, FifoOrderError)): raise
+        else:
+            result = state.build_result(start_datetime_beijing, end_datetime_beijing, start_datetime_utc, end_datetime_utc)
+            if incremental: result["summary"]["new_transactions_this_sync"] = new_tx_count
+            record_analysis_metrics("incremental" if incremental else "full", result["summary"]["timing_breakdown_seconds"])
+            return result
+    app.logger.warning(f"Rebuilding the sync checkpoint of {target_wallet_address}: a late tx arrived out of time order")
+    return process_wallet_data(target_wallet_address, bsc_api_key, incremental=incremental, window=window, checkpoint_key=checkpoint_key)
+
 
-    all_transactions_details = []
-    asset_holdings_fifo = defaultdict(deque)
-    realized_trades_log = []
-    all_txs_in_block_range_count = 0
+def sync_wallet_analysis_state(state, bsc_api_key, start_timestamp_unix_utc, end_timestamp_unix_utc):
+    # Brings state up to end_timestamp_unix_utc and returns how many txs were applied
+    return sum(1 for event in iter_wallet_sync_events(state, bsc_api_key, start_timestamp_unix_utc, end_timestamp_unix_utc)
+               if event["event"] == "transaction")
+
+
+def iter_wallet_sync_events(state, bsc_api_key, start_timestamp_unix_utc, end_timestamp_unix_utc, prefetched=None):
+    # Applies new txs to state in chronological order and yields progress events as it goes: one
+    # "block_range" event, then a "transaction" event per tx (plus a "trades" event for each FIFO match).
+    # A fresh state covers the whole window; a checkpointed one only fetches blocks from its last synced block on.
+    # prefetched lets batch analysis pass in data it already fetched once for many wallets: "block_range"
+    # (as returned by resolve_block_range_server), "txs" (txlist rows), "transfer_batch" (a TransferLogBatch
+    # from tokentx) and "receipts_by_hash".
+    prefetched = prefetched or {}
+    target_wallet_address = state.wallet_address
+    stage_seconds = state.stage_seconds
+    with timed_stage(stage_seconds, "resolve_block_range"):
+        window_start_block, end_block, confirmed_end_block = prefetched.get("block_range") or \
+            resolve_block_range_server(start_timestamp_unix_utc, end_timestamp_unix_utc, bsc_api_key)
+    if state.last_synced_block is None:
+        start_block = window_start_block
+    else:
+        # Resume from the checkpoint block itself (deduped by hash below); it is a confirmed lower bound, not the last block queried
+        start_block = state.last_synced_block
 
     if start_block is None or end_block is None or start_block > end_block:
         raise Exception("Could not determine valid block range for the given time period.")
 
-    all_txs_in_block_range = fetch_wallet_transactions_by_blockrange_server(target_wallet_address, start_block, end_block, bsc_api_key)
-    all_txs_in_block_range_count = len(all_txs_in_block_range)
+    all_txs_in_block_range = prefetched.get("txs")
+    if all_txs_in_block_range is None:
+        with timed_stage(stage_seconds, "fetch_transactions"):
+            all_txs_in_block_range = fetch_wallet_transactions_by_blockrange_server(target_wallet_address, start_block, end_block, bsc_api_key)
+    # Every txlist row is an exact (timestamp, block) pair; a sample of them keeps the anchor index dense
+    block_timestamp_resolver.learn(
+        (int(tx["timeStamp"]), int(tx["blockNumber"])) for tx in all_txs_in_block_range[::50] + all_txs_in_block_range[-1:]
+        if str(tx.get("timeStamp", "")).isdigit() and str(tx.get("blockNumber", "")).isdigit())
     
     filtered_txs_in_time_window = [
         tx for tx in all_txs_in_block_range
-        if tx.get("timeStamp") and start_timestamp_unix_utc <= int(tx["timeStamp"]) < end_timestamp_unix_utc
+        if tx.get("hash") and tx.get("timeStamp") and start_timestamp_unix_utc <= int(tx["timeStamp"]) < end_timestamp_unix_utc
+        and tx["hash"].lower() not in state.processed_tx_hashes
     ]
 
-    if not filtered_txs_in_time_window:
-        # Return empty but valid structure if no transactions
-        pass # Processing loop won't run
-
-    for tx_summary in filtered_txs_in_time_window:
-        tx_hash = tx_summary.get("hash")
-        if not tx_hash: continue
-
-        tx_main_from_address = tx_summary.get("from", "").lower()
-        tx_timestamp_unix = int(tx_summary.get("timeStamp", 0))
-        tx_datetime_utc = datetime.fromtimestamp(tx_timestamp_unix, dt_timezone.utc) if tx_timestamp_unix else None
-        tx_timestamp_utc_str = tx_datetime_utc.strftime('%Y-%m-%d %H:%M:%S UTC') if tx_datetime_utc else "N/A"
-        tx_date_for_price = tx_datetime_utc.strftime('%d-%m-%Y') if tx_datetime_utc else None
-
-        bep20_list, classification_details, estimated_val_details = \
-            get_bep20_transfers_and_classify_server(tx_hash, target_wallet_address, tx_date_for_price, tx_timestamp_unix, bsc_api_key)
-        
-        tx_pnl_current_tx = 0.0
-        current_tx_usdt_value_float = 0.0
-        
-        if estimated_val_details.get("amount"):
-            try:
-                temp_val = float(estimated_val_details["amount"])
-                if estimated_val_details.get("currency") == "BUSD" or "USDT" in estimated_val_details.get("currency", ""):
-                    current_tx_usdt_value_float = temp_val
-            except: pass # Ignore parsing error for this specific calculation
-
-        if classification_details["type"] == "Buy" and classification_details["main_token_symbol"] and current_tx_usdt_value_float > 0:
-            token_sym = classification_details["main_token_symbol"]
-            qty_bought = classification_details["main_token_quantity"]
-            cost_total_usdt = current_tx_usdt_value_float
-            if qty_bought > 0:
-                cost_pu_usdt = cost_total_usdt / qty_bought
-                asset_holdings_fifo[token_sym].append({
-                    "qty": qty_bought, "cost_pu_usdt": cost_pu_usdt, 
-                    "tx_hash_buy": tx_hash, "timestamp_buy": tx_timestamp_unix
-                })
-
-        elif classification_details["type"] == "Sell" and classification_details["main_token_symbol"] and current_tx_usdt_value_float > 0:
-            token_sym = classification_details["main_token_symbol"]
-            qty_sold = classification_details["main_token_quantity"]
-            proceeds_total_usdt = current_tx_usdt_value_float
-            
-            if qty_sold > 0 and token_sym in asset_holdings_fifo and asset_holdings_fifo[token_sym]:
-                proceeds_pu_usdt = proceeds_total_usdt / qty_sold
-                qty_remaining_to_sell = qty_sold
-                
-                while qty_remaining_to_sell > 0 and asset_holdings_fifo[token_sym]:
-                    buy_lot = asset_holdings_fifo[token_sym][0]
-                    qty_from_lot = min(qty_remaining_to_sell, buy_lot["qty"])
-                    cost_basis_for_lot_portion = qty_from_lot * buy_lot["cost_pu_usdt"]
-                    pnl_for_lot_portion = (qty_from_lot * proceeds_pu_usdt) - cost_basis_for_lot_portion
-                    tx_pnl_current_tx += pnl_for_lot_portion
-
-                    realized_trades_log.append({
-                        "token_symbol": token_sym, "buy_tx_hash": buy_lot["tx_hash_buy"], "sell_tx_hash": tx_hash,
-                        "buy_timestamp": buy_lot["timestamp_buy"], "sell_timestamp": tx_timestamp_unix,
-                        "quantity_matched": round(qty_from_lot, 8),
-                        "buy_cost_per_unit_usdt": round(buy_lot["cost_pu_usdt"], 4),
-                        "sell_proceeds_per_unit_usdt": round(proceeds_pu_usdt, 4),
-                        "pnl": round(pnl_for_lot_portion, 2)
-                    })
-                    buy_lot["qty"] -= qty_from_lot
-                    if buy_lot["qty"] < 1e-9: asset_holdings_fifo[token_sym].popleft()
-                    qty_remaining_to_sell -= qty_from_lot
-
-        if estimated_val_details.get("amount") is None and tx_summary.get("value","0").isdigit() and int(tx_summary.get("value",0)) > 0:
-            native_bnb_amount = int(tx_summary.get("value")) / (10**18)
-            bnb_price = get_historical_bnb_price_server(tx_date_for_price)
-            if bnb_price:
-                estimated_val_details = {
-                    "amount": str(native_bnb_amount * bnb_price),
-                    "currency": "USDT (from native BNB)",
-                    "basis": f"{native_bnb_amount:.6f} native BNB @ ${bnb_price:.2f}"
-                }
-        
-        all_transactions_details.append({
-            "hash": tx_hash, "block_number": tx_summary.get("blockNumber"),
-            "timestamp_unix": tx_timestamp_unix, "timestamp_utc": tx_timestamp_utc_str,
-            "tx_from_address": tx_main_from_address, "tx_to_address": tx_summary.get("to", "").lower(),
-            "value_bnb_native": str(int(tx_summary.get("value",0))/(10**18)) if tx_summary.get("value","0").isdigit() else "0",
-            "gas_used": tx_summary.get("gasUsed"), "is_error": tx_summary.get("isError", "0") == "1",
-            "classification_details": classification_details,
-            "estimated_transaction_value_usdt_equivalent": estimated_val_details,
-            "realized_pnl_for_this_sell_tx_usdt": f"{tx_pnl_current_tx:.2f}" if classification_details["type"] == "Sell" else None,
-            "bep20_token_transfers": bep20_list,
-        })
-
-    total_realized_pnl_all_trades = sum(trade['pnl'] for trade in realized_trades_log)
-    total_loss_value_from_trades = sum(trade['pnl'] for trade in realized_trades_log if trade['pnl'] < 0)
-    buy_transaction_count = 0
-    sell_transaction_count = 0
-    total_usdt_volume_buys = 0.0
-    total_usdt_volume_all_txs = 0.0
-
-    for tx_detail in all_transactions_details:
-        classification_type = tx_detail.get("classification_details",{}).get("type","Other")
-        if classification_type == "Buy": buy_transaction_count += 1 # Use exact match from classification
-        elif classification_type == "Sell": sell_transaction_count += 1
+    # Only txs not fetched before count here, so the total stays a per-window figure across syncs
+    new_block_range_hashes = {tx.get("hash", "").lower() for tx in all_txs_in_block_range} - state.seen_block_range_hashes
+    state.all_txs_in_block_range_count += len(new_block_range_hashes)
+    state.seen_block_range_hashes |= new_block_range_hashes
+    del all_txs_in_block_range
+    if filtered_txs_in_time_window:
+        # At most one CoinGecko call per sync prices every WBNB/native BNB leg below (none once the range is cached)
+        tx_timestamps = [int(tx["timeStamp"]) for tx in filtered_txs_in_time_window]
+        with timed_stage(stage_seconds, "bnb_price_series"):
+            bnb_price_series.ensure_range(min(tx_timestamps), max(tx_timestamps))
 
-        est_val = tx_detail.get("estimated_transaction_value_usdt_equivalent", {})
-        val_amount_str = est_val.get("amount")
-        if val_amount_str:
+    yield {
+        "event": "block_range", "start_block": start_block, "end_block": end_block,
+        "block_range_queried": f"{start_block} - {end_block}",
+        "transactions_in_block_range_fetched": len(new_block_range_hashes),
+        "transactions_to_process": len(filtered_txs_in_time_window),
+    }
+
+    # Bulk tokentx is preferred; per-tx receipts (cached, fetched concurrently) are the fallback.
+    # Either way the transfers end up in one TransferLogBatch, classified in a grouped pass, and the
+    # FIFO/PnL pass below runs in chronological order.
+    transfer_batch = prefetched.get("transfer_batch")
+    receipts_by_hash = prefetched.get("receipts_by_hash")
+    ordered_receipts = None
+    if filtered_txs_in_time_window and transfer_batch is None and receipts_by_hash is None and TRANSFER_INGESTION_MODE == "tokentx":
+        try:
+            with timed_stage(stage_seconds, "fetch_token_transfers"):
+                transfer_batch = fetch_wallet_token_transfers_by_blockrange_server(target_wallet_address, start_block, end_block, bsc_api_key)
+        except Exception as e:
+            app.logger.warning(f"tokentx ingestion failed for {target_wallet_address}, falling back to receipts: {e}")
+
+    if transfer_batch is None and receipts_by_hash is not None:
+        with timed_stage(stage_seconds, "classify"):
+            transfer_batch = TransferLogBatch.from_receipts(
+                target_wallet_address, [tx["hash"] for tx in filtered_txs_in_time_window], receipts_by_hash)
+    elif transfer_batch is None:
+        # Receipts stream in tx order while the pool fetches ahead, so early rows do not wait for the last receipt;
+        # each one is appended to the batch as it arrives. end_block may be an upper-bound estimate past the
+        # head, so it only gates receipt caching once the window has closed.
+        transfer_batch = TransferLogBatch(target_wallet_address)
+        ordered_receipts = iter_tx_receipts_in_order_server(
+            [tx["hash"] for tx in filtered_txs_in_time_window], bsc_api_key,
+            chain_head_block=receipt_cache_head_block(end_block, confirmed_end_block, end_timestamp_unix_utc))
+    with timed_stage(stage_seconds, "classify"):
+        transfer_batch.classify()
+
+    def classified_txs():
+        # Receipt wait and classification per tx, in chronological order, as the ledger pulls them.
+        # Per-tx spans use perf_counter directly; the time spent suspended at a yield is not counted.
+        for tx_summary in filtered_txs_in_time_window:
+            tx_hash = tx_summary["hash"]
+            tx_timestamp_unix = int(tx_summary.get("timeStamp", 0))
+            stage_started = time.perf_counter()
+            if ordered_receipts is not None:
+                receipt_data = next(ordered_receipts)[1]
+                receipt_ready = time.perf_counter()
+                stage_seconds["fetch_receipts"] += receipt_ready - stage_started
+                stage_started = receipt_ready
+                transfer_batch.add_receipt(tx_hash, receipt_data)
+            bep20_list, classification_details, estimated_val_details, valuation_complete = \
+                transfer_batch.describe(tx_hash, tx_timestamp_unix, bsc_api_key)
+            stage_seconds["classify"] += time.perf_counter() - stage_started
+
+            current_tx_usdt_value_float = 0.0
+            if estimated_val_details.get("amount"):
+                try:
+                    temp_val = float(estimated_val_details["amount"])
+                    if estimated_val_details.get("currency") == "BUSD" or "USDT" in estimated_val_details.get("currency", ""):
+                        current_tx_usdt_value_float = temp_val
+                except: pass # Ignore parsing error for this specific calculation
+            yield (tx_hash, tx_timestamp_unix, classification_details, current_tx_usdt_value_float,
+                   (tx_summary, bep20_list, classification_details, estimated_val_details, valuation_complete))
+
+    def upstream_seconds():
+        return stage_seconds.get("fetch_receipts", 0.0) + stage_seconds.get("classify", 0.0)
+
+    try:
+        fifo_results = state.apply_fifo_many(classified_txs())
+        while True:
+            # One step pulls a tx through classified_txs(), which books its own time, and applies it to the ledger
+            step_started, upstream_before = time.perf_counter(), upstream_seconds()
+            step = next(fifo_results, None)
+            stage_seconds["fifo"] += time.perf_counter() - step_started - (upstream_seconds() - upstream_before)
+            if step is None: break
+            (tx_summary, bep20_list, classification_details, estimated_val_details, valuation_complete), tx_pnl_current_tx, new_trades = step
+            tx_hash = tx_summary["hash"]
+            tx_main_from_address = tx_summary.get("from", "").lower()
+            tx_timestamp_unix = int(tx_summary.get("timeStamp", 0))
+            tx_datetime_utc = datetime.fromtimestamp(tx_timestamp_unix, dt_timezone.utc) if tx_timestamp_unix else None
+            tx_timestamp_utc_str = tx_datetime_utc.strftime('%Y-%m-%d %H:%M:%S UTC') if tx_datetime_utc else "N/A"
+
+            if estimated_val_details.get("amount") is None and tx_summary.get("value","0").isdigit() and int(tx_summary.get("value",0)) > 0:
+                native_bnb_amount = int(tx_summary.get("value")) / (10**18)
+                bnb_price = bnb_price_series.price_at(tx_timestamp_unix)
+                if bnb_price:
+                    estimated_val_details = {
+                        "amount": str(native_bnb_amount * bnb_price),
+                        "currency": "USDT (from native BNB)",
+                        "basis": f"{native_bnb_amount:.6f} native BNB @ ${bnb_price:.2f}"
+                    }
+                else: valuation_complete = False
+
+            tx_detail = {
+                "hash": tx_hash, "block_number": tx_summary.get("blockNumber"),
+                "timestamp_unix": tx_timestamp_unix, "timestamp_utc": tx_timestamp_utc_str,
+                "tx_from_address": tx_main_from_address, "tx_to_address": tx_summary.get("to", "").lower(),
+                "value_bnb_native": str(int(tx_summary.get("value",0))/(10**18)) if tx_summary.get("value","0").isdigit() else "0",
+                "gas_used": tx_summary.get("gasUsed"), "is_error": tx_summary.get("isError", "0") == "1",
+                "classification_details": classification_details,
+                "estimated_transaction_value_usdt_equivalent": estimated_val_details,
+                "realized_pnl_for_this_sell_tx_usdt": f"{tx_pnl_current_tx:.2f}" if classification_details["type"] == "Sell" else None,
+                "bep20_token_transfers": bep20_list,
+            }
+            state.record_transaction(tx_detail, valuation_complete)
+            yield {"event": "transaction", "transaction": tx_detail}
+            if new_trades: yield {"event": "trades", "trades": new_trades}
+    finally:
+        # Closing the receipt iterator cancels queued fetches and flushes fetched receipts to the cache
+        if ordered_receipts is not None: ordered_receipts.close()
+
+    if state.first_block is None: state.first_block = start_block
+    state.last_queried_block = end_block
+    state.last_synced_block = max(confirmed_end_block, state.last_synced_block or 0)
+
+
+def process_wallet_batch_data(wallet_addresses, bsc_api_key, window=None):
+    # Analyses many wallets over the same window. Work that single-wallet requests would repeat is shared:
+    # the block range and the BNB price series are resolved once, txlist/tokentx pages are
+    # fetched in parallel, and receipts needed by several wallets are fetched once by tx hash.
+    now_utc = datetime.now(dt_timezone.utc)
+    start_datetime_beijing, end_datetime_beijing, start_datetime_utc, end_datetime_utc = window or get_beijing_day_window_server(now_utc)
+    start_timestamp_unix_utc = int(start_datetime_utc.timestamp())
+    end_timestamp_unix_utc = int(end_datetime_utc.timestamp())
+    batch_started = time.perf_counter()
+    stage_seconds = defaultdict(float) # Batch-level timing breakdown; each wallet result carries its own too
+
+    with timed_stage(stage_seconds, "resolve_block_range"):
+        block_range = resolve_block_range_server(start_timestamp_unix_utc, end_timestamp_unix_utc, bsc_api_key)
+    start_block, end_block, confirmed_end_block = block_range
+    if start_block is None or end_block is None or start_block > end_block:
+        raise Exception("Could not determine valid block range for the given time period.")
+
+    def fetch_wallet_inputs(wallet_address):
+        txs = fetch_wallet_transactions_by_blockrange_server(wallet_address, start_block, end_block, bsc_api_key)
+        transfer_batch = None
+        if TRANSFER_INGESTION_MODE == "tokentx" and txs:
             try:
-                val_float = float(val_amount_str)
-                if "USDT" in est_val.get("currency","") or est_val.get("currency") == "BUSD":
-                    total_usdt_volume_all_txs += val_float
-                    if classification_type == "Buy": total_usdt_volume_buys += val_float
-            except: pass
+                transfer_batch = fetch_wallet_token_transfers_by_blockrange_server(wallet_address, start_block, end_block, bsc_api_key)
+            except Exception as e:
+                app.logger.warning(f"tokentx ingestion failed for {wallet_address}, falling back to receipts: {e}")
+        return {"txs": txs, "transfer_batch": transfer_batch}
+
+    wallet_inputs = {}
+    wallet_errors = {}
+    with timed_stage(stage_seconds, "fetch_wallet_inputs"), \
+            ThreadPoolExecutor(max_workers=max(1, min(BATCH_WALLET_WORKERS, len(wallet_addresses)))) as executor:
+        future_to_wallet = {executor.submit(fetch_wallet_inputs, wallet_address): wallet_address for wallet_address in wallet_addresses}
+        for future in as_completed(future_to_wallet):
+            wallet_address = future_to_wallet[future]
+            try: wallet_inputs[wallet_address] = future.result()
+            except Exception as e: wallet_errors[wallet_address] = str(e)
+
+    # One receipt fetch per distinct tx hash, however many tracked wallets took part in it
+    receipt_hashes = []
+    for inputs in wallet_inputs.values():
+        if inputs["transfer_batch"] is None:
+            receipt_hashes.extend(tx.get("hash") for tx in inputs["txs"]
+                                  if tx.get("hash") and tx.get("timeStamp") and start_timestamp_unix_utc <= int(tx["timeStamp"]) < end_timestamp_unix_utc)
+    with timed_stage(stage_seconds, "fetch_receipts"):
+        receipts_by_hash = get_tx_receipts_server(list(dict.fromkeys(h.lower() for h in receipt_hashes)), bsc_api_key,
+                                                  chain_head_block=receipt_cache_head_block(end_block, confirmed_end_block, end_timestamp_unix_utc)) if receipt_hashes else {}
+    # Resolve metadata for every token these receipts touch in one concurrent pass before classifying
+    with timed_stage(stage_seconds, "token_metadata"):
+        prefetch_token_info_server([log_entry.get("address", "") for receipt in receipts_by_hash.values() if receipt
+                                    for log_entry in receipt.get("logs", [])
+                                    if log_entry.get("topics") and log_entry["topics"][0].lower() == BEP20_TRANSFER_EVENT_SIGNATURE], bsc_api_key)
+    # One price series for the whole window, so no wallet below needs its own CoinGecko call
+    if any(inputs["txs"] for inputs in wallet_inputs.values()):
+        with timed_stage(stage_seconds, "bnb_price_series"):
+            bnb_price_series.ensure_range(start_timestamp_unix_utc, end_timestamp_unix_utc)
 
+    wallet_results = {}
+    aggregate_states = []
+    for wallet_address in wallet_addresses:
+        if wallet_address in wallet_errors:
+            wallet_results[wallet_address] = {"error": wallet_errors[wallet_address]}
+            continue
+        inputs = wallet_inputs[wallet_address]
+        state = WalletAnalysisState(wallet_address, start_timestamp_unix_utc)
+        state.begin_request()
+        try:
+            with timed_stage(stage_seconds, "analyse_wallets"):
+                sum(1 for _ in iter_wallet_sync_events(state, bsc_api_key, start_timestamp_unix_utc, end_timestamp_unix_utc, prefetched={
+                    "block_range": block_range, "txs": inputs["txs"], "transfer_batch": inputs["transfer_batch"],
+                    "receipts_by_hash": receipts_by_hash if inputs["transfer_batch"] is None else None}))
+        except Exception as e:
+            app.logger.error(f"Batch analysis failed for {wallet_address}: {e}", exc_info=True)
+            wallet_results[wallet_address] = {"error": str(e)}
+            continue
+        wallet_results[wallet_address] = state.build_result(start_datetime_beijing, end_datetime_beijing, start_datetime_utc, end_datetime_utc)
+        aggregate_states.append(state)
+
+    total_realized_pnl = sum(state.ledger.realized_pnl_scaled for state in aggregate_states) / FifoLotLedger.USDT_SCALE
+    total_realized_loss = sum(state.ledger.realized_loss_scaled for state in aggregate_states) / FifoLotLedger.USDT_SCALE
+    timing_breakdown = {stage: round(seconds, 4) for stage, seconds in stage_seconds.items()}
+    timing_breakdown["total"] = round(time.perf_counter() - batch_started, 4)
+    record_analysis_metrics("batch", timing_breakdown)
     return {
-        "summary": {
-            "wallet_address": target_wallet_address,
+        "aggregate_summary": {
+            "wallet_count": len(wallet_addresses),
+            "wallets_failed": len(wallet_addresses) - len(aggregate_states),
             "time_window_beijing": f"{start_datetime_beijing.strftime('%Y-%m-%d %H:%M:%S')} to {end_datetime_beijing.strftime('%Y-%m-%d %H:%M:%S')} CST",
-            "time_window_utc": f"{start_datetime_utc.strftime('%Y-%m-%d %H:%M:%S')} to {end_datetime_utc.strftime('%Y-%m-%d %H:%M:%S')} UTC",
-            "block_range_queried": f"{start_block} - {end_block}" if start_block and end_block else "N/A",
-            "transactions_in_block_range_initially_fetched": all_txs_in_block_range_count,
-            "transactions_in_precise_time_window_processed": len(all_transactions_details),
-            "buy_transaction_count": buy_transaction_count,
-            "sell_transaction_count": sell_transaction_count,
-            "total_estimated_usdt_volume_all_txs_in_window": f"{total_usdt_volume_all_txs:.2f} USDT",
-            "total_estimated_usdt_volume_buys_in_window": f"{total_usdt_volume_buys:.2f} USDT",
-            "total_realized_pnl_from_trades_usdt (差值总和)": f"{total_realized_pnl_all_trades:.2f} USDT",
-            "total_realized_loss_value_usdt (损耗值)": f"{abs(total_loss_value_from_trades):.2f} USDT",
-            "data_generation_date_utc": datetime.now(dt_timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+            "block_range_queried": f"{start_block} - {end_block}",
+            "transactions_in_precise_time_window_processed": sum(state.transaction_count for state in aggregate_states),
+            "transactions_with_incomplete_valuation": sum(state.incomplete_valuation_count for state in aggregate_states),
+            "receipts_needed_after_cross_wallet_dedup": len(receipts_by_hash),
+            "buy_transaction_count": sum(state.buy_transaction_count for state in aggregate_states),
+            "sell_transaction_count": sum(state.sell_transaction_count for state in aggregate_states),
+            "total_estimated_usdt_volume_all_txs_in_window": f"{sum(state.total_usdt_volume_all_txs for state in aggregate_states):.2f} USDT",
+            "total_estimated_usdt_volume_buys_in_window": f"{sum(state.total_usdt_volume_buys for state in aggregate_states):.2f} USDT",
+            "total_realized_pnl_from_trades_usdt (差值总和)": f"{total_realized_pnl:.2f} USDT",
+            "total_realized_loss_value_usdt (损耗值)": f"{abs(total_realized_loss):.2f} USDT",
+            "data_generation_date_utc": datetime.now(dt_timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC'),
+            "timing_breakdown_seconds": timing_breakdown,
         },
-        "realized_trades_log_fifo": realized_trades_log, # Renamed for clarity
-        "transactions_in_time_window": all_transactions_details,
-        "outstanding_holdings_fifo": {token: list(lots) for token, lots in asset_holdings_fifo.items()}
+        "wallets": wallet_results,
     }
 
+def iter_wallet_data_events(target_wallet_address, bsc_api_key, window=None):
+    # Streaming counterpart of process_wallet_data: same analysis, but rows are yielded as they are
+    # classified and the state keeps only running totals, so memory does not grow with the window.
+    now_utc = datetime.now(dt_timezone.utc)
+    start_datetime_beijing, end_datetime_beijing, start_datetime_utc, end_datetime_utc = window or get_beijing_day_window_server(now_utc)
+    start_timestamp_unix_utc = int(start_datetime_utc.timestamp())
+    end_timestamp_unix_utc = int(end_datetime_utc.timestamp())
+
+    state = WalletAnalysisState(target_wallet_address, start_timestamp_unix_utc, keep_details=False)
+    state.begin_request()
+    yield from iter_wallet_sync_events(state, bsc_api_key, start_timestamp_unix_utc, end_timestamp_unix_utc)
+    result = state.build_result(start_datetime_beijing, end_datetime_beijing, start_datetime_utc, end_datetime_utc)
+    record_analysis_metrics("stream", result["summary"]["timing_breakdown_seconds"])
+    yield {"event": "summary", "summary": result["summary"], "outstanding_holdings_fifo": result["outstanding_holdings_fifo"]}
+
+
+def parse_decimal_string(value):
+    try: return float(value) if value is not None else None
+    except (TypeError, ValueError): return None
+
+
+# Columns served by the paginated table API; each maps a column name to its value in one result row
+TRANSACTION_TABLE_COLUMNS = {
+    "hash": lambda tx: tx.get("hash"),
+    "timestamp_unix": lambda tx: tx.get("timestamp_unix"),
+    "type": lambda tx: (tx.get("classification_details") or {}).get("type"),
+    "main_token_symbol": lambda tx: (tx.get("classification_details") or {}).get("main_token_symbol"),
+    "main_token_quantity": lambda tx: (tx.get("classification_details") or {}).get("main_token_quantity"),
+    "value_amount": lambda tx: parse_decimal_string((tx.get("estimated_transaction_value_usdt_equivalent") or {}).get("amount")),
+    "value_currency": lambda tx: (tx.get("estimated_transaction_value_usdt_equivalent") or {}).get("currency"),
+    "realized_pnl": lambda tx: parse_decimal_string(tx.get("realized_pnl_for_this_sell_tx_usdt")),
+    "from": lambda tx: tx.get("tx_from_address"),
+    "to": lambda tx: tx.get("tx_to_address"),
+    "transfer_count": lambda tx: len(tx.get("bep20_token_transfers") or []),
+}
+REALIZED_TRADE_TABLE_COLUMNS = {name: (lambda trade, name=name: trade.get(name)) for name in (
+    "token_symbol", "quantity_matched", "buy_cost_per_unit_usdt", "sell_proceeds_per_unit_usdt", "pnl",
+    "buy_tx_hash", "sell_tx_hash", "buy_timestamp", "sell_timestamp")}
+
+
+class ColumnarTable:
+    # Rows stored column by column. Each (sort, filter) view is a list of row indices computed once and
+    # reused, so paging through a view only touches the rows on the page.
+    MAX_VIEWS = 8
+
+    def __init__(self, column_getters, rows, filter_column=None):
+        self.columns = {name: [getter(row) for row in rows] for name, getter in column_getters.items()}
+        self.row_count = len(rows)
+        self.filter_column = filter_column
+        self.views = OrderedDict()
+        self.lock = threading.Lock()
+
+    def value_counts(self, column):
+        return dict(Counter(self.columns[column]))
+
+    def view(self, sort_by=None, descending=False, filter_values=None):
+        key = (sort_by, descending, tuple(sorted(filter_values)) if filter_values else None)
+        with self.lock:
+            order = self.views.get(key)
+            if order is not None:
+                self.views.move_to_end(key)
+                return order
+        order = list(range(self.row_count))
+        if sort_by:
+            values = self.columns[sort_by]
+            present = sorted((i for i in order if values[i] is not None), key=values.__getitem__, reverse=descending)
+            order = present + [i for i in order if values[i] is None] # Missing values last in either direction
+        if filter_values and self.filter_column:
+            allowed = set(filter_values)
+            column = self.columns[self.filter_column]
+            order = [i for i in order if column[i] in allowed]
+        with self.lock:
+            self.views[key] = order
+            while len(self.views) > self.MAX_VIEWS: self.views.popitem(last=False)
+        return order
+
+    def page(self, offset, limit, sort_by=None, descending=False, filter_values=None):
+        order = self.view(sort_by, descending, filter_values)
+        rows = order[offset:offset + limit]
+        return {"total": len(order), "offset": offset, "limit": limit,
+                "columns": {name: [values[i] for i in rows] for name, values in self.columns.items()}}
+
+
+class AnalysisTables:
+    # One analysis result split for paging: transactions and realized trades as columnar tables, and the
+    # full per-tx records (transfers included) looked up by hash only when a row is opened
+    def __init__(self, table_id, result):
+        transactions = result.get("transactions_in_time_window") or []
+        self.table_id = table_id
+        self.summary = result.get("summary")
+        self.outstanding_holdings = result.get("outstanding_holdings_fifo")
+        self.tables = {
+            "transactions": ColumnarTable(TRANSACTION_TABLE_COLUMNS, transactions, filter_column="type"),
+            "trades": ColumnarTable(REALIZED_TRADE_TABLE_COLUMNS, result.get("realized_trades_log_fifo") or [], filter_column="token_symbol"),
+        }
+        self.transactions_by_hash = {tx.get("hash"): tx for tx in transactions}
+
+
+class AnalysisTableCache:
+    # LRU of AnalysisTables by table id; the id is the result's ETag, so equal results share one entry
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, table_id):
+        with self.lock:
+            tables = self.entries.get(table_id)
+            if tables is not None: self.entries.move_to_end(table_id)
+            return tables
+
+    def get_or_build(self, table_id, load_result):
+        tables = self.get(table_id)
+        if tables is not None: return tables
+        tables = AnalysisTables(table_id, load_result())
+        with self.lock:
+            self.entries[table_id] = tables
+            while len(self.entries) > self.max_entries: self.entries.popitem(last=False)
+        return tables
+
+
+analysis_table_cache = AnalysisTableCache(TABLE_CACHE_MAX_ENTRIES)
+
+
+class JobQueueFullError(Exception):
+    # Raised when ANALYSIS_JOB_MAX_PENDING jobs are already queued or running
+    pass
+
+
+class AnalysisJob:
+    # One background analysis; every request coalesced onto it gets the same result
+    def __init__(self, job_id, key):
+        self.job_id = job_id
+        self.key = key
+        self.status = "queued" # queued -> running -> done | error
+        self.result = None
+        self.error = None
+        self.requests = 1 # Requests served by this job, including merged duplicates
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        job = {"job_id": self.job_id, "status": self.status, "coalesced_requests": self.requests,
+               "created_at": self.created_at, "started_at": self.started_at, "finished_at": self.finished_at}
+        if self.status == "done": job["result"] = self.result
+        elif self.status == "error": job["error"] = self.error
+        return job
+
+
+class AnalysisJobQueue:
+    # Bounded worker pool for analyses. A submission whose key matches a job that is still queued or running
+    # joins that job instead of starting another, so a burst of identical requests costs one analysis.
+    # Finished jobs stay readable by id for polling until they expire.
+    def __init__(self, max_workers, max_pending, result_ttl_seconds, max_retained):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-job")
+        self.max_pending = max_pending
+        self.result_ttl_seconds = result_ttl_seconds
+        self.max_retained = max_retained
+        self.jobs = OrderedDict() # job_id -> AnalysisJob, oldest first
+        self.in_flight = {} # key -> AnalysisJob that is queued or running
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def submit(self, key, fn, *args, **kwargs):
+        # Returns (job, coalesced)
+        with self.lock:
+            job = self.in_flight.get(key)
+            if job is not None:
+                job.requests += 1
+                self.coalesced += 1
+                return job, True
+            self._prune_locked()
+            if len(self.in_flight) >= self.max_pending:
+                self.rejected += 1
+                raise JobQueueFullError(f"Too many analyses in progress ({self.max_pending}); retry shortly.")
+            job = AnalysisJob(uuid.uuid4().hex, key)
+            self.jobs[job.job_id] = job
+            self.in_flight[key] = job
+            self.submitted += 1
+        self.executor.submit(self._run, job, fn, args, kwargs)
+        return job, False
+
+    def in_flight_job(self, key):
+        # The queued or running job for key, if any
+        with self.lock:
+            return self.in_flight.get(key)
+
+    def add_finished(self, key, result):
+        # A job that is done on arrival, for async requests answered from the result cache
+        job = AnalysisJob(uuid.uuid4().hex, key)
+        job.started_at = job.finished_at = time.time()
+        job.status = "done"
+        job.result = result
+        job.done.set()
+        with self.lock:
+            self._prune_locked()
+            self.jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            self._prune_locked()
+            return self.jobs.get(job_id)
+
+    def stats(self):
+        with self.lock:
+            running = sum(1 for job in self.in_flight.values() if job.status == "running")
+            return {"queued": len(self.in_flight) - running, "running": running, "retained": len(self.jobs),
+                    "submitted": self.submitted, "coalesced": self.coalesced, "rejected": self.rejected}
+
+    def _run(self, job, fn, args, kwargs):
+        job.started_at = time.time()
+        job.status = "running"
+        try:
+            job.result = fn(*args, **kwargs)
+            status = "done"
+        except Exception as e:
+            app.logger.error(f"Analysis job {job.job_id} failed: {e}", exc_info=True)
+            job.error = str(e)
+            status = "error"
+        with self.lock:
+            job.finished_at = time.time()
+            job.status = status
+            if self.in_flight.get(job.key) is job: del self.in_flight[job.key]
+        job.done.set()
+
+    def _prune_locked(self):
+        cutoff = time.time() - self.result_ttl_seconds
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at is not None and (job.finished_at < cutoff or len(self.jobs) > self.max_retained):
+                del self.jobs[job_id]
+
+
+analysis_job_queue = AnalysisJobQueue(ANALYSIS_JOB_WORKERS, ANALYSIS_JOB_MAX_PENDING,
+                                      ANALYSIS_JOB_RESULT_TTL_SECONDS, ANALYSIS_JOB_MAX_RETAINED)
+
+
+def collect_job_metrics():
+    jobs = analysis_job_queue.stats()
+    return [
+        ("analysis_jobs_total", "counter", "Job submissions by result; coalesced ones joined a job already in flight.", [
+            ({"result": "submitted"}, jobs["submitted"]), ({"result": "coalesced"}, jobs["coalesced"]),
+            ({"result": "rejected"}, jobs["rejected"]),
+        ]),
+        ("analysis_jobs", "gauge", "Jobs currently queued or running.", [
+            ({"status": "queued"}, jobs["queued"]), ({"status": "running"}, jobs["running"]),
+        ]),
+    ]
+
+
+metrics.register_collector(collect_job_metrics)
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def validate_wallet_request(data):
+    # Returns (wallet_address, bsc_api_key, error_message)
+    data = data or {}
+    wallet_address = data.get('wallet_address')
+    bsc_api_key = data.get('bsc_api_key')
+    if not wallet_address or not wallet_address.startswith('0x'):
+        return wallet_address, bsc_api_key, "Invalid or missing wallet address."
+    if not bsc_api_key and chain_data_source.requires_api_key: # Basic check, could be more robust
+        return wallet_address, bsc_api_key, "Missing BscScan API Key."
+    return wallet_address, bsc_api_key, None
+
+def parse_window_request(data):
+    # Returns (window, error_message) from optional start_time/end_time (unix seconds or ISO 8601, Beijing time if no offset)
+    data = data or {}
+    try:
+        return get_analysis_window_server(datetime.now(dt_timezone.utc), data.get('start_time'), data.get('end_time')), None
+    except ValueError as e:
+        return None, str(e)
+    except OverflowError: # An ISO time at the edge of the datetime range, shifted past it by a time zone
+        return None, "Time value out of range."
+
+def parse_wallet_analysis_request(data):
+    # Validates a /get_transactions body. Returns (params, error_message). params["key"] names the wallet
+    # and window: requests with equal keys share in-flight jobs and cached results. An open-ended range
+    # ("until now") matches any other open-ended request with the same start.
+    wallet_address, bsc_api_key, error_message = validate_wallet_request(data)
+    if error_message:
+        return None, error_message
+    window, error_message = parse_window_request(data)
+    if error_message:
+        return None, error_message
+    open_ended = data.get('start_time') is not None and data.get('end_time') is None
+    return {"wallet_address": wallet_address, "bsc_api_key": bsc_api_key, "window": window,
+            "incremental": bool(data.get('incremental', False)),
+            "key": (wallet_address.lower(), int(window[2].timestamp()), None if open_ended else int(window[1].timestamp()))}, None
+
+def run_wallet_analysis_job(params):
+    # Job body for /get_transactions. Full (non-incremental) results also go into the result cache;
+    # they are final if the window had closed by RESULT_CACHE_FINALITY_SECONDS before the analysis began
+    # and every tx was fully valued. A result with missing BNB prices or placeholder token metadata is
+    # only kept for the open-window TTL, so the next request after that recomputes it.
+    window = params["window"]
+    closed = window_closed_for_caching(window)
+    result = process_wallet_data(params["wallet_address"], params["bsc_api_key"], incremental=params["incremental"], window=window,
+                                 checkpoint_key=params["key"])
+    if not params["incremental"]: cache_wallet_analysis_result(params, result, closed)
+    return result
+
+def window_closed_for_caching(window):
+    # Checked before an analysis starts: its result can only be final if the window had closed long enough ago
+    return window[3] >= window[1] and time.time() >= window[1].timestamp() + RESULT_CACHE_FINALITY_SECONDS
+
+def cache_wallet_analysis_result(params, result, closed):
+    final = closed and result["summary"]["transactions_with_incomplete_valuation"] == 0
+    return analysis_result_cache.put(params["key"], result, final)
+
+def wallet_result_url(params):
+    # GET /get_transactions URL of a cached result: wallet and window in the query string, no API key
+    wallet_address, start_ts, end_ts = params["key"]
+    query = {"wallet_address": wallet_address, "start_time": start_ts}
+    if end_ts is not None: query["end_time"] = end_ts
+    return "/get_transactions?" + urlencode(query)
+
+def cached_result_response(entry, params):
+    # The stored gzip body, decompressed only for clients that do not accept gzip. Only GET answers are
+    # conditional (304 if the client already holds this ETag) and carry Cache-Control; POST answers are
+    # never reused by HTTP caches, so they are always 200 and name the GET URL in Content-Location.
+    if request.method == "GET" and request.if_none_match.contains_weak(entry.etag.strip('"')):
+        response = Response(status=304)
+    elif request.accept_encodings["gzip"]:
+        response = Response(entry.body_gzip, mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(gzip.decompress(entry.body_gzip), mimetype="application/json")
+    response.headers["ETag"] = entry.etag
+    response.headers["Vary"] = "Accept-Encoding"
+    if request.method == "GET":
+        max_age = 86400 if entry.final else max(0, int(entry.expires_at - time.time()))
+        response.headers["Cache-Control"] = f"private, max-age={max_age}"
+    else:
+        response.headers["Content-Location"] = wallet_result_url(params)
+    return response
+
+def parse_table_page_args(args, filter_values):
+    # Returns (page_kwargs, error_message) from offset/limit/sort_by/descending in a request body or query string
+    try:
+        offset = max(0, int(args.get('offset', 0)))
+        limit = min(max(1, int(args.get('limit', TABLE_PAGE_DEFAULT_ROWS))), TABLE_PAGE_MAX_ROWS)
+    except (TypeError, ValueError):
+        return None, "offset and limit must be integers."
+    descending = args.get('descending', False)
+    if isinstance(descending, str): descending = descending.lower() in ("1", "true", "yes")
+    return {"offset": offset, "limit": limit, "sort_by": args.get('sort_by') or None,
+            "descending": bool(descending), "filter_values": [v for v in filter_values if v] or None}, None
+
+def table_page_response(tables, table_name, page_kwargs):
+    table = tables.tables.get(table_name)
+    if table is None:
+        return jsonify({"error": f"Unknown table {table_name!r}; use one of {sorted(tables.tables)}."}), 404
+    if page_kwargs["sort_by"] and page_kwargs["sort_by"] not in table.columns:
+        return jsonify({"error": f"Cannot sort by {page_kwargs['sort_by']!r}."}), 400
+    return jsonify(table.page(**page_kwargs))
+
+@app.route('/metrics')
+def metrics_route():
+    # Prometheus scrape endpoint
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
 @app.route('/get_transactions', methods=['POST'])
 def get_transactions_route():
     try:
         data = request.get_json()
-        wallet_address = data.get('wallet_address')
+        params, error_message = parse_wallet_analysis_request(data)
+        if error_message:
+            return jsonify({"error": error_message}), 400
+        # Full analyses are answered from the result cache when possible. In async mode the answer keeps the
+        # job shape: a job that is already done, so its status_url resolves on the first poll.
+        if not params["incremental"]:
+            entry = analysis_result_cache.get(params["key"])
+            if entry is not None and data.get('async'):
+                job = analysis_job_queue.add_finished(params["key"] + (False,), json.loads(gzip.decompress(entry.body_gzip)))
+                return jsonify({"job_id": job.job_id, "status": job.status, "coalesced": False,
+                                "status_url": f"/jobs/{job.job_id}"}), 202
+            if entry is not None:
+                return cached_result_response(entry, params)
+
+        # The analysis runs in the job pool either way, so identical concurrent requests share it.
+        # With "async": true the job id is returned at once (202) and the client polls /jobs/<job_id>.
+        job, coalesced = analysis_job_queue.submit(params["key"] + (params["incremental"],), run_wallet_analysis_job, params)
+        if data.get('async'):
+            return jsonify({"job_id": job.job_id, "status": job.status, "coalesced": coalesced,
+                            "status_url": f"/jobs/{job.job_id}"}), 202
+
+        job.done.wait()
+        if job.status == "error":
+            return jsonify({"error": job.error}), 500
+        entry = None if params["incremental"] else analysis_result_cache.get(params["key"], count_lookup=False)
+        return cached_result_response(entry, params) if entry is not None else jsonify(job.result)
+
+    except JobQueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        app.logger.error(f"Error processing request: {e}", exc_info=True) # Log full traceback
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/get_transactions', methods=['GET'])
+def get_transactions_conditional_route():
+    # Full analysis addressed by URL, for conditional fetches: ?wallet_address=&start_time=&end_time= (as in
+    # the POST body; the URL is also given in Content-Location of POST answers) and the API key in the
+    # X-BscScan-Api-Key header. Answers carry ETag and Cache-Control, and If-None-Match gets a 304.
+    try:
+        data = dict(request.args.items(), bsc_api_key=request.headers.get('X-BscScan-Api-Key'), incremental=False)
+        params, error_message = parse_wallet_analysis_request(data)
+        if error_message:
+            return jsonify({"error": error_message}), 400
+        entry = analysis_result_cache.get(params["key"])
+        if entry is None:
+            job, _ = analysis_job_queue.submit(params["key"] + (False,), run_wallet_analysis_job, params)
+            job.done.wait()
+            if job.status == "error":
+                return jsonify({"error": job.error}), 500
+            entry = analysis_result_cache.get(params["key"], count_lookup=False)
+            if entry is None: return jsonify(job.result) # Already evicted again
+        return cached_result_response(entry, params)
+
+    except JobQueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        app.logger.error(f"Error processing request: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/jobs/<job_id>')
+def get_job_route(job_id):
+    # Job status, plus the result once done. ?wait=<seconds> blocks until the job finishes or the wait
+    # runs out (at most ANALYSIS_JOB_MAX_WAIT_SECONDS), so clients can subscribe without tight polling.
+    job = analysis_job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job id."}), 404
+    try:
+        wait_seconds = min(max(float(request.args.get('wait', 0)), 0), ANALYSIS_JOB_MAX_WAIT_SECONDS)
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds."}), 400
+    if wait_seconds: job.done.wait(wait_seconds)
+    return jsonify(job.to_dict())
+
+def parse_table_request(data):
+    # Validates a /get_transactions_table body. Returns (params, page_kwargs, error_message).
+    params, error_message = parse_wallet_analysis_request(dict(data, incremental=False))
+    if error_message:
+        return None, None, error_message
+    types = data.get('types') or []
+    page_kwargs, error_message = parse_table_page_args(data, types if isinstance(types, list) else [types])
+    if error_message:
+        return None, None, error_message
+    if page_kwargs["sort_by"] and page_kwargs["sort_by"] not in TRANSACTION_TABLE_COLUMNS:
+        return None, None, f"Cannot sort by {page_kwargs['sort_by']!r}."
+    return params, page_kwargs, None
+
+def analysis_tables_for(entry, result=None):
+    # Tables of a cached result; the id is its ETag, so equal results share one entry
+    table_id = entry.etag.strip('"') if entry is not None else uuid.uuid4().hex
+    return analysis_table_cache.get_or_build(table_id, lambda: result if result is not None else json.loads(gzip.decompress(entry.body_gzip)))
+
+def analysis_tables_first_pages(tables, page_kwargs):
+    transactions = tables.tables["transactions"]
+    return {
+        "table_id": tables.table_id, "summary": tables.summary, "outstanding_holdings_fifo": tables.outstanding_holdings,
+        "type_counts": transactions.value_counts("type"),
+        "transactions": transactions.page(**page_kwargs),
+        "trades": tables.tables["trades"].page(0, page_kwargs["limit"]),
+    }
+
+def iter_wallet_table_events(params, page_kwargs):
+    # Progressive /get_transactions_table: block_range, then each tx's table row (transaction_row) and its
+    # realized trade rows (trade_rows) as they are classified, then a "table" event carrying the same body
+    # /get_transactions_table returns, from which the client pages. The result is cached like a job's; a
+    # cached result, or an identical analysis already running in the job pool, yields only the table event.
+    entry = analysis_result_cache.get(params["key"])
+    result = None
+    if entry is None:
+        job = analysis_job_queue.in_flight_job(params["key"] + (False,))
+        if job is not None:
+            job.done.wait()
+            if job.status == "error": raise Exception(job.error)
+            result = job.result
+            entry = analysis_result_cache.get(params["key"], count_lookup=False)
+        else:
+            window = params["window"]
+            closed = window_closed_for_caching(window)
+            start_timestamp_unix_utc, end_timestamp_unix_utc = int(window[2].timestamp()), int(window[3].timestamp())
+            state = WalletAnalysisState(params["wallet_address"], start_timestamp_unix_utc)
+            state.begin_request()
+            for event in iter_wallet_sync_events(state, params["bsc_api_key"], start_timestamp_unix_utc, end_timestamp_unix_utc):
+                if event["event"] == "transaction":
+                    yield {"event": "transaction_row", "row": {name: getter(event["transaction"]) for name, getter in TRANSACTION_TABLE_COLUMNS.items()}}
+                elif event["event"] == "trades":
+                    yield {"event": "trade_rows", "rows": [{name: getter(trade) for name, getter in REALIZED_TRADE_TABLE_COLUMNS.items()}
+                                                           for trade in event["trades"]]}
+                else:
+                    yield event
+            result = state.build_result(*window)
+            record_analysis_metrics("full", result["summary"]["timing_breakdown_seconds"])
+            entry = cache_wallet_analysis_result(params, result, closed)
+    yield dict(analysis_tables_first_pages(analysis_tables_for(entry, result), page_kwargs), event="table")
+
+@app.route('/get_transactions_table', methods=['POST'])
+def get_transactions_table_route():
+    # Compact counterpart of /get_transactions for large wallets: the summary plus the first page of each
+    # table in columnar form and a table_id. Further pages come from /tables/<table_id>/<table_name> and
+    # the full record of one transaction (with its BEP-20 transfers) from /tables/<table_id>/transactions/<hash>.
+    # Body: the /get_transactions fields plus optional offset, limit, sort_by, descending and types.
+    try:
+        data = request.get_json(silent=True) or {}
+        params, page_kwargs, error_message = parse_table_request(data)
+        if error_message:
+            return jsonify({"error": error_message}), 400
+
+        result = None
+        entry = analysis_result_cache.get(params["key"])
+        if entry is None:
+            job, _ = analysis_job_queue.submit(params["key"] + (False,), run_wallet_analysis_job, params)
+            job.done.wait()
+            if job.status == "error":
+                return jsonify({"error": job.error}), 500
+            result = job.result
+            entry = analysis_result_cache.get(params["key"], count_lookup=False)
+        return jsonify(analysis_tables_first_pages(analysis_tables_for(entry, result), page_kwargs))
+
+    except JobQueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        app.logger.error(f"Error processing table request: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/get_transactions_table_stream', methods=['POST'])
+def get_transactions_table_stream_route():
+    # NDJSON form of /get_transactions_table used by the web page, so rows show up while the analysis
+    # runs (see iter_wallet_table_events). Errors after the stream has started end it with {"event": "error"}.
+    try:
+        data = request.get_json(silent=True) or {}
+        params, page_kwargs, error_message = parse_table_request(data)
+        if error_message:
+            return jsonify({"error": error_message}), 400
+    except Exception as e:
+        app.logger.error(f"Error processing table stream request: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        try:
+            for event in iter_wallet_table_events(params, page_kwargs):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            app.logger.error(f"Error streaming table request: {e}", exc_info=True)
+            yield json.dumps({"event": "error", "error": str(e)}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/tables/<table_id>/<table_name>')
+def get_table_page_route(table_id, table_name):
+    # ?offset=&limit=&sort_by=&descending=1, and for transactions ?type=Buy&type=Sell (trades: ?type=<token symbol>)
+    tables = analysis_table_cache.get(table_id)
+    if tables is None:
+        return jsonify({"error": "Unknown or expired table id; request /get_transactions_table again."}), 404
+    page_kwargs, error_message = parse_table_page_args(request.args, request.args.getlist('type'))
+    if error_message:
+        return jsonify({"error": error_message}), 400
+    return table_page_response(tables, table_name, page_kwargs)
+
+@app.route('/tables/<table_id>/transactions/<tx_hash>')
+def get_table_transaction_route(table_id, tx_hash):
+    tables = analysis_table_cache.get(table_id)
+    if tables is None:
+        return jsonify({"error": "Unknown or expired table id; request /get_transactions_table again."}), 404
+    tx = tables.transactions_by_hash.get(tx_hash) or tables.transactions_by_hash.get(tx_hash.lower())
+    if tx is None:
+        return jsonify({"error": "Transaction not found in this table."}), 404
+    return jsonify(tx)
+
+@app.route('/get_transactions_stream', methods=['POST'])
+def get_transactions_stream_route():
+    # NDJSON stream: block_range, then transaction/trades events as each tx is classified, then summary.
+    # Errors after the stream has started are reported as a final {"event": "error"} line.
+    try:
+        data = request.get_json(silent=True)
+        wallet_address, bsc_api_key, error_message = validate_wallet_request(data)
+        if error_message:
+            return jsonify({"error": error_message}), 400
+        window, error_message = parse_window_request(data)
+        if error_message:
+            return jsonify({"error": error_message}), 400
+    except Exception as e:
+        app.logger.error(f"Error processing stream request: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        try:
+            for event in iter_wallet_data_events(wallet_address, bsc_api_key, window=window):
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            app.logger.error(f"Error streaming request: {e}", exc_info=True)
+            yield json.dumps({"event": "error", "error": str(e)}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/get_transactions_batch', methods=['POST'])
+def get_transactions_batch_route():
+    try:
+        data = request.get_json(silent=True) or {}
+        wallet_addresses = data.get('wallet_addresses')
         bsc_api_key = data.get('bsc_api_key')
 
-        if not wallet_address or not wallet_address.startswith('0x'):
-            return jsonify({"error": "Invalid or missing wallet address."}), 400
-        if not bsc_api_key: # Basic check, could be more robust
+        if not isinstance(wallet_addresses, list) or not wallet_addresses:
+            return jsonify({"error": "wallet_addresses must be a non-empty list."}), 400
+        if len(wallet_addresses) > BATCH_MAX_WALLETS:
+            return jsonify({"error": f"At most {BATCH_MAX_WALLETS} wallets per batch."}), 400
+        if not all(isinstance(w, str) and w.startswith('0x') for w in wallet_addresses):
+            return jsonify({"error": "Invalid wallet address in wallet_addresses."}), 400
+        if not bsc_api_key and chain_data_source.requires_api_key:
             return jsonify({"error": "Missing BscScan API Key."}), 400
+        window, error_message = parse_window_request(data)
+        if error_message:
+            return jsonify({"error": error_message}), 400
 
-        # Call the main processing function from your script
-        processed_data = process_wallet_data(wallet_address, bsc_api_key)
-        return jsonify(processed_data)
+        unique_wallets = list(dict.fromkeys(w.lower() for w in wallet_addresses))
+        return jsonify(process_wallet_batch_data(unique_wallets, bsc_api_key, window=window))
 
     except Exception as e:
-        app.logger.error(f"Error processing request: {e}", exc_info=True) # Log full traceback
+        app.logger.error(f"Error processing batch request: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
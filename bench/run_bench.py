@@ -0,0 +1,282 @@
+# Benchmark harness: runs app.py against bench/stub_server.py and reports wall-clock time, API calls,
+# peak memory and time-to-first-byte for process_wallet_data, /get_transactions and /get_transactions_stream.
+# Every scenario/target pair runs in a fresh child process with an empty cache file, once cold and once warm.
+# The JSON written to --output has a stable shape, so a run can be checked against an earlier one with --baseline:
+#   python bench/run_bench.py --output bench/results/baseline.json
+#   ... change something ...
+#   python bench/run_bench.py --baseline bench/results/baseline.json
+import argparse
+import hashlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+import stub_server
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULT_SCHEMA_VERSION = 1
+BENCH_API_KEY = "BENCHKEY"
+
+# name -> BENCH_WALLETS entry to analyse and the transfer ingestion mode to force (None keeps the app default)
+SCENARIOS = {
+    "small": ("small", None),
+    "medium": ("medium", None),
+    "medium-receipts": ("medium", "receipts"),
+    "huge": ("huge", None),
+}
+TARGETS = ("process", "route", "stream")
+# Metric -> (relative tolerance scale, absolute floor below which a difference is noise)
+TIMING_METRICS = {"wall_seconds": (1.0, 0.05), "ttfb_seconds": (1.0, 0.05), "time_to_first_row_seconds": (1.0, 0.05),
+                  "peak_rss_delta_mb": (1.0, 5.0)}
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024 # bytes on macOS, KiB on Linux
+
+
+def stub_request(stub_url, path, method="GET"):
+    with urllib.request.urlopen(urllib.request.Request(stub_url + path, method=method, data=b"" if method == "POST" else None)) as response:
+        return json.loads(response.read())
+
+
+def result_digest(summary):
+    # Fingerprint of the analysis result, minus fields that change on every run
+    stable = {key: value for key, value in summary.items() if key not in ("data_generation_date_utc", "new_transactions_this_sync", "timing_breakdown_seconds")}
+    return hashlib.sha1(json.dumps(stable, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:12]
+
+
+def run_process_target(app, wallet_address, start_time, end_time):
+    window = app.get_analysis_window_server(datetime.now(timezone.utc), start_time, end_time)
+    started = time.perf_counter()
+    result = app.process_wallet_data(wallet_address, BENCH_API_KEY, window=window)
+    elapsed = time.perf_counter() - started
+    return {"wall_seconds": elapsed, "ttfb_seconds": elapsed, "time_to_first_row_seconds": elapsed,
+            "transactions": result["summary"]["transactions_in_precise_time_window_processed"], "result_digest": result_digest(result["summary"])}
+
+
+def run_route_target(app, wallet_address, start_time, end_time):
+    client = app.app.test_client()
+    started = time.perf_counter()
+    response = client.post("/get_transactions", json={"wallet_address": wallet_address, "bsc_api_key": BENCH_API_KEY,
+                                                       "start_time": start_time, "end_time": end_time}, buffered=False)
+    chunks = iter(response.response)
+    body = next(chunks, b"")
+    ttfb = time.perf_counter() - started
+    body += b"".join(chunks)
+    elapsed = time.perf_counter() - started
+    result = json.loads(body)
+    if "error" in result: raise RuntimeError(result["error"])
+    return {"wall_seconds": elapsed, "ttfb_seconds": ttfb, "time_to_first_row_seconds": ttfb,
+            "transactions": result["summary"]["transactions_in_precise_time_window_processed"], "result_digest": result_digest(result["summary"])}
+
+
+def run_stream_target(app, wallet_address, start_time, end_time):
+    client = app.app.test_client()
+    started = time.perf_counter()
+    response = client.post("/get_transactions_stream", json={"wallet_address": wallet_address, "bsc_api_key": BENCH_API_KEY,
+                                                              "start_time": start_time, "end_time": end_time}, buffered=False)
+    ttfb = first_row = None
+    transactions = 0
+    summary = None
+    buffered = b""
+    for chunk in response.response:
+        if ttfb is None: ttfb = time.perf_counter() - started
+        buffered += chunk
+        *lines, buffered = buffered.split(b"\n")
+        for line in lines:
+            if not line.strip(): continue
+            event = json.loads(line)
+            if event["event"] == "transaction":
+                transactions += 1
+                if first_row is None: first_row = time.perf_counter() - started
+            elif event["event"] == "summary":
+                summary = event["summary"]
+            elif event["event"] == "error":
+                raise RuntimeError(event["error"])
+    elapsed = time.perf_counter() - started
+    return {"wall_seconds": elapsed, "ttfb_seconds": ttfb, "time_to_first_row_seconds": first_row if first_row is not None else elapsed,
+            "transactions": transactions, "result_digest": result_digest(summary or {})}
+
+
+TARGET_RUNNERS = {"process": run_process_target, "route": run_route_target, "stream": run_stream_target}
+
+
+def run_child(spec):
+    # Runs inside a fresh interpreter whose environment already points app.py at the stub server
+    sys.path.insert(0, REPO_DIR)
+    import app
+    app.app.logger.disabled = True
+    if spec["ingestion"]: app.TRANSFER_INGESTION_MODE = spec["ingestion"]
+    runner = TARGET_RUNNERS[spec["target"]]
+    baseline_rss = peak_rss_mb()
+    measurements = {}
+    for phase in ("cold", "warm"):
+        stub_request(spec["stub_url"], "/__reset", method="POST")
+        measurement = runner(app, spec["wallet_address"], spec["start_time"], spec["end_time"])
+        measurement["api_calls"] = stub_request(spec["stub_url"], "/__stats")
+        if phase == "cold":
+            # ru_maxrss is a high-water mark, so only the first run of the process has its own peak
+            measurement["peak_rss_mb"] = peak_rss_mb()
+            measurement["peak_rss_delta_mb"] = measurement["peak_rss_mb"] - baseline_rss
+        measurements[phase] = measurement
+    print("BENCH_RESULT " + json.dumps(measurements), flush=True)
+
+
+def start_stub(args, wallet_names):
+    command = [sys.executable, os.path.join(BENCH_DIR, "stub_server.py"), "--latency", str(args.latency),
+               "--rate-limit-every", str(args.rate_limit_every), "--seed", str(args.seed),
+               "--rpc-max-log-blocks", str(args.rpc_max_log_blocks)]
+    command += ["--replay", args.replay] if args.replay else ["--wallets", ",".join(wallet_names)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("STUB_LISTENING "):
+        process.kill()
+        raise RuntimeError(f"Stub server did not start: {line!r}")
+    return process, line.split()[1]
+
+
+def run_scenario_target(args, stub_url, scenario_name, target, wallet_address, start_time, end_time, ingestion):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, BSCSCAN_API_URL=stub_url + "/api", COINGECKO_API_URL=stub_url + "/api/v3",
+                   BSC_CACHE_DB_PATH=os.path.join(cache_dir, "bench_cache.sqlite3"),
+                   BSCSCAN_CALLS_PER_SECOND=str(args.api_rate), COINGECKO_CALLS_PER_SECOND=str(args.api_rate), BSCSCAN_API_KEYS="",
+                   BSC_DATA_SOURCE=args.data_source, BSC_RPC_URL=stub_url + "/rpc")
+        spec = {"target": target, "stub_url": stub_url, "wallet_address": wallet_address, "start_time": start_time,
+                "end_time": end_time, "ingestion": ingestion}
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", json.dumps(spec)],
+                                   env=env, capture_output=True, text=True, timeout=args.timeout)
+    for line in completed.stdout.splitlines():
+        if line.startswith("BENCH_RESULT "): return json.loads(line[len("BENCH_RESULT "):])
+    return {"error": (completed.stderr or completed.stdout).strip().splitlines()[-1:] or ["child produced no result"]}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare_with_baseline(current, baseline, tolerance):
+    # Returns human-readable regression lines; timing metrics get a relative tolerance, API call counts none
+    regressions = []
+    for key, phases in current["results"].items():
+        for phase, measurement in phases.items():
+            base = baseline.get("results", {}).get(key, {}).get(phase)
+            if not base or "error" in base or "error" in measurement: continue
+            for metric, (scale, floor) in TIMING_METRICS.items():
+                new_value, old_value = measurement.get(metric), base.get(metric)
+                if new_value is None or old_value is None: continue
+                if new_value > old_value * (1 + tolerance * scale) and new_value - old_value > floor:
+                    regressions.append(f"{key} {phase} {metric}: {old_value:.3f} -> {new_value:.3f}")
+            new_calls, old_calls = measurement["api_calls"].get("total", 0), base["api_calls"].get("total", 0)
+            if new_calls > old_calls:
+                regressions.append(f"{key} {phase} api_calls.total: {old_calls} -> {new_calls}")
+            if measurement.get("result_digest") != base.get("result_digest"):
+                regressions.append(f"{key} {phase} result changed: {base.get('result_digest')} -> {measurement.get('result_digest')}")
+    return regressions
+
+
+def print_table(results):
+    print(f"{'scenario/target':<28}{'phase':<6}{'wall s':>9}{'ttfb s':>9}{'1st row s':>10}{'api calls':>10}{'rss +MB':>9}{'txs':>8}")
+    for key, phases in results.items():
+        for phase, measurement in phases.items():
+            if "error" in measurement:
+                print(f"{key:<28}{phase:<6} ERROR {measurement['error']}")
+                continue
+            rss = measurement.get("peak_rss_delta_mb")
+            print(f"{key:<28}{phase:<6}{measurement['wall_seconds']:>9.3f}{measurement['ttfb_seconds']:>9.3f}"
+                  f"{measurement['time_to_first_row_seconds']:>10.3f}{measurement['api_calls'].get('total', 0):>10}"
+                  f"{(f'{rss:.1f}' if rss is not None else '-'):>9}{measurement['transactions']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app.py against the local BscScan/CoinGecko stub")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--targets", default=",".join(TARGETS), help=f"Comma-separated subset of {', '.join(TARGETS)}")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds the stub adds to every API response")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Stub answers every Nth BscScan call with a rate-limit error")
+    parser.add_argument("--api-rate", type=float, default=100, help="Calls/sec budget given to the app's rate limiters")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--data-source", choices=("bscscan", "rpc"), default="bscscan",
+                        help="App data source; rpc uses the stub's JSON-RPC endpoint (synthetic wallets only)")
+    parser.add_argument("--rpc-max-log-blocks", type=int, default=5000, help="eth_getLogs span limit the stub node enforces")
+    parser.add_argument("--replay", help="Replay this recording (made with stub_server.py --record) instead of synthetic wallets")
+    parser.add_argument("--wallet", help="Wallet to analyse in --replay mode")
+    parser.add_argument("--start-time", help="Window start in --replay mode (unix seconds or ISO 8601)")
+    parser.add_argument("--end-time", help="Window end in --replay mode")
+    parser.add_argument("--output", default=os.path.join(BENCH_DIR, "results", "latest.json"))
+    parser.add_argument("--baseline", help="Earlier --output file to compare against; exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before a timing counts as a regression")
+    parser.add_argument("--timeout", type=float, default=1800, help="Seconds allowed per scenario/target child")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(json.loads(args.child))
+
+    if args.replay:
+        if not (args.wallet and args.start_time):
+            parser.error("--replay needs --wallet and --start-time")
+        if args.data_source == "rpc":
+            parser.error("--data-source rpc needs synthetic wallets, not --replay")
+        scenarios = {"replay": (args.wallet.lower(), args.start_time, args.end_time, None)}
+    else:
+        scenarios = {}
+        for name in [name for name in args.scenarios.split(",") if name]:
+            wallet_name, ingestion = SCENARIOS[name]
+            wallet_address, _, start_time, days = stub_server.BENCH_WALLETS[wallet_name]
+            end_time = (datetime.fromisoformat(start_time) + timedelta(days=days)).isoformat()
+            scenarios[name] = (wallet_address, start_time, end_time, ingestion)
+    targets = [target for target in args.targets.split(",") if target]
+
+    wallet_names = sorted({SCENARIOS[name][0] for name in scenarios if name in SCENARIOS})
+    stub_process, stub_url = start_stub(args, wallet_names)
+    results = {}
+    try:
+        for scenario_name, (wallet_address, start_time, end_time, ingestion) in scenarios.items():
+            for target in targets:
+                key = f"{scenario_name}/{target}"
+                print(f"running {key} ...", file=sys.stderr, flush=True)
+                measurement = run_scenario_target(args, stub_url, scenario_name, target, wallet_address, start_time, end_time, ingestion)
+                results[key] = measurement if "error" not in measurement else {"cold": measurement}
+    finally:
+        stub_process.kill()
+
+    output = {
+        "schema_version": RESULT_SCHEMA_VERSION,
+        "generated_at": datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC'),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {"latency": args.latency, "rate_limit_every": args.rate_limit_every, "api_rate": args.api_rate,
+                   "seed": args.seed, "replay": bool(args.replay), "data_source": args.data_source},
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(output, output_file, indent=2, sort_keys=True)
+    print_table(results)
+    print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("config") != output["config"]:
+            print("warning: baseline was recorded with a different config", file=sys.stderr)
+        regressions = compare_with_baseline(output, baseline, args.tolerance)
+        for line in regressions: print("REGRESSION " + line)
+        if regressions: sys.exit(1)
+        print("no regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
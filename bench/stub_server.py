@@ -0,0 +1,439 @@
+# Local stand-in for the BscScan and CoinGecko endpoints app.py calls, so performance work can be measured
+# without spending real API quota. Three data sources:
+#   synthetic - deterministic wallets generated from a seed (BENCH_WALLETS below)
+#   replay    - answers from a JSONL recording made with --record
+#   record    - forwards to the real APIs and appends every exchange to a JSONL recording
+# Point the app at it with BSCSCAN_API_URL=http://127.0.0.1:<port>/api and
+# COINGECKO_API_URL=http://127.0.0.1:<port>/api/v3. GET /__stats returns call counters, POST /__reset clears them.
+# Synthetic wallets are also served as a JSON-RPC node at POST /rpc (BSC_DATA_SOURCE=rpc BSC_RPC_URL=.../rpc),
+# with batched requests and an optional eth_getLogs block range limit (--rpc-max-log-blocks).
+import argparse
+import bisect
+import calendar
+import json
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+import requests
+
+TRANSFER_EVENT_SIGNATURE = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+GENESIS_TIMESTAMP = 1714521600 # 2024-05-01 00:00 UTC; the synthetic chain starts here
+GENESIS_BLOCK = 38000000
+BLOCKS_PER_SECOND = 4 / 3 # BSC's 0.75 s block time
+LIST_RESULT_CAP = 10000 # BscScan rejects page * offset above this
+RATE_LIMIT_RESULT = {"status": "0", "message": "NOTOK", "result": "Max rate limit reached"}
+DEFAULT_BSCSCAN_UPSTREAM = "https://api.bscscan.com/api"
+DEFAULT_COINGECKO_UPSTREAM = "https://api.coingecko.com/api/v3"
+
+USDT_ADDRESS = "0x55d398326f99059ff775485246999027b3197955"
+WBNB_ADDRESS = "0xbb4cdb9cbd36b01bd1cbaebf2de08d9173bc095c"
+SYNTHETIC_TOKENS = {
+    USDT_ADDRESS: ("Tether USD", "USDT", 18),
+    WBNB_ADDRESS: ("Wrapped BNB", "WBNB", 18),
+    "0x2222222222222222222222222222222222222222": ("Bench Alpha", "ALPHA", 18),
+    "0x3333333333333333333333333333333333333333": ("Bench Beta", "BETA", 9),
+    "0x4444444444444444444444444444444444444444": ("Bench Gamma", "GAMMA", 6),
+}
+TRADED_TOKENS = [address for address in SYNTHETIC_TOKENS if address not in (USDT_ADDRESS, WBNB_ADDRESS)]
+COUNTERPARTY_ADDRESS = "0x1111111111111111111111111111111111111111" # Plays the DEX pool in every swap
+
+# name -> (wallet address, tx count, window start as Beijing ISO time, window length in days)
+BENCH_WALLETS = {
+    "small": ("0x5a11000000000000000000000000000000000001", 50, "2024-05-02T08:00:00+08:00", 1),
+    "medium": ("0x5a11000000000000000000000000000000000002", 2000, "2024-05-02T08:00:00+08:00", 1),
+    "huge": ("0x5a11000000000000000000000000000000000003", 25000, "2024-05-02T08:00:00+08:00", 7),
+}
+
+
+def block_at(timestamp):
+    return GENESIS_BLOCK + math.floor((timestamp - GENESIS_TIMESTAMP) * BLOCKS_PER_SECOND)
+
+
+def timestamp_of(block_number):
+    return GENESIS_TIMESTAMP + math.ceil((block_number - GENESIS_BLOCK) / BLOCKS_PER_SECOND)
+
+
+def bnb_price_at(timestamp):
+    # Smooth, deterministic intraday curve so interpolated valuations are stable across runs
+    return round(580 + 25 * math.sin(timestamp / 86400 * 2 * math.pi) + 4 * math.sin(timestamp / 3600 * 2 * math.pi), 4)
+
+
+def pad_topic(address):
+    return "0x" + "0" * 24 + address[2:]
+
+
+class SyntheticChain:
+    # Deterministic wallets made of USDT/WBNB buys and sells of a few tokens, plain token sends and native
+    # BNB transfers, indexed the way the stub needs to answer txlist/tokentx/receipt queries.
+    def __init__(self, seed=1):
+        self.seed = seed
+        self.txs_by_wallet = {}
+        self.txs_by_hash = {}
+        self.logs_by_address = defaultdict(list) # address -> [(block, tx, log index)] in chain order, for eth_getLogs
+        self.next_tx_id = 1
+
+    def add_wallet(self, wallet_address, tx_count, start_timestamp, end_timestamp):
+        rng = random.Random(f"{self.seed}:{wallet_address}")
+        timestamps = sorted(rng.randrange(start_timestamp, end_timestamp) for _ in range(tx_count))
+        txs = []
+        for transaction_index, timestamp in enumerate(timestamps):
+            tx_hash = "0x%064x" % self.next_tx_id
+            self.next_tx_id += 1
+            token = rng.choice(TRADED_TOKENS)
+            token_unit = 10 ** SYNTHETIC_TOKENS[token][2]
+            token_amount = rng.randrange(1, 5000) * token_unit // 10
+            quote = USDT_ADDRESS if rng.random() < 0.7 else WBNB_ADDRESS
+            quote_amount = rng.randrange(10, 2000) * 10 ** 18 // (1 if quote == USDT_ADDRESS else 600)
+            kind = rng.choices(["buy", "sell", "send", "native"], weights=[40, 35, 15, 10])[0]
+            transfers = []
+            value = 0
+            if kind == "buy":
+                transfers = [(quote, wallet_address, COUNTERPARTY_ADDRESS, quote_amount), (token, COUNTERPARTY_ADDRESS, wallet_address, token_amount)]
+            elif kind == "sell":
+                transfers = [(token, wallet_address, COUNTERPARTY_ADDRESS, token_amount), (quote, COUNTERPARTY_ADDRESS, wallet_address, quote_amount)]
+            elif kind == "send":
+                transfers = [(token, wallet_address, "0x%040x" % rng.getrandbits(160), token_amount)]
+            else:
+                value = rng.randrange(1, 100) * 10 ** 16
+            tx = {
+                "hash": tx_hash, "timestamp": timestamp, "block": block_at(timestamp), "index": transaction_index,
+                "from": wallet_address, "to": COUNTERPARTY_ADDRESS, "value": value, "transfers": transfers,
+            }
+            txs.append(tx)
+            self.txs_by_hash[tx_hash] = tx
+            for log_index, (_, from_address, to_address, _) in enumerate(transfers):
+                for address in {from_address, to_address}:
+                    self.logs_by_address[address].append((tx["block"], tx, log_index))
+        self.txs_by_wallet[wallet_address.lower()] = txs
+        for entries in self.logs_by_address.values():
+            entries.sort(key=lambda entry: (entry[0], entry[1]["hash"], entry[2]))
+
+    def txlist_rows(self, wallet_address, start_block, end_block):
+        return [{
+            "blockNumber": str(tx["block"]), "timeStamp": str(tx["timestamp"]), "hash": tx["hash"], "nonce": str(tx["index"]),
+            "transactionIndex": "0", "from": tx["from"], "to": tx["to"], "value": str(tx["value"]), "gas": "300000",
+            "gasPrice": "3000000000", "isError": "0", "txreceipt_status": "1", "gasUsed": "150000",
+        } for tx in self.txs_by_wallet.get(wallet_address.lower(), []) if start_block <= tx["block"] <= end_block]
+
+    def tokentx_rows(self, wallet_address, start_block, end_block):
+        rows = []
+        for tx in self.txs_by_wallet.get(wallet_address.lower(), []):
+            if not start_block <= tx["block"] <= end_block: continue
+            for log_index, (token, from_address, to_address, amount) in enumerate(tx["transfers"]):
+                name, symbol, decimals = SYNTHETIC_TOKENS[token]
+                rows.append({
+                    "blockNumber": str(tx["block"]), "timeStamp": str(tx["timestamp"]), "hash": tx["hash"],
+                    "from": from_address, "to": to_address, "contractAddress": token, "value": str(amount),
+                    "tokenName": name, "tokenSymbol": symbol, "tokenDecimal": str(decimals),
+                    "transactionIndex": "0", "logIndex": str(log_index),
+                })
+        return rows
+
+    def log_entry(self, tx, log_index):
+        token, from_address, to_address, amount = tx["transfers"][log_index]
+        return {"address": token, "topics": [TRANSFER_EVENT_SIGNATURE, pad_topic(from_address), pad_topic(to_address)],
+                "data": "0x%064x" % amount, "blockNumber": hex(tx["block"]), "transactionHash": tx["hash"],
+                "transactionIndex": "0x0", "logIndex": hex(log_index), "removed": False}
+
+    def receipt(self, tx_hash):
+        tx = self.txs_by_hash.get(tx_hash.lower())
+        if tx is None: return None
+        return {
+            "transactionHash": tx["hash"], "blockNumber": hex(tx["block"]), "status": "0x1", "from": tx["from"], "to": tx["to"],
+            "gasUsed": hex(150000), "logs": [self.log_entry(tx, log_index) for log_index in range(len(tx["transfers"]))],
+        }
+
+    def transaction(self, tx_hash):
+        tx = self.txs_by_hash.get(tx_hash.lower())
+        if tx is None: return None
+        return {"hash": tx["hash"], "blockNumber": hex(tx["block"]), "transactionIndex": "0x0", "from": tx["from"], "to": tx["to"],
+                "value": hex(tx["value"]), "nonce": hex(tx["index"]), "gas": hex(300000), "gasPrice": hex(3000000000), "input": "0x"}
+
+    def logs(self, log_filter):
+        # Transfer logs matching topics [signature, from] or [signature, None, to] in a block range
+        topics = (log_filter.get("topics") or []) + [None, None, None]
+        if topics[0] not in (None, TRANSFER_EVENT_SIGNATURE): return []
+        from_topic, to_topic = topics[1], topics[2]
+        address = "0x" + (from_topic or to_topic or "")[-40:]
+        start_block, end_block = int(log_filter.get("fromBlock", "0x0"), 16), int(log_filter.get("toBlock", "0x0"), 16)
+        entries = self.logs_by_address.get(address, [])
+        first = bisect.bisect_left(entries, start_block, key=lambda entry: entry[0])
+        matches = []
+        for block, tx, log_index in entries[first:]:
+            if block > end_block: break
+            _, from_address, to_address, _ = tx["transfers"][log_index]
+            if from_topic and pad_topic(from_address) != from_topic: continue
+            if to_topic and pad_topic(to_address) != to_topic: continue
+            matches.append(self.log_entry(tx, log_index))
+        return matches
+
+
+def encode_abi_string(text):
+    raw = text.encode()
+    return "0x" + "%064x" % 32 + "%064x" % len(raw) + raw.hex().ljust(64 * max(1, math.ceil(len(raw) / 32)), "0")
+
+
+class StubBackend:
+    # Shared by all handler threads: the data source, failure injection settings and call counters
+    def __init__(self, chain=None, recording=None, record_path=None, latency=0.0, rate_limit_every=0, max_calls_per_second=0,
+                 bscscan_upstream=DEFAULT_BSCSCAN_UPSTREAM, coingecko_upstream=DEFAULT_COINGECKO_UPSTREAM, rpc_max_log_blocks=0):
+        self.chain = chain
+        self.rpc_max_log_blocks = rpc_max_log_blocks
+        self.recording = recording # (path, params json) -> (status, body)
+        self.record_path = record_path
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.max_calls_per_second = max_calls_per_second
+        self.bscscan_upstream = bscscan_upstream
+        self.coingecko_upstream = coingecko_upstream
+        self.lock = threading.Lock()
+        self.calls = defaultdict(int)
+        self.bscscan_call_count = 0
+        self.recent_calls_by_key = defaultdict(list)
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.bscscan_call_count = 0
+            self.recent_calls_by_key.clear()
+
+    def stats(self):
+        with self.lock:
+            calls = dict(self.calls)
+        calls["total"] = sum(count for name, count in calls.items()
+                             if not name.startswith("injected_") and name not in ("replay_misses", "rpc_http_requests"))
+        return calls
+
+    def _injected_rate_limit(self, api_key):
+        # Every Nth BscScan call, or any call beyond max_calls_per_second for its key, gets BscScan's rate-limit reply
+        with self.lock:
+            self.bscscan_call_count += 1
+            if self.rate_limit_every and self.bscscan_call_count % self.rate_limit_every == 0:
+                self.calls["injected_rate_limits"] += 1
+                return True
+            if self.max_calls_per_second:
+                now = time.monotonic()
+                recent = [t for t in self.recent_calls_by_key[api_key] if now - t < 1.0]
+                self.recent_calls_by_key[api_key] = recent
+                if len(recent) >= self.max_calls_per_second:
+                    self.calls["injected_rate_limits"] += 1
+                    return True
+                recent.append(now)
+        return False
+
+    def handle(self, path, params):
+        # Returns (http status, JSON body)
+        service = "bscscan" if path.rstrip("/") == "/api" else "coingecko"
+        call_name = params.get("action") or path.rsplit("/", 1)[-1]
+        with self.lock:
+            self.calls[call_name] += 1
+        if self.latency: time.sleep(self.latency)
+        if service == "bscscan" and self._injected_rate_limit(params.get("apikey")):
+            return 200, RATE_LIMIT_RESULT
+
+        recorded_params = {name: value for name, value in params.items() if name != "apikey"}
+        if self.record_path:
+            return self._forward_and_record(service, path, params, recorded_params)
+        if self.recording is not None:
+            answer = self.recording.get((path, json.dumps(recorded_params, sort_keys=True)))
+            if answer is None:
+                with self.lock:
+                    self.calls["replay_misses"] += 1
+                return 404, {"error": f"No recorded response for {path} {recorded_params}"}
+            return answer
+        if service == "bscscan":
+            return 200, self._synthetic_bscscan(params)
+        return self._synthetic_coingecko(path, params)
+
+    def handle_rpc(self, payload):
+        # JSON-RPC over the synthetic chain; a batch is one HTTP request but every call in it is counted
+        if self.chain is None: return 404, {"error": "JSON-RPC is only served for synthetic wallets"}
+        calls = payload if isinstance(payload, list) else [payload]
+        with self.lock:
+            self.calls["rpc_http_requests"] += 1
+            for call in calls: self.calls["rpc:" + str(call.get("method"))] += 1
+        if self.latency: time.sleep(self.latency)
+        answers = [self._synthetic_rpc(call) for call in calls]
+        return 200, answers if isinstance(payload, list) else answers[0]
+
+    def _synthetic_rpc(self, call):
+        chain = self.chain
+        method, params = call.get("method"), call.get("params") or []
+        answer = {"jsonrpc": "2.0", "id": call.get("id")}
+        head_block = block_at(int(time.time()))
+        if method == "eth_blockNumber":
+            answer["result"] = hex(head_block)
+        elif method == "eth_getBlockByNumber":
+            block_number = head_block if params[0] == "latest" else int(params[0], 16)
+            answer["result"] = {"number": hex(block_number), "timestamp": hex(timestamp_of(block_number)),
+                                "hash": "0x%064x" % block_number} if block_number <= head_block else None
+        elif method == "eth_getLogs":
+            log_filter = params[0]
+            span = int(log_filter.get("toBlock", "0x0"), 16) - int(log_filter.get("fromBlock", "0x0"), 16) + 1
+            if self.rpc_max_log_blocks and span > self.rpc_max_log_blocks:
+                answer["error"] = {"code": -32005, "message": f"exceed maximum block range: {self.rpc_max_log_blocks}"}
+            else:
+                answer["result"] = chain.logs(log_filter)
+        elif method == "eth_getTransactionByHash":
+            answer["result"] = chain.transaction(params[0])
+        elif method == "eth_getTransactionReceipt":
+            answer["result"] = chain.receipt(params[0])
+        elif method == "eth_call":
+            answer.update(self._synthetic_bscscan({"action": "eth_call", "to": params[0].get("to", ""), "data": params[0].get("data")}))
+            answer["id"] = call.get("id")
+        else:
+            answer["error"] = {"code": -32601, "message": f"Method {method} not supported"}
+        return answer
+
+    def _forward_and_record(self, service, path, params, recorded_params):
+        upstream = self.bscscan_upstream if service == "bscscan" else self.coingecko_upstream + path[len("/api/v3"):]
+        response = requests.get(upstream, params=params, timeout=60)
+        try: body = response.json()
+        except ValueError: body = {"error": response.text[:500]}
+        with self.lock:
+            with open(self.record_path, "a", encoding="utf-8") as recording_file:
+                recording_file.write(json.dumps({"path": path, "params": recorded_params, "status": response.status_code, "body": body}) + "\n")
+        return response.status_code, body
+
+    def _synthetic_bscscan(self, params):
+        chain = self.chain
+        action = params.get("action")
+        if action in ("txlist", "tokentx"):
+            page, offset = int(params.get("page", 1)), int(params.get("offset", 10000))
+            if page * offset > LIST_RESULT_CAP:
+                return {"status": "0", "message": "NOTOK", "result": "Result window is too large, PageNo x Offset size must be less than or equal to 10000"}
+            start_block, end_block = int(params.get("startblock", 0)), int(params.get("endblock", 99999999))
+            rows = (chain.txlist_rows if action == "txlist" else chain.tokentx_rows)(params.get("address", ""), start_block, end_block)
+            page_rows = rows[(page - 1) * offset:page * offset]
+            if not page_rows: return {"status": "0", "message": "No transactions found", "result": []}
+            return {"status": "1", "message": "OK", "result": page_rows}
+        if action == "getblocknobytime":
+            timestamp = int(params["timestamp"])
+            block_number = block_at(timestamp)
+            if params.get("closest") == "after" and timestamp_of(block_number) < timestamp: block_number += 1
+            return {"status": "1", "message": "OK", "result": str(block_number)}
+        if action == "eth_getTransactionReceipt":
+            return {"jsonrpc": "2.0", "id": 1, "result": chain.receipt(params.get("txhash", ""))}
+        if action == "eth_blockNumber":
+            return {"jsonrpc": "2.0", "id": 1, "result": hex(block_at(int(time.time())))}
+        if action == "eth_call":
+            token = SYNTHETIC_TOKENS.get(params.get("to", "").lower())
+            if token is None: return {"jsonrpc": "2.0", "id": 1, "error": {"code": -32000, "message": "execution reverted"}}
+            name, symbol, decimals = token
+            result = {"0x313ce567": "0x%064x" % decimals, "0x06fdde03": encode_abi_string(name), "0x95d89b41": encode_abi_string(symbol)}
+            return {"jsonrpc": "2.0", "id": 1, "result": result.get(params.get("data"), "0x")}
+        return {"status": "0", "message": "NOTOK", "result": f"Unsupported action {action}"}
+
+    def _synthetic_coingecko(self, path, params):
+        if path.endswith("/market_chart/range"):
+            start_timestamp, end_timestamp = int(float(params["from"])), int(float(params["to"]))
+            # CoinGecko's automatic granularity: 5-minutely within a day, hourly up to 90 days, daily beyond
+            span = end_timestamp - start_timestamp
+            step = 300 if span <= 86400 else (3600 if span <= 90 * 86400 else 86400)
+            first = start_timestamp - start_timestamp % step + step
+            return 200, {"prices": [[t * 1000, bnb_price_at(t)] for t in range(first, end_timestamp + 1, step)]}
+        if path.endswith("/history"):
+            day, month, year = (int(part) for part in params["date"].split("-"))
+            midday = calendar.timegm((year, month, day, 12, 0, 0))
+            return 200, {"market_data": {"current_price": {"usd": bnb_price_at(midday)}}}
+        return 404, {"error": f"Unsupported CoinGecko path {path}"}
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    backend = None # Set on the subclass built by make_server
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real APIs
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == "/__stats":
+            return self._send_json(200, self.backend.stats())
+        status, body = self.backend.handle(parsed.path, dict(parse_qsl(parsed.query)))
+        self._send_json(status, body)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path == "/__reset":
+            self.backend.reset()
+            return self._send_json(200, {"ok": True})
+        if path.rstrip("/") == "/rpc":
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+            return self._send_json(*self.backend.handle_rpc(payload))
+        self._send_json(404, {"error": "Unknown endpoint"})
+
+    def log_message(self, format, *args):
+        pass # One line per API call would drown the benchmark output
+
+
+def load_recording(path):
+    recording = {}
+    with open(path, encoding="utf-8") as recording_file:
+        for line in recording_file:
+            if not line.strip(): continue
+            entry = json.loads(line)
+            recording[(entry["path"], json.dumps(entry["params"], sort_keys=True))] = (entry.get("status", 200), entry["body"])
+    return recording
+
+
+def build_synthetic_chain(seed=1, wallet_names=None):
+    chain = SyntheticChain(seed)
+    for name, (wallet_address, tx_count, start_time, days) in BENCH_WALLETS.items():
+        if wallet_names and name not in wallet_names: continue
+        start_timestamp = int(datetime.fromisoformat(start_time).timestamp())
+        chain.add_wallet(wallet_address, tx_count, start_timestamp, start_timestamp + days * 86400)
+    return chain
+
+
+def make_server(backend, host="127.0.0.1", port=0):
+    handler = type("BoundStubRequestHandler", (StubRequestHandler,), {"backend": backend})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local BscScan/CoinGecko stand-in for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port; the chosen one is printed on startup")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the synthetic wallets")
+    parser.add_argument("--wallets", default="", help="Comma-separated BENCH_WALLETS names to generate (default: all)")
+    parser.add_argument("--replay", help="Serve responses from this JSONL recording instead of synthetic data")
+    parser.add_argument("--record", help="Forward to the real APIs and append every exchange to this JSONL file")
+    parser.add_argument("--bscscan-upstream", default=DEFAULT_BSCSCAN_UPSTREAM)
+    parser.add_argument("--coingecko-upstream", default=DEFAULT_COINGECKO_UPSTREAM)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every Nth BscScan call with a rate-limit error")
+    parser.add_argument("--max-calls-per-second", type=float, default=0, help="Per-key BscScan budget; calls above it get a rate-limit error")
+    parser.add_argument("--rpc-max-log-blocks", type=int, default=0, help="Reject eth_getLogs spans wider than this many blocks (0: no limit)")
+    args = parser.parse_args()
+
+    chain = None
+    if not args.replay and not args.record:
+        chain = build_synthetic_chain(args.seed, [name for name in args.wallets.split(",") if name])
+    backend = StubBackend(chain=chain, recording=load_recording(args.replay) if args.replay else None, record_path=args.record,
+                          latency=args.latency, rate_limit_every=args.rate_limit_every, max_calls_per_second=args.max_calls_per_second,
+                          bscscan_upstream=args.bscscan_upstream, coingecko_upstream=args.coingecko_upstream,
+                          rpc_max_log_blocks=args.rpc_max_log_blocks)
+    server = make_server(backend, args.host, args.port)
+    print(f"STUB_LISTENING http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 document.getElementById('submitBtn').addEventListener('click', async function() {
     const walletAddress = document.getElementById('walletAddress').value.trim();
     const apiKey = document.getElementById('apiKey').value.trim();
+    const startTime = document.getElementById('startTime').value;
+    const endTime = document.getElementById('endTime').value;
     const resultsArea = document.getElementById('resultsArea');
     const loadingIndicator = document.getElementById('loadingIndicator');
     const errorDisplay = document.getElementById('errorDisplay');
@@ -19,37 +21,64 @@ document.getElementById('submitBtn').addEventListener('click', async function()
         errorDisplay.style.display = 'block';
         return;
     }
+    if (endTime && !startTime) {
+        errorDisplay.textContent = 'Please enter a Start Time when an End Time is set.';
+        errorDisplay.style.display = 'block';
+        return;
+    }
 
     loadingIndicator.style.display = 'block';
 
+    // Without a start time the server analyses today's 08:00 Beijing window
+    const requestBody = { wallet_address: walletAddress, bsc_api_key: apiKey, limit: TABLE_PAGE_ROWS };
+    if (startTime) requestBody.start_time = startTime;
+    if (endTime) requestBody.end_time = endTime;
+
     try {
-        const response = await fetch('/get_transactions', {
+        const response = await fetch('/get_transactions_table_stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ wallet_address: walletAddress, bsc_api_key: apiKey }),
+            body: JSON.stringify(requestBody),
         });
 
-        loadingIndicator.style.display = 'none';
-
         if (!response.ok) {
             const errorData = await response.json().catch(() => ({ error: `HTTP error! Status: ${response.status}` }));
             throw new Error(errorData.error || `HTTP error! Status: ${response.status}`);
         }
 
-        const data = await response.json();
-
-        if (data.error) {
-             throw new Error(data.error);
-        }
-
-        displaySummary(data.summary);
-        displayTransactionsTable(data.transactions_in_time_window);
-        displayRealizedTradesTable(data.realized_trades_log_fifo);
-        displayOutstandingHoldings(data.outstanding_holdings_fifo);
+        // Rows are shown as the server classifies them; the final "table" event switches both tables to
+        // server-side paging, which is when sorting, the type filter and transaction details become available
+        document.getElementById('summaryDetails').innerHTML = '';
+        document.getElementById('outstandingHoldings').innerHTML = '';
+        document.getElementById('transactionDetail').style.display = 'none';
+        setupTypeFilter(null);
+        transactionsTable.startStreaming();
+        realizedTradesTable.startStreaming();
         resultsArea.style.display = 'block';
 
+        await readNdjsonStream(response, event => {
+            if (event.event === 'block_range') {
+                displaySummary({ block_range_queried: event.block_range_queried, transactions_to_process: event.transactions_to_process });
+            } else if (event.event === 'transaction_row') {
+                transactionsTable.appendRows([event.row]);
+            } else if (event.event === 'trade_rows') {
+                realizedTradesTable.appendRows(event.rows);
+            } else if (event.event === 'table') {
+                loadingIndicator.style.display = 'none';
+                displaySummary(event.summary);
+                setupTypeFilter(event.type_counts);
+                transactionsTable.load(event.table_id, event.transactions);
+                realizedTradesTable.load(event.table_id, event.trades);
+                displayOutstandingHoldings(event.outstanding_holdings_fifo);
+                transactionsTable.render();
+                realizedTradesTable.render();
+            } else if (event.event === 'error') {
+                throw new Error(event.error);
+            }
+        });
+
     } catch (error) {
         loadingIndicator.style.display = 'none';
         console.error('Error fetching or processing data:', error);
@@ -58,6 +87,21 @@ document.getElementById('submitBtn').addEventListener('click', async function()
     }
 });
 
+async function readNdjsonStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+        const lines = buffered.split('\n');
+        buffered = lines.pop(); // Keep the trailing partial line for the next chunk
+        lines.filter(line => line.trim()).forEach(line => onEvent(JSON.parse(line)));
+        if (done) break;
+    }
+    if (buffered.trim()) onEvent(JSON.parse(buffered));
+}
+
 function displaySummary(summary) {
     const summaryDiv = document.getElementById('summaryDetails');
     summaryDiv.innerHTML = ''; // Clear previous
@@ -67,135 +111,298 @@ function displaySummary(summary) {
     for (const key in summary) {
         const li = document.createElement('li');
         const readableKey = key.replace(/_/g, ' ').replace(/\b\w/g, l => l.toUpperCase()); // Make key readable
-        li.innerHTML = `<strong>${readableKey}:</strong> ${summary[key]}`;
+        const value = typeof summary[key] === 'object' && summary[key] !== null ? JSON.stringify(summary[key]) : summary[key];
+        li.innerHTML = `<strong>${readableKey}:</strong> ${value}`;
         ul.appendChild(li);
     }
     summaryDiv.appendChild(ul);
 }
 
-function displayTransactionsTable(transactions) {
-    const table = document.getElementById('transactionsTable');
-    const thead = table.querySelector('thead');
-    const tbody = table.querySelector('tbody');
-    thead.innerHTML = '';
-    tbody.innerHTML = '';
+const TABLE_PAGE_ROWS = 200; // Rows per /tables request; pages are cached per table view
+const TABLE_OVERSCAN_ROWS = 10; // Rows rendered above and below the visible ones
 
-    if (!transactions || transactions.length === 0) {
-        tbody.innerHTML = '<tr><td colspan="10">No transactions found in the specified time window.</td></tr>';
-        return;
+// Column names match the server's columnar tables (TRANSACTION_TABLE_COLUMNS / REALIZED_TRADE_TABLE_COLUMNS)
+const TRANSACTION_HEADERS = [
+    { key: "hash", display: "Hash", format: 'tx' },
+    { key: "timestamp_unix", display: "Timestamp (UTC)", format: 'utc' },
+    { key: "type", display: "Type (Wallet)" },
+    { key: "main_token_symbol", display: "Main Token" },
+    { key: "main_token_quantity", display: "Main Token Qty" },
+    { key: "value_amount", display: "Est. Value", format: 'amount' },
+    { key: "value_currency", display: "Value Currency" },
+    { key: "realized_pnl", display: "Realized P/L (This Tx)", format: 'amount' },
+    { key: "from", display: "From", format: 'address' },
+    { key: "to", display: "To", format: 'address' },
+    { key: "transfer_count", display: "BEP20 Transfers" },
+];
+
+const REALIZED_TRADE_HEADERS = [
+    { key: "token_symbol", display: "Token" },
+    { key: "quantity_matched", display: "Qty Matched", format: 'quantity' },
+    { key: "buy_cost_per_unit_usdt", display: "Buy Cost/Unit (USDT)", format: 'amount' },
+    { key: "sell_proceeds_per_unit_usdt", display: "Sell Price/Unit (USDT)", format: 'amount' },
+    { key: "pnl", display: "P/L (USDT)", format: 'amount' },
+    { key: "buy_tx_hash", display: "Buy Tx", format: 'tx' },
+    { key: "sell_tx_hash", display: "Sell Tx", format: 'tx' },
+    { key: "sell_timestamp", display: "Sell Timestamp", format: 'local' }
+];
+
+function shortenHex(value) {
+    return value.length > 12 ? `${value.substring(0, 6)}...${value.substring(value.length - 4)}` : value;
+}
+
+function formatCell(td, header, value) {
+    if (value === null || value === undefined) {
+        td.textContent = 'N/A';
+    } else if (header.format === 'tx' || header.format === 'address') {
+        const link = document.createElement('a');
+        link.href = `https://bscscan.com/${header.format}/${value}`;
+        link.textContent = shortenHex(value);
+        link.target = "_blank";
+        td.appendChild(link);
+    } else if (header.format === 'utc') {
+        td.textContent = new Date(value * 1000).toISOString().replace('T', ' ').substring(0, 19) + ' UTC';
+    } else if (header.format === 'local') {
+        td.textContent = new Date(value * 1000).toLocaleString();
+    } else if (header.format === 'amount') {
+        td.textContent = value.toFixed(2);
+    } else if (header.format === 'quantity') {
+        td.textContent = value.toFixed(6);
+    } else {
+        td.textContent = value;
     }
+}
 
-    // Define desired headers and the corresponding data keys
-    // Adjusted to match the Python output structure more closely
-    const headers = [
-        { key: "hash", display: "Hash" },
-        { key: "timestamp_utc", display: "Timestamp (UTC)" },
-        { key: "classification_details.type", display: "Type (Wallet)" },
-        { key: "classification_details.main_token_symbol", display: "Main Token" },
-        { key: "classification_details.main_token_quantity", display: "Main Token Qty" },
-        { key: "estimated_transaction_value_usdt_equivalent.amount", display: "Est. Value" },
-        { key: "estimated_transaction_value_usdt_equivalent.currency", display: "Value Currency" },
-        { key: "realized_pnl_for_this_sell_tx_usdt", display: "Realized P/L (This Tx)" },
-        { key: "tx_from_address", display: "From" },
-        { key: "tx_to_address", display: "To" },
-        // { key: "bep20_token_transfers", display: "BEP20 Transfers (Details)"} // Might be too complex for simple cell
-    ];
-
-    const trHead = document.createElement('tr');
-    headers.forEach(header => {
-        const th = document.createElement('th');
-        th.textContent = header.display;
-        trHead.appendChild(th);
-    });
-    thead.appendChild(trHead);
+// A table that keeps only the rows inside its scroll viewport in the DOM. Rows come from
+// /tables/<table_id>/<tableName> in pages of TABLE_PAGE_ROWS, fetched as they scroll into view;
+// spacer rows above and below stand in for the rest, so render cost does not grow with the row count.
+// While an analysis streams (startStreaming / appendRows) there is no table_id yet: rows are kept
+// locally in the same page layout, and sorting waits for load() to switch to server paging.
+function createVirtualTable(tableId, tableName, headers, emptyMessage, onRowClick) {
+    const table = document.getElementById(tableId);
+    const viewport = table.parentElement;
+    const view = { tableId: null, total: 0, sortBy: null, descending: false, filterValues: [], pages: new Map(), generation: 0 };
+    let rowHeight = 37; // Re-measured from the first rendered row
+    let renderQueued = false;
 
-    transactions.forEach(tx => {
-        const tr = document.createElement('tr');
+    function setupHeaders() {
+        const thead = table.querySelector('thead');
+        thead.innerHTML = '';
+        const trHead = document.createElement('tr');
         headers.forEach(header => {
-            const td = document.createElement('td');
-            let value = getNestedValue(tx, header.key);
-            if (value === null || value === undefined) value = 'N/A';
-            
-            if (header.key === "hash" || header.key === "tx_from_address" || header.key === "tx_to_address") {
-                const shortVal = value.length > 12 ? `${value.substring(0, 6)}...${value.substring(value.length - 4)}` : value;
-                const link = document.createElement('a');
-                link.href = `https://bscscan.com/tx/${tx.hash}`; // Link for hash, adjust for addresses
-                if(header.key !== "hash") link.href = `https://bscscan.com/address/${value}`;
-                link.textContent = shortVal;
-                link.target = "_blank";
-                td.appendChild(link);
-            } else if (typeof value === 'object') {
-                td.textContent = JSON.stringify(value, null, 2).substring(0, 100) + "..."; // Simple display for objects
-            } else {
-                td.textContent = value;
-            }
-            tr.appendChild(td);
+            const th = document.createElement('th');
+            th.textContent = header.display + (view.sortBy === header.key ? (view.descending ? ' ▼' : ' ▲') : '');
+            th.addEventListener('click', () => {
+                if (!view.tableId) return; // Still streaming
+                // First click sorts ascending, a second click on the same column descending
+                view.descending = view.sortBy === header.key && !view.descending;
+                view.sortBy = header.key;
+                reload();
+            });
+            trHead.appendChild(th);
         });
-        tbody.appendChild(tr);
-    });
-}
+        thead.appendChild(trHead);
+    }
 
-function displayRealizedTradesTable(trades) {
-    const table = document.getElementById('realizedTradesTable');
-    const thead = table.querySelector('thead');
-    const tbody = table.querySelector('tbody');
-    thead.innerHTML = '';
-    tbody.innerHTML = '';
+    function storePage(page) {
+        view.total = page.total;
+        view.pages.set(Math.floor(page.offset / TABLE_PAGE_ROWS), page.columns);
+    }
 
-    if (!trades || trades.length === 0) {
-        tbody.innerHTML = '<tr><td colspan="8">No realized trades (FIFO) logged for this period.</td></tr>';
-        return;
+    function pageColumns(index) {
+        const columns = view.pages.get(Math.floor(index / TABLE_PAGE_ROWS));
+        return columns && columns !== 'loading' ? columns : null;
+    }
+
+    async function fetchPage(pageIndex) {
+        if (!view.tableId || view.pages.has(pageIndex)) return;
+        view.pages.set(pageIndex, 'loading');
+        const generation = view.generation;
+        const params = new URLSearchParams({ offset: pageIndex * TABLE_PAGE_ROWS, limit: TABLE_PAGE_ROWS });
+        if (view.sortBy) params.set('sort_by', view.sortBy);
+        if (view.descending) params.set('descending', '1');
+        view.filterValues.forEach(value => params.append('type', value));
+        try {
+            const response = await fetch(`/tables/${view.tableId}/${tableName}?${params}`);
+            const page = await response.json();
+            if (!response.ok) throw new Error(page.error || `HTTP error! Status: ${response.status}`);
+            if (generation !== view.generation) return; // Sort or filter changed while this page was loading
+            storePage(page);
+            render();
+        } catch (error) {
+            if (generation === view.generation) view.pages.delete(pageIndex);
+            console.error(`Error loading ${tableName} rows:`, error);
+        }
     }
-    const headers = [
-        { key: "token_symbol", display: "Token" },
-        { key: "quantity_matched", display: "Qty Matched" },
-        { key: "buy_cost_per_unit_usdt", display: "Buy Cost/Unit (USDT)" },
-        { key: "sell_proceeds_per_unit_usdt", display: "Sell Price/Unit (USDT)" },
-        { key: "pnl", display: "P/L (USDT)" },
-        { key: "buy_tx_hash", display: "Buy Tx" },
-        { key: "sell_tx_hash", display: "Sell Tx" },
-        { key: "sell_timestamp", display: "Sell Timestamp" }
-    ];
-    const trHead = document.createElement('tr');
-    headers.forEach(header => {
-        const th = document.createElement('th');
-        th.textContent = header.display;
-        trHead.appendChild(th);
-    });
-    thead.appendChild(trHead);
 
-    trades.forEach(trade => {
+    function reload() {
+        view.generation++;
+        view.pages.clear();
+        view.total = 0;
+        viewport.scrollTop = 0;
+        setupHeaders();
+        render();
+        fetchPage(0);
+    }
+
+    function spacerRow(height) {
         const tr = document.createElement('tr');
-        headers.forEach(header => {
-            const td = document.createElement('td');
-            let value = getNestedValue(trade, header.key);
-            if (value === null || value === undefined) value = 'N/A';
-            
-            if (header.key === "sell_timestamp" || header.key === "buy_timestamp") {
-                 value = new Date(value * 1000).toLocaleString();
-            } else if (typeof value === 'number' && (header.key.includes('pnl') || header.key.includes('cost') || header.key.includes('proceeds'))){
-                 value = value.toFixed(2);
-            } else if (typeof value === 'number' && header.key.includes('quantity')){
-                 value = value.toFixed(6);
-            }
+        tr.className = 'virtual-spacer';
+        tr.style.height = `${height}px`;
+        return tr;
+    }
 
+    function renderNow() {
+        renderQueued = false;
+        const tbody = table.querySelector('tbody');
+        tbody.innerHTML = '';
+        if (view.total === 0) {
+            if (pageColumns(0)) tbody.innerHTML = `<tr><td colspan="${headers.length}">${emptyMessage}</td></tr>`;
+            return;
+        }
+        const first = Math.max(0, Math.floor(viewport.scrollTop / rowHeight) - TABLE_OVERSCAN_ROWS);
+        const last = Math.min(view.total, Math.ceil((viewport.scrollTop + viewport.clientHeight) / rowHeight) + TABLE_OVERSCAN_ROWS);
+        for (let pageIndex = Math.floor(first / TABLE_PAGE_ROWS); pageIndex <= Math.floor((last - 1) / TABLE_PAGE_ROWS); pageIndex++) {
+            fetchPage(pageIndex);
+        }
 
-            if (header.key === "buy_tx_hash" || header.key === "sell_tx_hash") {
-                const shortVal = value.length > 12 ? `${value.substring(0, 6)}...${value.substring(value.length - 4)}` : value;
-                const link = document.createElement('a');
-                link.href = `https://bscscan.com/tx/${value}`;
-                link.textContent = shortVal;
-                link.target = "_blank";
-                td.appendChild(link);
-            } else {
-                td.textContent = value;
+        const fragment = document.createDocumentFragment();
+        if (first > 0) fragment.appendChild(spacerRow(first * rowHeight));
+        for (let index = first; index < last; index++) {
+            const tr = document.createElement('tr');
+            const columns = pageColumns(index);
+            const position = index % TABLE_PAGE_ROWS;
+            headers.forEach(header => {
+                const td = document.createElement('td');
+                if (columns) formatCell(td, header, columns[header.key][position]);
+                else td.textContent = '…'; // Page still loading
+                tr.appendChild(td);
+            });
+            if (columns && onRowClick && view.tableId) {
+                const hash = columns.hash[position];
+                tr.classList.add('clickable-row');
+                tr.addEventListener('click', event => { if (event.target.tagName !== 'A') onRowClick(view.tableId, hash); });
             }
-            tr.appendChild(td);
-        });
-        tbody.appendChild(tr);
+            fragment.appendChild(tr);
+        }
+        if (last < view.total) fragment.appendChild(spacerRow((view.total - last) * rowHeight));
+        tbody.appendChild(fragment);
+
+        const sample = tbody.querySelector('tr:not(.virtual-spacer)');
+        const measured = sample ? sample.getBoundingClientRect().height : 0;
+        if (measured && Math.abs(measured - rowHeight) > 0.5) {
+            rowHeight = measured;
+            render();
+        }
+    }
+
+    function render() {
+        if (renderQueued) return;
+        renderQueued = true;
+        requestAnimationFrame(renderNow);
+    }
+
+    viewport.addEventListener('scroll', render);
+
+    return {
+        startStreaming() {
+            view.tableId = null;
+            view.sortBy = null;
+            view.descending = false;
+            view.filterValues = [];
+            view.generation++;
+            view.pages.clear();
+            view.total = 0;
+            viewport.scrollTop = 0;
+            setupHeaders();
+            render();
+        },
+        appendRows(rows) {
+            rows.forEach(row => {
+                const pageIndex = Math.floor(view.total / TABLE_PAGE_ROWS);
+                if (!view.pages.has(pageIndex)) {
+                    view.pages.set(pageIndex, Object.fromEntries(Object.keys(row).map(key => [key, []])));
+                }
+                const columns = view.pages.get(pageIndex);
+                Object.keys(columns).forEach(key => columns[key].push(row[key]));
+                view.total++;
+            });
+            render();
+        },
+        load(tableIdValue, firstPage) {
+            view.tableId = tableIdValue;
+            view.sortBy = null;
+            view.descending = false;
+            view.filterValues = [];
+            view.generation++;
+            view.pages.clear();
+            storePage(firstPage);
+            viewport.scrollTop = 0;
+            setupHeaders();
+        },
+        setFilter(values) {
+            view.filterValues = values;
+            reload();
+        },
+        render,
+    };
+}
+
+const transactionsTable = createVirtualTable('transactionsTable', 'transactions', TRANSACTION_HEADERS,
+    'No transactions found in the specified time window.', displayTransactionDetail);
+const realizedTradesTable = createVirtualTable('realizedTradesTable', 'trades', REALIZED_TRADE_HEADERS,
+    'No realized trades (FIFO) logged for this period.', null);
+
+function setupTypeFilter(typeCounts) {
+    const select = document.getElementById('typeFilter');
+    select.innerHTML = '';
+    select.disabled = !typeCounts; // Filtering needs the server's table
+    const allOption = document.createElement('option');
+    allOption.value = '';
+    allOption.textContent = 'All types';
+    select.appendChild(allOption);
+    Object.keys(typeCounts || {}).sort().forEach(type => {
+        const option = document.createElement('option');
+        option.value = type;
+        option.textContent = `${type} (${typeCounts[type]})`;
+        select.appendChild(option);
     });
 }
 
+document.getElementById('typeFilter').addEventListener('change', function() {
+    transactionsTable.setFilter(this.value ? [this.value] : []);
+});
+
+// BEP-20 transfers are not part of the table pages; they are loaded for one transaction when its row is clicked
+async function displayTransactionDetail(tableId, txHash) {
+    const div = document.getElementById('transactionDetail');
+    div.style.display = 'block';
+    div.textContent = 'Loading transaction details...';
+    try {
+        const response = await fetch(`/tables/${tableId}/transactions/${txHash}`);
+        const tx = await response.json();
+        if (!response.ok) throw new Error(tx.error || `HTTP error! Status: ${response.status}`);
+
+        div.innerHTML = '';
+        const title = document.createElement('h4');
+        title.textContent = `Transaction ${tx.hash} (block ${tx.block_number})`;
+        div.appendChild(title);
+        const basis = document.createElement('p');
+        basis.textContent = `Value basis: ${(tx.estimated_transaction_value_usdt_equivalent || {}).basis || 'N/A'}`;
+        div.appendChild(basis);
+        const ul = document.createElement('ul');
+        (tx.bep20_token_transfers || []).forEach(transfer => {
+            const li = document.createElement('li');
+            li.textContent = `${transfer.human_readable_amount} ${transfer.token_symbol} (${transfer.token_name}): ${shortenHex(transfer.from)} → ${shortenHex(transfer.to)}`;
+            ul.appendChild(li);
+        });
+        if (!ul.children.length) ul.innerHTML = '<li>No BEP-20 transfers.</li>';
+        div.appendChild(ul);
+    } catch (error) {
+        div.textContent = `Could not load transaction details: ${error.message}`;
+    }
+}
+
 
 function displayOutstandingHoldings(holdings) {
     const div = document.getElementById('outstandingHoldings');
@@ -223,18 +430,3 @@ function displayOutstandingHoldings(holdings) {
         }
     }
 }
-
-
-function getNestedValue(obj, path) {
-    if (!path) return obj;
-    const parts = path.split('.');
-    let current = obj;
-    for (let i = 0; i < parts.length; i++) {
-        if (current && typeof current === 'object' && parts[i] in current) {
-            current = current[parts[i]];
-        } else {
-            return undefined; // Path does not exist
-        }
-    }
-    return current;
-}
\ No newline at end of file
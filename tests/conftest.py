@@ -0,0 +1,8 @@
+# app.py reads its configuration when imported, so point its caches at a scratch file first
+import os
+import sys
+import tempfile
+
+os.environ["BSC_CACHE_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bsc-tests-"), "cache.sqlite3")
+os.environ["BSC_DATA_SOURCE"] = "bscscan"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
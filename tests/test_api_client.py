@@ -0,0 +1,102 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def fake_bscscan(monkeypatch):
+    # Records the key of every attempt; "bad" keys are rejected the way BscScan rejects them
+    used_keys = []
+
+    def send_api_request_server(url, params, source="BscScan", is_proxied_block_request=False, json_payload=None):
+        used_keys.append(params["apikey"])
+        if params["apikey"].startswith("bad"): raise app.InvalidApiKeyError("BscScan API Error: NOTOK - Invalid API Key")
+        return "0x1"
+    monkeypatch.setattr(app, "send_api_request_server", send_api_request_server)
+    monkeypatch.setattr(app.time, "sleep", lambda seconds: None)
+    return used_keys
+
+
+def use_pool(monkeypatch, configured_keys):
+    pool = app.ApiKeyPool(configured_keys, 1000)
+    monkeypatch.setattr(app, "bscscan_api_key_pool", pool)
+    return pool
+
+
+def test_invalid_request_key_is_dropped_when_server_keys_exist(monkeypatch, fake_bscscan):
+    use_pool(monkeypatch, ["server-1"])
+    results = [app.make_api_request_server(app.BSCSCAN_API_URL, {"action": "eth_blockNumber"}, "bad-user-key") for _ in range(20)]
+
+    assert results == ["0x1"] * 20
+    assert fake_bscscan.count("bad-user-key") <= 1
+
+
+def test_invalid_key_is_an_error_without_other_keys(monkeypatch, fake_bscscan):
+    use_pool(monkeypatch, [])
+
+    with pytest.raises(app.InvalidApiKeyError):
+        app.make_api_request_server(app.BSCSCAN_API_URL, {"action": "eth_blockNumber"}, "bad-user-key")
+    assert fake_bscscan == ["bad-user-key"]
+
+
+def test_invalid_server_key_leaves_the_rotation(monkeypatch, fake_bscscan):
+    use_pool(monkeypatch, ["bad-server-key", "server-2"])
+    for _ in range(10):
+        app.make_api_request_server(app.BSCSCAN_API_URL, {"action": "eth_blockNumber"}, None)
+
+    assert fake_bscscan.count("bad-server-key") == 1
+
+
+@pytest.fixture
+def frozen_clock(monkeypatch):
+    # Buckets only refill when the test says so
+    monkeypatch.setattr(app.time, "monotonic", lambda: 1000.0)
+
+
+def test_pool_hands_out_the_key_that_frees_up_first(monkeypatch, frozen_clock):
+    monkeypatch.setattr(app.time, "sleep", lambda seconds: None)
+    pool = app.ApiKeyPool(["server-1", "server-2"], 1)
+
+    assert [pool.acquire("user-key") for _ in range(3)] == ["server-1", "server-2", "user-key"]
+    assert pool.acquire(None) in ("server-1", "server-2") # Without a request key only the server keys are used
+
+
+def test_penalized_key_is_passed_over(frozen_clock):
+    pool = app.ApiKeyPool(["server-1", "server-2"], 1)
+    pool.penalize("server-1", 30)
+    pool.penalize("unknown-key", 30) # Keys without a bucket are ignored
+
+    assert pool.acquire(None) == "server-2"
+
+
+def test_transient_errors_are_retried_with_backoff_on_another_key(monkeypatch):
+    use_pool(monkeypatch, ["server-1", "server-2"])
+    used_keys, sleeps = [], []
+
+    def send_api_request_server(url, params, source="BscScan", is_proxied_block_request=False, json_payload=None):
+        used_keys.append(params["apikey"])
+        if len(used_keys) < 3: raise app.TransientApiError("BscScan rate limit reached")
+        return "0x1"
+    monkeypatch.setattr(app, "send_api_request_server", send_api_request_server)
+    monkeypatch.setattr(app.time, "sleep", sleeps.append)
+
+    assert app.make_api_request_server(app.BSCSCAN_API_URL, {"action": "eth_blockNumber"}, None) == "0x1"
+    assert used_keys[:2] == ["server-1", "server-2"] # The key that just failed is held back
+    # Jittered exponential backoff after each failure (the pool may also wait for a penalized key to cool down)
+    assert app.API_RETRY_BASE_DELAY * 0.5 <= sleeps[0] <= app.API_RETRY_BASE_DELAY * 1.5
+    assert app.API_RETRY_BASE_DELAY * 2 * 0.5 <= sleeps[1] <= app.API_RETRY_BASE_DELAY * 2 * 1.5
+
+
+def test_transient_errors_give_up_after_the_retry_budget(monkeypatch):
+    use_pool(monkeypatch, ["server-1"])
+    attempts = []
+
+    def send_api_request_server(url, params, source="BscScan", is_proxied_block_request=False, json_payload=None):
+        attempts.append(params["apikey"])
+        raise app.TransientApiError("HTTP 503")
+    monkeypatch.setattr(app, "send_api_request_server", send_api_request_server)
+    monkeypatch.setattr(app.time, "sleep", lambda seconds: None)
+
+    with pytest.raises(Exception, match="gave up after"):
+        app.make_api_request_server(app.BSCSCAN_API_URL, {"action": "eth_blockNumber"}, None)
+    assert len(attempts) == app.API_MAX_RETRIES + 1
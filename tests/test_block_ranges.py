@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+
+import app
+
+WALLET = "0x5a11000000000000000000000000000000000001"
+
+
+@pytest.mark.parametrize("start_block, end_block, shard_count", [(100, 199, 4), (100, 102, 10), (5, 5, 3), (0, 1000, 7)])
+def test_split_block_range_is_contiguous_and_clamped(start_block, end_block, shard_count):
+    shards = app.split_block_range(start_block, end_block, shard_count)
+
+    assert len(shards) == min(shard_count, end_block - start_block + 1)
+    assert shards[0][0] == start_block and shards[-1][1] == end_block
+    assert all(shard_start <= shard_end for shard_start, shard_end in shards)
+    assert all(shards[i][1] + 1 == shards[i + 1][0] for i in range(len(shards) - 1))
+
+
+class FakeAccountList:
+    # Serves account list queries from a fixed row set with BscScan's paging and result cap
+    def __init__(self, rows):
+        self.rows = rows
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def __call__(self, url, params, current_bsc_api_key, **kwargs):
+        with self.lock:
+            self.calls.append((params["startblock"], params["endblock"], params["page"]))
+        if params["page"] * params["offset"] > app.ACCOUNT_LIST_RESULT_CAP: return {"status": "0", "message": "Result window is too large"}
+        in_range = [row for row in self.rows if params["startblock"] <= int(row["blockNumber"]) <= params["endblock"]]
+        first = (params["page"] - 1) * params["offset"]
+        return in_range[first:first + params["offset"]]
+
+
+def account_rows(blocks):
+    return [{"hash": f"0x{block:04x}{i:02x}", "logIndex": str(i), "blockNumber": str(block)} for block, count in blocks for i in range(count)]
+
+
+@pytest.fixture
+def small_pages(monkeypatch):
+    monkeypatch.setattr(app, "ACCOUNT_LIST_PAGE_SIZE", 2)
+    monkeypatch.setattr(app, "ACCOUNT_LIST_RESULT_CAP", 4)
+    monkeypatch.setattr(app, "ACCOUNT_LIST_SHARD_BLOCKS", 50)
+
+
+def test_capped_shards_are_split_until_every_row_is_fetched(monkeypatch, small_pages):
+    # 14 rows crowded into a few blocks, far over the 4-row cap of any one query
+    rows = account_rows([(100, 1), (101, 3), (102, 2), (130, 1), (160, 3), (161, 1), (199, 3)])
+    fake = FakeAccountList(rows)
+    monkeypatch.setattr(app, "make_api_request_server", fake)
+
+    fetched = app.fetch_account_rows_by_blockrange_server("tokentx", WALLET, 100, 199, "key")
+
+    assert fetched == rows
+    assert len({(start, end) for start, end, _ in fake.calls}) > 2 # The two initial shards were split further
+
+
+def test_tokentx_rows_without_log_index_are_all_kept(monkeypatch, small_pages):
+    # BscScan's tokentx rows carry no logIndex: both legs of a swap share the tx hash and must both survive
+    pool, token = "0x9999999999999999999999999999999999999999", "0x3333333333333333333333333333333333333333"
+    swap = [{"hash": "0xaa", "blockNumber": "120", "contractAddress": app.WBNB_ADDRESS, "from": WALLET, "to": pool,
+             "value": str(10**18), "tokenName": "Wrapped BNB", "tokenSymbol": "WBNB", "tokenDecimal": "18"},
+            {"hash": "0xaa", "blockNumber": "120", "contractAddress": token, "from": pool, "to": WALLET,
+             "value": str(7 * 10**6), "tokenName": "Delta", "tokenSymbol": "DELTA", "tokenDecimal": "6"}]
+    monkeypatch.setattr(app, "make_api_request_server", FakeAccountList(swap))
+    monkeypatch.setattr(app.bnb_price_series, "price_at", lambda timestamp: 600.0)
+
+    fetched = app.fetch_account_rows_by_blockrange_server("tokentx", WALLET, 100, 199, "key")
+    _, classification, value, _ = app.TransferLogBatch.from_tokentx_rows(WALLET, fetched).describe("0xaa", 0, None)
+
+    assert fetched == swap
+    assert (classification["type"], classification["main_token_symbol"], classification["main_token_quantity"]) == ("Buy", "DELTA", 7.0)
+    assert value["amount"] == "600.0"
+
+
+def test_block_over_the_result_cap_is_an_error(monkeypatch, small_pages):
+    monkeypatch.setattr(app, "make_api_request_server", FakeAccountList(account_rows([(150, 5)])))
+
+    with pytest.raises(Exception, match="more than 4 rows in block 150"):
+        app.fetch_account_rows_by_blockrange_server("txlist", WALLET, 100, 199, "key")
+
+
+def test_failed_page_is_an_error(monkeypatch, small_pages):
+    monkeypatch.setattr(app, "make_api_request_server", lambda *args, **kwargs: None)
+
+    with pytest.raises(Exception, match="Failed to fetch transactions page 1"):
+        app.fetch_account_rows_by_blockrange_server("txlist", WALLET, 100, 199, "key")
+
+
+def transfer_log(block, log_index, tx_hash, from_addr, to_addr):
+    def topic(address): return "0x" + "0" * 24 + address[2:]
+    return {"blockNumber": hex(block), "logIndex": hex(log_index), "transactionHash": tx_hash, "data": "0x01",
+            "address": "0x2222222222222222222222222222222222222222",
+            "topics": [app.BEP20_TRANSFER_EVENT_SIGNATURE, topic(from_addr), topic(to_addr)]}
+
+
+def test_rpc_transfer_logs_split_rejected_spans(monkeypatch):
+    other = "0x7777777777777777777777777777777777777777"
+    logs = [transfer_log(990, 0, "0xcc", other, WALLET), transfer_log(100, 4, "0xaa", WALLET, other),
+            transfer_log(500, 1, "0xbb", WALLET, WALLET)] # A self-transfer matches both topic filters
+    data_source = app.JsonRpcDataSource("http://node.invalid")
+    data_source.log_range_blocks = 1000
+    spans = []
+
+    def call_batch(calls):
+        answers = []
+        for method, (log_filter,) in calls:
+            from_block, to_block = int(log_filter["fromBlock"], 16), int(log_filter["toBlock"], 16)
+            spans.append(to_block - from_block + 1)
+            if to_block - from_block + 1 > 300:
+                answers.append((None, {"code": -32005, "message": "block range too wide"}))
+                continue
+            wallet_topic = "0x" + "0" * 24 + WALLET[2:]
+            answers.append(([log_entry for log_entry in logs if from_block <= int(log_entry["blockNumber"], 16) <= to_block
+                             and log_entry["topics"][1 if log_filter["topics"][1] else 2] == wallet_topic], None))
+        return answers
+    monkeypatch.setattr(data_source, "call_batch", call_batch)
+
+    fetched = data_source.transfer_logs(WALLET, 100, 1099)
+
+    assert [log_entry["transactionHash"] for log_entry in fetched] == ["0xaa", "0xbb", "0xcc"]
+    assert data_source.log_range_blocks <= 300
+    # Later queries start at the accepted span instead of being rejected first
+    spans.clear()
+    data_source.transfer_logs(WALLET, 2000, 2999)
+    assert max(spans) <= 300
+
+
+def test_rpc_transfer_logs_fail_when_one_block_is_rejected(monkeypatch):
+    data_source = app.JsonRpcDataSource("http://node.invalid")
+    monkeypatch.setattr(data_source, "call_batch", lambda calls: [(None, {"message": "query returned more than 10000 results"})] * len(calls))
+
+    with pytest.raises(Exception, match="eth_getLogs failed for block 7"):
+        data_source.transfer_logs(WALLET, 7, 8)
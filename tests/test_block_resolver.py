@@ -0,0 +1,129 @@
+import time
+
+import pytest
+
+import app
+
+GENESIS_TIMESTAMP = int(time.time()) - 2 * 86400 # Recent enough for memoized boundaries to be reloaded
+BLOCK_SECONDS = 0.75
+
+
+def block_timestamp(block_number):
+    return GENESIS_TIMESTAMP + int(block_number * BLOCK_SECONDS)
+
+
+def last_block_at_or_before(timestamp):
+    block_number = int((timestamp - GENESIS_TIMESTAMP + 1) / BLOCK_SECONDS) + 1
+    while block_timestamp(block_number) > timestamp: block_number -= 1
+    return block_number
+
+
+def first_block_at_or_after(timestamp):
+    block_number = last_block_at_or_before(timestamp)
+    return block_number if block_timestamp(block_number) == timestamp else block_number + 1
+
+
+@pytest.fixture
+def resolver(tmp_path):
+    return app.BlockTimestampResolver(str(tmp_path / "anchors.sqlite3"), 100)
+
+
+def anchor(block_number):
+    return block_timestamp(block_number), block_number
+
+
+def test_no_anchors_means_no_bounds(resolver):
+    assert resolver.bounds(GENESIS_TIMESTAMP + 100) is None
+
+
+@pytest.mark.parametrize("seconds_after_genesis", [
+    6000, # Before the first anchor
+    7500, 9001, 12345, 15000, 22499, # At and between anchors
+    22501, 23000, 26000, # After the last anchor
+])
+def test_bounds_bracket_the_true_block(resolver, seconds_after_genesis):
+    resolver.learn([anchor(10000), anchor(20000), anchor(30000)])
+    timestamp = GENESIS_TIMESTAMP + seconds_after_genesis
+    lower, upper = resolver.bounds(timestamp)
+
+    assert lower <= last_block_at_or_before(timestamp) <= upper
+    assert lower <= first_block_at_or_after(timestamp) # Also a safe start block for the window
+
+
+def test_bounds_between_anchors_are_tight(resolver):
+    resolver.learn([anchor(10000), anchor(10040)])
+    lower, upper = resolver.bounds(block_timestamp(10020))
+
+    assert upper - lower <= 40 + 2 * app.BLOCK_RESOLVER_SLACK_BLOCKS
+
+
+def test_exact_timestamps_only_answers_anchors(resolver):
+    resolver.learn([anchor(10000), anchor(20000)])
+
+    assert resolver.exact_timestamps([10000, 15000, 20000]) == {10000: block_timestamp(10000), 20000: block_timestamp(20000)}
+
+
+def test_anchors_and_boundaries_persist(tmp_path):
+    db_path = str(tmp_path / "anchors.sqlite3")
+    first = app.BlockTimestampResolver(db_path, 100)
+    first.learn([anchor(20000), anchor(10000)])
+    first.remember_boundary(GENESIS_TIMESTAMP + 9000, 'before', 12000)
+
+    reloaded = app.BlockTimestampResolver(db_path, 100)
+    assert reloaded.exact_timestamps([10000, 20000]) == {10000: block_timestamp(10000), 20000: block_timestamp(20000)}
+    assert reloaded.get_boundary(GENESIS_TIMESTAMP + 9000, 'before') == 12000
+
+
+def test_thinning_keeps_the_newest_anchors(tmp_path):
+    db_path = str(tmp_path / "anchors.sqlite3")
+    resolver = app.BlockTimestampResolver(db_path, 8)
+    resolver.learn([anchor(block_number) for block_number in range(1000, 10000, 1000)])
+
+    # Every other anchor of the older half is dropped, in memory and on disk
+    assert resolver.blocks == [1000, 3000, 5000, 6000, 7000, 8000, 9000]
+    assert app.BlockTimestampResolver(db_path, 8).exact_timestamps(range(1000, 10000, 1000)).keys() == set(resolver.blocks)
+
+
+@pytest.fixture
+def fake_block_api(monkeypatch, resolver):
+    calls = []
+
+    def get_block_number_by_timestamp(timestamp, closest_option, current_bsc_api_key):
+        calls.append((timestamp, closest_option))
+        return last_block_at_or_before(timestamp) if closest_option == 'before' else first_block_at_or_after(timestamp)
+    monkeypatch.setattr(app, "block_timestamp_resolver", resolver)
+    monkeypatch.setattr(app, "get_block_number_by_timestamp_bsc_server", get_block_number_by_timestamp)
+    return calls
+
+
+def test_resolve_block_range_memoizes_window_boundaries(resolver, fake_block_api):
+    start, end = GENESIS_TIMESTAMP + 3600, GENESIS_TIMESTAMP + 7200
+    expected = (first_block_at_or_after(start), last_block_at_or_before(end), last_block_at_or_before(end))
+
+    assert app.resolve_block_range_server(start, end, "key") == expected
+    assert len(fake_block_api) == 2
+    # Another wallet analysing the same window needs no lookups
+    assert app.resolve_block_range_server(start, end, "key") == expected
+    assert len(fake_block_api) == 2
+    assert resolver.stats()["api_lookups"] == 2
+
+
+def test_resolve_block_range_uses_narrow_anchor_bounds(resolver, fake_block_api):
+    resolver.learn([anchor(10000), anchor(10400)])
+    start, end = block_timestamp(10100), block_timestamp(10300) + 1
+    start_block, end_block, confirmed_end_block = app.resolve_block_range_server(start, end, "key")
+
+    assert fake_block_api == []
+    assert resolver.stats()["index_answers"] == 2
+    assert start_block <= first_block_at_or_after(start)
+    assert confirmed_end_block <= last_block_at_or_before(end) <= end_block
+
+
+def test_resolve_block_range_refines_wide_bounds_with_the_api(resolver, fake_block_api):
+    resolver.learn([anchor(10000), anchor(10000 + 2 * app.BLOCK_RESOLVER_MAX_UNCERTAINTY_BLOCKS)])
+    start, end = block_timestamp(10100), block_timestamp(10900)
+
+    assert app.resolve_block_range_server(start, end, "key") == (
+        first_block_at_or_after(start), last_block_at_or_before(end), last_block_at_or_before(end))
+    assert [closest for _, closest in fake_block_api] == ['after', 'before']
+
@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+import app
+
+HOUR = 3600
+NOW = int(time.time()) // HOUR * HOUR
+
+
+@pytest.fixture
+def series(tmp_path):
+    return app.BnbPriceSeries(str(tmp_path / "prices.sqlite3"))
+
+
+def load(series, points):
+    series._connection()
+    series.timestamps = sorted(points)
+    series.prices = [points[timestamp] for timestamp in series.timestamps]
+
+
+def test_price_between_points_is_interpolated(series):
+    load(series, {10 * HOUR: 600.0, 11 * HOUR: 610.0})
+
+    assert series.price_at(10 * HOUR) == 600.0
+    assert series.price_at(10 * HOUR + 900) == pytest.approx(602.5)
+
+
+def test_price_falls_back_to_the_nearest_point_across_a_gap(series):
+    gap = app.BNB_PRICE_MAX_GAP_SECONDS
+    load(series, {10 * HOUR: 600.0, 10 * HOUR + 3 * gap: 700.0})
+
+    assert series.price_at(10 * HOUR + 60) == 600.0 # Only the earlier point is close enough
+    assert series.price_at(10 * HOUR + 3 * gap - 60) == 700.0 # Only the later one
+    assert series.price_at(10 * HOUR + int(1.5 * gap)) is None # Neither
+    assert series.price_at(10 * HOUR + 5 * gap) is None # Past the end of the series
+    assert (series.hits, series.misses) == (2, 2)
+
+
+@pytest.fixture
+def fake_coingecko(monkeypatch):
+    # Answers market_chart/range with a point every `spacing` seconds; records each (from, to) asked for
+    calls = []
+    spacing = [HOUR]
+
+    def make_api_request_server(url, params, current_bsc_api_key, source="BscScan", **kwargs):
+        calls.append((params["from"], params["to"]))
+        return {"prices": [[timestamp * 1000, 600.0] for timestamp in range(params["from"], params["to"] + 1, spacing[0])]}
+    monkeypatch.setattr(app, "make_api_request_server", make_api_request_server)
+    return calls, spacing
+
+
+def test_long_ranges_are_fetched_in_chunks_once(series, fake_coingecko):
+    calls, _ = fake_coingecko
+    start, end = NOW - 200 * 86400, NOW - 86400
+    series.ensure_range(start, end)
+
+    assert len(calls) == 3
+    assert all(to - frm <= app.BNB_PRICE_FETCH_CHUNK_SECONDS for frm, to in calls)
+    assert calls[0][0] == start - app.BNB_PRICE_FETCH_PADDING_SECONDS
+    assert calls[-1][1] == end + app.BNB_PRICE_FETCH_PADDING_SECONDS
+    series.ensure_range(start + 86400, end - 86400)
+    assert len(calls) == 3 # Covered by the cached ranges
+    reloaded = app.BnbPriceSeries(series.db_path)
+    reloaded.ensure_range(start, end)
+    assert len(calls) == 3 # Points and covered ranges were persisted
+    assert reloaded.price_at(start + 1800) == 600.0
+
+
+def test_sparse_data_is_not_marked_as_covered(series, fake_coingecko):
+    calls, spacing = fake_coingecko
+    spacing[0] = 86400 # Daily points, as CoinGecko returns for long spans
+    series.ensure_range(NOW - 10 * 86400, NOW - 5 * 86400)
+    series.ensure_range(NOW - 10 * 86400, NOW - 5 * 86400)
+
+    assert len(calls) == 2
+    assert series.ranges == []
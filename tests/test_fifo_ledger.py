@@ -0,0 +1,119 @@
+import pytest
+
+import app
+
+TOKEN = "0x2222222222222222222222222222222222222222"
+SCALE = app.FifoLotLedger.USDT_SCALE
+
+
+def trade(tx_type, raw_qty, decimals=0, symbol="ALPHA", token=TOKEN):
+    return {"type": tx_type, "main_token_symbol": symbol, "main_token_address": token,
+            "main_token_raw_quantity": str(raw_qty), "main_token_decimals": decimals}
+
+
+def test_partial_sell_splits_lot_cost_proportionally():
+    ledger = app.FifoLotLedger()
+    ledger.apply("0xb1", 100, trade("Buy", 4 * 10**18, decimals=18), 100.0)
+    pnl, trades = ledger.apply("0xs1", 200, trade("Sell", 10**18, decimals=18), 40.0)
+
+    assert pnl == 15.0 # 40 proceeds - a quarter of the 100 cost
+    assert len(trades) == 1
+    assert trades[0]["quantity_matched"] == 1.0
+    assert trades[0]["buy_cost_per_unit_usdt"] == 25.0
+    assert trades[0]["sell_proceeds_per_unit_usdt"] == 40.0
+    (lot,) = ledger.lots[TOKEN]
+    assert lot.raw_qty == 3 * 10**18
+    assert lot.cost_scaled == 75 * SCALE
+
+
+def test_sell_spanning_lots_matches_oldest_first():
+    ledger = app.FifoLotLedger()
+    ledger.apply("0xb1", 100, trade("Buy", 2), 10.0)
+    ledger.apply("0xb2", 110, trade("Buy", 2), 30.0)
+    pnl, trades = ledger.apply("0xs1", 200, trade("Sell", 3), 60.0)
+
+    assert [t["buy_tx_hash"] for t in trades] == ["0xb1", "0xb2"]
+    assert [t["quantity_matched"] for t in trades] == [2.0, 1.0]
+    assert [t["pnl"] for t in trades] == [30.0, 5.0] # 40 - 10, then 20 - 15
+    assert pnl == 35.0
+    (lot,) = ledger.lots[TOKEN]
+    assert (lot.tx_hash, lot.raw_qty, lot.cost_scaled) == ("0xb2", 1, 15 * SCALE)
+
+
+def test_repeated_partial_fills_conserve_cost_exactly():
+    # 10 USDT over 3 units does not divide evenly; the last fragment takes the remainder
+    ledger = app.FifoLotLedger()
+    ledger.apply("0xb1", 100, trade("Buy", 3), 10.0)
+    for i in range(3):
+        ledger.apply(f"0xs{i}", 200 + i, trade("Sell", 1), 4.0)
+
+    assert TOKEN not in ledger.lots
+    assert ledger.realized_pnl_scaled == 2 * SCALE
+    assert ledger.realized_pnl_usdt() == 2.0
+
+
+def test_sell_larger_than_open_lots_matches_what_is_held():
+    ledger = app.FifoLotLedger()
+    ledger.apply("0xb1", 100, trade("Buy", 2), 10.0)
+    pnl, trades = ledger.apply("0xs1", 200, trade("Sell", 4), 40.0)
+
+    # Only half the sale is matched, so only half the proceeds count
+    assert trades[0]["quantity_matched"] == 2.0
+    assert pnl == 10.0
+    assert ledger.lots == {}
+
+
+def test_realized_loss_only_sums_losing_fragments():
+    ledger = app.FifoLotLedger()
+    ledger.apply("0xb1", 100, trade("Buy", 1), 10.0)
+    ledger.apply("0xb2", 110, trade("Buy", 1), 30.0)
+    ledger.apply("0xs1", 200, trade("Sell", 2), 40.0) # +10 on the first lot, -10 on the second
+
+    assert ledger.realized_pnl_usdt() == 0.0
+    assert ledger.realized_loss_usdt() == -10.0
+
+
+@pytest.mark.parametrize("details, value", [
+    (trade("Send", 1), 10.0),
+    (trade("Buy", 1), 0.0),
+    (trade("Buy", "N/A"), 10.0),
+    (dict(trade("Buy", 1), main_token_decimals=None), 10.0),
+])
+def test_non_trades_and_unvalued_txs_are_ignored(details, value):
+    ledger = app.FifoLotLedger()
+    assert ledger.apply("0xt", 100, details, value) == (0.0, [])
+    assert ledger.lots == {}
+
+
+def test_sell_without_lots_realizes_nothing():
+    ledger = app.FifoLotLedger()
+    assert ledger.apply("0xs1", 100, trade("Sell", 1), 10.0) == (0.0, [])
+
+
+def test_outstanding_holdings_shape():
+    ledger = app.FifoLotLedger()
+    ledger.apply("0xb1", 100, trade("Buy", 5 * 10**9, decimals=9, symbol="BETA"), 20.0)
+
+    assert ledger.outstanding_holdings() == {
+        "BETA": [{"qty": 5.0, "cost_pu_usdt": 4.0, "tx_hash_buy": "0xb1", "timestamp_buy": 100}]}
+
+
+def test_apply_many_streams_payloads_in_order():
+    ledger = app.FifoLotLedger()
+    txs = [("0xb1", 100, trade("Buy", 2), 10.0, "first"), ("0xs1", 200, trade("Sell", 2), 16.0, "second")]
+    results = ledger.apply_many(iter(txs))
+
+    assert next(results) == ("first", 0.0, [])
+    payload, pnl, trades = next(results)
+    assert (payload, pnl, len(trades)) == ("second", 6.0, 1)
+    assert next(results, None) is None
+
+
+def test_apply_many_rejects_out_of_order_txs_across_calls():
+    ledger = app.FifoLotLedger()
+    list(ledger.apply_many([("0xb1", 200, trade("Buy", 1), 10.0, None)]))
+
+    with pytest.raises(app.FifoOrderError):
+        list(ledger.apply_many([("0xs1", 199, trade("Sell", 1), 10.0, None)]))
+    # Equal timestamps (same block) are in order
+    assert len(list(ledger.apply_many([("0xs2", 200, trade("Sell", 1), 12.0, None)]))) == 1
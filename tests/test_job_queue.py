@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+import app
+
+WALLET = "0x5a11000000000000000000000000000000000001"
+
+
+@pytest.fixture
+def result_cache(monkeypatch, tmp_path):
+    result_cache = app.AnalysisResultCache(str(tmp_path / "results.sqlite3"), 10**6, 10**6, 60)
+    monkeypatch.setattr(app, "analysis_result_cache", result_cache)
+    return result_cache
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def test_async_request_answered_from_the_cache_returns_a_finished_job(result_cache, client, monkeypatch):
+    monkeypatch.setattr(app, "run_wallet_analysis_job", lambda params: pytest.fail("the cached result should be used"))
+    start_time = int(time.time()) - 7200
+    params, _ = app.parse_wallet_analysis_request({"wallet_address": WALLET, "bsc_api_key": "key", "start_time": start_time})
+    result_cache.put(params["key"], {"summary": {"wallet_address": WALLET}}, final=False)
+
+    response = client.post("/get_transactions", json={"wallet_address": WALLET, "bsc_api_key": "key",
+                                                      "start_time": start_time, "async": True})
+
+    assert response.status_code == 202
+    job = client.get(response.get_json()["status_url"]).get_json()
+    assert (job["status"], job["result"]) == ("done", {"summary": {"wallet_address": WALLET}})
+
+
+@pytest.fixture
+def queue():
+    queue = app.AnalysisJobQueue(max_workers=2, max_pending=2, result_ttl_seconds=60, max_retained=10)
+    yield queue
+    queue.executor.shutdown(wait=True)
+
+
+def test_identical_submissions_share_one_job(queue):
+    release = app.threading.Event()
+    runs = []
+
+    def analysis(wallet):
+        runs.append(wallet)
+        release.wait(5)
+        return {"wallet": wallet}
+
+    first, first_coalesced = queue.submit(("w", 1), analysis, "w")
+    second, second_coalesced = queue.submit(("w", 1), analysis, "w")
+    other, _ = queue.submit(("v", 1), analysis, "v")
+    release.set()
+    for job in (first, other): assert job.done.wait(5)
+
+    assert (first_coalesced, second_coalesced, second is first) == (False, True, True)
+    assert first.result == {"wallet": "w"} and first.to_dict()["coalesced_requests"] == 2
+    assert sorted(runs) == ["v", "w"]
+    assert queue.stats()["submitted"] == 2 and queue.stats()["coalesced"] == 1
+
+
+def test_finished_keys_start_a_new_job(queue):
+    first, _ = queue.submit(("w", 1), lambda: 1)
+    assert first.done.wait(5)
+    second, coalesced = queue.submit(("w", 1), lambda: 2)
+    assert second.done.wait(5)
+
+    assert (coalesced, second is first, second.result) == (False, False, 2)
+    assert queue.get(first.job_id) is first # Still readable for polling
+
+
+def test_full_queue_rejects_new_keys_but_still_coalesces(queue):
+    release = app.threading.Event()
+    jobs = [queue.submit((key,), release.wait, 5)[0] for key in ("a", "b")]
+
+    with pytest.raises(app.JobQueueFullError):
+        queue.submit(("c",), release.wait, 5)
+    assert queue.submit(("a",), release.wait, 5) == (jobs[0], True)
+    release.set()
+    assert all(job.done.wait(5) for job in jobs)
+    assert queue.stats()["rejected"] == 1
+
+
+def test_failed_job_reports_its_error(queue):
+    def analysis():
+        raise ValueError("node unreachable")
+    job, _ = queue.submit(("w",), analysis)
+    assert job.done.wait(5)
+
+    assert job.to_dict()["status"] == "error" and job.to_dict()["error"] == "node unreachable"
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+import app
+
+GENESIS_TIMESTAMP = int(time.time()) - 86400
+HEAD_BLOCK = 100000
+
+
+def block_timestamp(block_number):
+    # 0.75s blocks rounded down to whole seconds, so some neighbouring blocks share a timestamp
+    return GENESIS_TIMESTAMP + int(block_number * 0.75)
+
+
+def last_block_at_or_before(timestamp):
+    blocks = [block for block in range(HEAD_BLOCK + 1) if block_timestamp(block) <= timestamp]
+    return blocks[-1] if blocks else None
+
+
+def first_block_at_or_after(timestamp):
+    return next((block for block in range(HEAD_BLOCK + 1) if block_timestamp(block) >= timestamp), None)
+
+
+@pytest.fixture
+def source(monkeypatch, tmp_path):
+    # A JSON-RPC source over a synthetic chain; records the block numbers of each batched request
+    source = app.JsonRpcDataSource("http://node.invalid")
+    source.batches = []
+
+    def call_batch(calls):
+        source.batches.append([params[0] for _, params in calls])
+        answers = []
+        for method, params in calls:
+            assert method == "eth_getBlockByNumber"
+            block_number = HEAD_BLOCK if params[0] == "latest" else int(params[0], 16)
+            answers.append(({"number": hex(block_number), "timestamp": hex(block_timestamp(block_number))}, None))
+        return answers
+    monkeypatch.setattr(source, "call_batch", call_batch)
+    monkeypatch.setattr(app, "block_timestamp_resolver", app.BlockTimestampResolver(str(tmp_path / "anchors.sqlite3"), 100))
+    return source
+
+
+@pytest.mark.parametrize("seconds_after_genesis", [0, 1, 2, 3, 4567, 30000, 74998, 74999])
+def test_block_by_timestamp_matches_getblocknobytime(source, seconds_after_genesis):
+    timestamp = GENESIS_TIMESTAMP + seconds_after_genesis
+
+    assert source.block_number_by_timestamp(timestamp, 'before', None) == last_block_at_or_before(timestamp)
+    assert source.block_number_by_timestamp(timestamp, 'after', None) == first_block_at_or_after(timestamp)
+
+
+def test_timestamps_outside_the_chain(source):
+    head_timestamp = block_timestamp(HEAD_BLOCK)
+
+    assert source.block_number_by_timestamp(head_timestamp + 60, 'before', None) == HEAD_BLOCK
+    assert source.block_number_by_timestamp(head_timestamp + 60, 'after', None) is None
+    assert source.block_number_by_timestamp(head_timestamp, 'after', None) == first_block_at_or_after(head_timestamp)
+    assert source.block_number_by_timestamp(GENESIS_TIMESTAMP - 60, 'before', None) is None
+    assert source.block_number_by_timestamp(GENESIS_TIMESTAMP - 60, 'after', None) == 0
+
+
+def test_head_shortcut_needs_one_request(source):
+    source.block_number_by_timestamp(block_timestamp(HEAD_BLOCK) + 60, 'before', None)
+
+    assert source.batches == [["latest"]]
+
+
+def test_search_rounds_are_batched(source):
+    source.block_number_by_timestamp(GENESIS_TIMESTAMP + 30000, 'before', None)
+    rounds = source.batches[1:]
+
+    assert all(len(probes) <= app.RPC_BLOCK_SEARCH_PROBES for probes in rounds)
+    assert len(rounds) <= 5 # 17-ary search over 100000 blocks
+
+
+def test_anchor_estimate_shortens_the_search(source):
+    timestamp = GENESIS_TIMESTAMP + 30000
+    app.block_timestamp_resolver.learn([(block_timestamp(block), block) for block in (39990, 40030)])
+
+    assert source.block_number_by_timestamp(timestamp, 'before', None) == last_block_at_or_before(timestamp)
+    assert source.batches[1] == [hex(block) for block in app.block_timestamp_resolver.bounds(timestamp)] # Probed first
+    assert len(source.batches) <= 4 # The head, the estimate's bounds, then a search inside them (5 without anchors)
@@ -0,0 +1,15 @@
+import app
+
+
+def test_api_endpoint_labels():
+    assert app.api_endpoint_label(app.BSCSCAN_API_URL, {"module": "account", "action": "tokentx"}) == "tokentx"
+    assert app.api_endpoint_label("https://api.coingecko.com/api/v3/coins/binancecoin/market_chart/range", {}) == "range"
+    assert app.api_endpoint_label("http://node", {}, {"method": "eth_call"}) == "eth_call"
+
+
+def test_json_rpc_batches_are_labelled_by_all_their_methods():
+    batch = [{"method": "eth_getTransactionByHash"}, {"method": "eth_getTransactionReceipt"},
+             {"method": "eth_getTransactionByHash"}, {"method": "eth_blockNumber"}]
+
+    assert app.api_endpoint_label("http://node", {}, batch) == "eth_blockNumber+eth_getTransactionByHash+eth_getTransactionReceipt"
+    assert app.api_endpoint_label("http://node", {}, [{"method": "eth_getLogs"}] * 3) == "eth_getLogs"
@@ -0,0 +1,46 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # A monotonic clock the test moves by hand
+    now = [1000.0]
+    monkeypatch.setattr(app.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_reservations_are_spaced_by_the_rate(clock):
+    limiter = app.TokenBucketRateLimiter(4)
+
+    assert [limiter.reserve() for _ in range(3)] == [0, 0.25, 0.5]
+    assert limiter.next_available_delay() == 0.75
+
+
+def test_tokens_refill_up_to_the_burst(clock):
+    limiter = app.TokenBucketRateLimiter(2, burst=3)
+    for _ in range(3): limiter.reserve()
+    assert limiter.next_available_delay() == 0.5
+
+    clock[0] += 60 # A long idle period only refills the burst
+    assert [limiter.reserve() for _ in range(4)] == [0, 0, 0, 0.5]
+
+
+def test_penalize_pushes_the_next_token_back(clock):
+    limiter = app.TokenBucketRateLimiter(5)
+    limiter.penalize(2)
+
+    assert limiter.next_available_delay() == pytest.approx(2)
+    clock[0] += 2
+    assert limiter.reserve() == 0
+
+
+def test_acquire_sleeps_only_when_over_budget(clock, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(app.time, "sleep", sleeps.append)
+    limiter = app.TokenBucketRateLimiter(10)
+    limiter.acquire()
+    limiter.acquire()
+
+    assert sleeps == [pytest.approx(0.1)]
@@ -0,0 +1,111 @@
+import itertools
+import time
+
+import pytest
+
+import app
+
+WALLET = "0x5a11000000000000000000000000000000000001"
+POOL = "0x9999999999999999999999999999999999999999"
+TOKEN = "0x2222222222222222222222222222222222222222"
+APPROVAL_EVENT_SIGNATURE = "0x8c5be1e5ebec7d5bd14f71427d1e84f3dd0314c0f7b2291e5b200ac8c7c3b925"
+
+
+def topic(address):
+    return "0x" + "0" * 24 + address[2:]
+
+
+def transfer_log(token, from_addr, to_addr, raw_amount):
+    return {"address": token, "topics": [app.BEP20_TRANSFER_EVENT_SIGNATURE, topic(from_addr), topic(to_addr)],
+            "data": "0x" + format(raw_amount, "064x")}
+
+
+def receipt(block_number, *logs):
+    return {"blockNumber": hex(block_number), "logs": list(logs)}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return app.ReceiptStore(str(tmp_path / "receipts.sqlite3"), 1024 * 1024, confirmation_depth=15)
+
+
+@pytest.fixture
+def ticking_clock(monkeypatch):
+    # Distinct last_access stamps, so LRU order does not depend on the real clock's resolution
+    ticks = itertools.count(1_700_000_000)
+    monkeypatch.setattr(app.time, "time", lambda: float(next(ticks)))
+
+
+def test_round_trip_keeps_only_transfer_logs(store):
+    original = receipt(100,
+                       transfer_log(app.USDT_ADDRESS, WALLET, POOL, 100 * 10**18),
+                       {"address": TOKEN, "topics": [APPROVAL_EVENT_SIGNATURE, topic(WALLET), topic(POOL)], "data": "0x" + "0" * 64},
+                       transfer_log(TOKEN, POOL, WALLET, 5 * 10**9))
+    store.put_many({"0xAA": original}, chain_head_block=115)
+    cached = store.get_many(["0xaa"])
+
+    assert list(cached) == ["0xaa"] # Keys are stored lowercase
+    assert cached["0xaa"] == receipt(100, original["logs"][0], original["logs"][2])
+
+
+def test_encode_decode_round_trip_of_odd_data_lengths():
+    logs = [dict(transfer_log(TOKEN, WALLET, POOL, 0), data="0x"), dict(transfer_log(TOKEN, POOL, WALLET, 0), data="0x0102ff")]
+    payload = app.ReceiptStore.encode_receipt(receipt(7, *logs))
+
+    assert app.ReceiptStore.decode_receipt(7, payload) == receipt(7, *logs)
+
+
+def test_receipts_that_cannot_be_packed_are_not_cached(store):
+    short_token = dict(transfer_log(TOKEN, WALLET, POOL, 1), address="0x22")
+    odd_hex = dict(transfer_log(TOKEN, WALLET, POOL, 1), data="0x123")
+    store.put_many({"0xaa": receipt(100, short_token), "0xbb": receipt(100, odd_hex), "0xcc": {"blockNumber": hex(100)}},
+                   chain_head_block=200)
+
+    assert store.get_many(["0xaa", "0xbb", "0xcc"]) == {}
+    assert store.stats()["stores"] == 0
+
+
+def test_confirmation_depth_cutoff(store):
+    store.put_many({"0xaa": receipt(101), "0xbb": receipt(100)}, chain_head_block=115)
+
+    assert list(store.get_many(["0xaa", "0xbb"])) == ["0xbb"]
+    # Without a known head nothing is final
+    store.put_many({"0xcc": receipt(1)}, chain_head_block=None)
+    assert store.get_many(["0xcc"]) == {}
+
+
+def test_hit_and_miss_counts(store):
+    store.put_many({"0xaa": receipt(1), "0xbb": receipt(2)}, chain_head_block=100)
+    store.get_many(["0xaa", "0xAA", "0xcc", ""]) # Duplicates and empty hashes are not counted twice
+    store.get_many(["0xbb"])
+
+    assert store.stats() == {"hits": 2, "misses": 1, "stores": 2, "evictions": 0}
+
+
+def test_least_recently_used_receipts_are_evicted(tmp_path, ticking_clock):
+    one_log = transfer_log(TOKEN, WALLET, POOL, 1)
+    row_size = len(app.ReceiptStore.encode_receipt(receipt(1, one_log))) + len("0xa1")
+    store = app.ReceiptStore(str(tmp_path / "receipts.sqlite3"), int(row_size * 2.5), confirmation_depth=0)
+    store.put_many({"0xa1": receipt(1, one_log)}, chain_head_block=10)
+    store.put_many({"0xa2": receipt(2, one_log)}, chain_head_block=10)
+    store.get_many(["0xa1"]) # 0xa2 is now the least recently used
+    store.put_many({"0xa3": receipt(3, one_log)}, chain_head_block=10)
+
+    assert sorted(store.get_many(["0xa1", "0xa2", "0xa3"])) == ["0xa1", "0xa3"]
+    assert store.stats()["evictions"] == 1
+
+
+def test_tx_summaries_are_cached_separately(store):
+    row = {"hash": "0xaa", "blockNumber": "100", "from": WALLET, "to": POOL, "value": "0", "timeStamp": "1714608000"}
+    store.put_tx_summaries([row, dict(row, hash="0xbb", blockNumber="101")], chain_head_block=115)
+
+    assert store.get_tx_summaries(["0xaa", "0xbb"]) == {"0xaa": row}
+    assert store.get_many(["0xaa"]) == {}
+
+
+def test_closed_windows_cache_receipts_up_to_their_last_block():
+    now = int(time.time())
+
+    assert app.receipt_cache_head_block(5000, 4990, now) == 4990
+    closed_end = now - app.RESULT_CACHE_FINALITY_SECONDS - 1
+    assert app.receipt_cache_head_block(5000, 4990, closed_end) == 5000 + app.RECEIPT_CONFIRMATION_DEPTH
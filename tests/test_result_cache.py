@@ -0,0 +1,79 @@
+import gzip
+import json
+import time
+
+import pytest
+
+import app
+
+WALLET = "0x5a11000000000000000000000000000000000001"
+RESULT = {"summary": {"wallet_address": WALLET}}
+
+
+@pytest.fixture
+def result_cache(monkeypatch, tmp_path):
+    result_cache = app.AnalysisResultCache(str(tmp_path / "results.sqlite3"), 10**6, 10**6, 60)
+    monkeypatch.setattr(app, "analysis_result_cache", result_cache)
+    monkeypatch.setattr(app, "run_wallet_analysis_job", lambda params: pytest.fail("the cached result should be used"))
+    return result_cache
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def cache_result(result_cache, final):
+    start_time = int(time.time()) - 7200
+    params, _ = app.parse_wallet_analysis_request({"wallet_address": WALLET, "bsc_api_key": "key", "start_time": start_time})
+    return start_time, result_cache.put(params["key"], RESULT, final=final)
+
+
+def get_result(client, start_time, **headers):
+    return client.get(f"/get_transactions?wallet_address={WALLET}&start_time={start_time}",
+                      headers=dict(headers, **{"X-BscScan-Api-Key": "key"}))
+
+
+def test_get_answers_carry_etag_and_cache_control(result_cache, client):
+    start_time, entry = cache_result(result_cache, final=False)
+    response = get_result(client, start_time)
+
+    assert response.status_code == 200 and response.get_json() == RESULT
+    assert response.headers["ETag"] == entry.etag
+    assert response.headers["Cache-Control"].startswith("private, max-age=")
+    assert 0 < int(response.headers["Cache-Control"].split("=")[1]) <= 60 # Open windows expire with the cache entry
+
+
+def test_final_results_are_cacheable_for_a_day(result_cache, client):
+    start_time, _ = cache_result(result_cache, final=True)
+
+    assert get_result(client, start_time).headers["Cache-Control"] == "private, max-age=86400"
+
+
+def test_matching_if_none_match_gets_304(result_cache, client):
+    start_time, entry = cache_result(result_cache, final=True)
+    response = get_result(client, start_time, **{"If-None-Match": entry.etag})
+
+    assert response.status_code == 304 and response.data == b""
+    assert response.headers["ETag"] == entry.etag
+    assert get_result(client, start_time, **{"If-None-Match": '"stale"'}).status_code == 200
+
+
+def test_gzip_body_is_sent_as_stored(result_cache, client):
+    start_time, entry = cache_result(result_cache, final=True)
+    response = get_result(client, start_time, **{"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.data == entry.body_gzip
+    assert json.loads(gzip.decompress(response.data)) == RESULT
+
+
+def test_post_answers_are_200_and_point_at_the_get_url(result_cache, client):
+    start_time, entry = cache_result(result_cache, final=True)
+    response = client.post("/get_transactions", json={"wallet_address": WALLET, "bsc_api_key": "key", "start_time": start_time},
+                           headers={"If-None-Match": entry.etag})
+
+    assert response.status_code == 200 and response.get_json() == RESULT
+    assert "Cache-Control" not in response.headers
+    location = response.headers["Content-Location"]
+    assert client.get(location, headers={"X-BscScan-Api-Key": "key", "If-None-Match": entry.etag}).status_code == 304
@@ -0,0 +1,122 @@
+import json
+import time
+
+import pytest
+
+import app
+
+WALLET = "0x5a11000000000000000000000000000000000001"
+
+
+@pytest.fixture
+def result_cache(monkeypatch, tmp_path):
+    result_cache = app.AnalysisResultCache(str(tmp_path / "results.sqlite3"), 10**6, 10**6, 60)
+    monkeypatch.setattr(app, "analysis_result_cache", result_cache)
+    return result_cache
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def tx(tx_hash, timestamp, tx_type):
+    return {"hash": tx_hash, "timestamp_unix": timestamp, "classification_details": {"type": tx_type}}
+
+
+@pytest.fixture
+def fake_sync(monkeypatch):
+    # Stands in for the chain sync: applies two txs and one FIFO match, counting the analyses run
+    runs = []
+
+    def iter_wallet_sync_events(state, bsc_api_key, start_timestamp_unix_utc, end_timestamp_unix_utc):
+        runs.append(state)
+        yield {"event": "block_range", "start_block": 1, "end_block": 2, "block_range_queried": "1-2",
+               "transactions_in_block_range_fetched": 2, "transactions_to_process": 2}
+        for detail in (tx("0xaa", start_timestamp_unix_utc + 1, "Buy"), tx("0xbb", start_timestamp_unix_utc + 2, "Sell")):
+            state.record_transaction(detail)
+            yield {"event": "transaction", "transaction": detail}
+        trade = {"token_symbol": "TKN", "pnl": 1.5, "buy_tx_hash": "0xaa", "sell_tx_hash": "0xbb"}
+        state.realized_trades_log.append(trade)
+        yield {"event": "trades", "trades": [trade]}
+    monkeypatch.setattr(app, "iter_wallet_sync_events", iter_wallet_sync_events)
+    return runs
+
+
+def stream_events(client, body):
+    response = client.post("/get_transactions_table_stream", json=body)
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_table_stream_sends_rows_before_the_table(result_cache, client, fake_sync):
+    body = {"wallet_address": WALLET, "bsc_api_key": "key", "start_time": int(time.time()) - 7200, "limit": 1}
+    events = stream_events(client, body)
+
+    assert [event["event"] for event in events] == ["block_range", "transaction_row", "transaction_row", "trade_rows", "table"]
+    assert [events[1]["row"]["hash"], events[2]["row"]["type"]] == ["0xaa", "Sell"]
+    assert events[3]["rows"][0]["pnl"] == 1.5
+    table = events[-1]
+    assert (table["transactions"]["total"], table["transactions"]["columns"]["hash"]) == (2, ["0xaa"])
+    assert table["type_counts"] == {"Buy": 1, "Sell": 1}
+    page = client.get(f"/tables/{table['table_id']}/transactions?offset=1&limit=1").get_json()
+    assert page["columns"]["hash"] == ["0xbb"]
+
+    # The result was cached, so asking again sends only the table
+    assert [event["event"] for event in stream_events(client, body)] == ["table"]
+    assert len(fake_sync) == 1
+
+
+def test_table_stream_rejects_unknown_sort_columns_up_front(result_cache, client, fake_sync):
+    response = client.post("/get_transactions_table_stream", json={"wallet_address": WALLET, "bsc_api_key": "key",
+                                                                   "sort_by": "nonsense"})
+
+    assert response.status_code == 400
+    assert fake_sync == []
+
+
+ROWS = [
+    {"hash": "0x1", "timestamp_unix": 30, "type": "Buy", "value": 5.0},
+    {"hash": "0x2", "timestamp_unix": 10, "type": "Sell", "value": None},
+    {"hash": "0x3", "timestamp_unix": 20, "type": "Buy", "value": 7.0},
+    {"hash": "0x4", "timestamp_unix": 40, "type": "Send", "value": 1.0},
+]
+
+
+@pytest.fixture
+def table():
+    return app.ColumnarTable({name: (lambda row, name=name: row[name]) for name in ROWS[0]}, ROWS, filter_column="type")
+
+
+def hashes(table, **view_kwargs):
+    return [table.columns["hash"][i] for i in table.view(**view_kwargs)]
+
+
+def test_view_sorts_with_missing_values_last(table):
+    assert hashes(table) == ["0x1", "0x2", "0x3", "0x4"]
+    assert hashes(table, sort_by="timestamp_unix") == ["0x2", "0x3", "0x1", "0x4"]
+    assert hashes(table, sort_by="value") == ["0x4", "0x1", "0x3", "0x2"]
+    assert hashes(table, sort_by="value", descending=True) == ["0x3", "0x1", "0x4", "0x2"]
+
+
+def test_view_filters_on_the_filter_column(table):
+    assert hashes(table, sort_by="timestamp_unix", filter_values=["Buy"]) == ["0x3", "0x1"]
+    assert hashes(table, filter_values=["Send", "Sell"]) == ["0x2", "0x4"]
+    assert hashes(table, filter_values=["Approve"]) == []
+
+
+def test_views_are_reused_and_bounded(table):
+    assert table.view(filter_values=["Sell", "Buy"]) is table.view(filter_values=["Buy", "Sell"])
+    for i in range(app.ColumnarTable.MAX_VIEWS + 2): table.view(sort_by="value", filter_values=[f"type-{i}"])
+
+    assert len(table.views) == app.ColumnarTable.MAX_VIEWS
+
+
+def test_page_returns_columns_of_the_view(table):
+    page = table.page(1, 2, sort_by="timestamp_unix", descending=True)
+
+    assert (page["total"], page["offset"], page["limit"]) == (4, 1, 2)
+    assert page["columns"]["hash"] == ["0x1", "0x3"]
+    assert page["columns"]["type"] == ["Buy", "Buy"]
+    assert table.page(4, 2)["columns"]["hash"] == []
+    assert table.value_counts("type") == {"Buy": 2, "Sell": 1, "Send": 1}
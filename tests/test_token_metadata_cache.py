@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+import app
+
+ALPHA = {"name": "Alpha", "symbol": "ALPHA", "decimals": 9}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(app.time, "time", lambda: now[0])
+    return now
+
+
+def token(i):
+    return "0x" + format(i, "040x")
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = app.TokenMetadataCache(10)
+    cache.put(token(1), ALPHA)
+    cache.put(token(2), ALPHA, is_placeholder=True)
+
+    clock[0] += app.TOKEN_METADATA_PLACEHOLDER_TTL_SECONDS + 1
+    assert cache.lookup(token(1)) == (ALPHA, False)
+    assert cache.lookup(token(2)) is None # Placeholders are retried sooner
+    clock[0] += app.TOKEN_METADATA_TTL_SECONDS
+    assert cache.get(token(1)) is None
+
+
+def test_placeholders_can_be_refused():
+    cache = app.TokenMetadataCache(10)
+    cache.put(token(1), ALPHA, is_placeholder=True)
+
+    assert cache.get(token(1), allow_placeholder=False) is None
+    assert cache.lookup(token(1).upper().replace("0X", "0x")) == (ALPHA, True)
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+
+def test_least_recently_used_entries_are_evicted_from_memory():
+    cache = app.TokenMetadataCache(2)
+    cache.put(token(1), ALPHA)
+    cache.put(token(2), ALPHA)
+    cache.get(token(1))
+    cache.put(token(3), ALPHA)
+
+    assert list(cache.entries) == [token(1), token(3)]
+
+
+def test_persisted_entries_survive_a_restart(tmp_path):
+    db_path = str(tmp_path / "tokens.sqlite3")
+    app.TokenMetadataCache(10, db_path).put(token(1), ALPHA)
+
+    assert app.TokenMetadataCache(10, db_path).lookup(token(1)) == (ALPHA, False)
+
+
+def test_persisted_table_is_pruned_on_put(tmp_path, clock):
+    db_path = str(tmp_path / "tokens.sqlite3")
+    cache = app.TokenMetadataCache(10, db_path, max_db_entries=3)
+    cache.put(token(1), ALPHA, is_placeholder=True)
+    clock[0] += app.TOKEN_METADATA_PLACEHOLDER_TTL_SECONDS + 1
+    for i in range(2, 7):
+        clock[0] += 1
+        cache.put(token(i), ALPHA)
+
+    rows = sqlite3.connect(db_path).execute("SELECT token_address FROM token_metadata ORDER BY expires_at").fetchall()
+    assert [row[0] for row in rows] == [token(4), token(5), token(6)] # The expired placeholder and the oldest rows are gone
@@ -0,0 +1,165 @@
+import pytest
+
+import app
+
+WALLET = "0x5a11000000000000000000000000000000000001"
+POOL = "0x9999999999999999999999999999999999999999"
+OTHER = "0x7777777777777777777777777777777777777777"
+TOKEN = "0x2222222222222222222222222222222222222222" # 9 decimals, seeded into the metadata cache below
+APPROVAL_EVENT_SIGNATURE = "0x8c5be1e5ebec7d5bd14f71427d1e84f3dd0314c0f7b2291e5b200ac8c7c3b925"
+
+
+@pytest.fixture(autouse=True)
+def known_token_metadata(monkeypatch):
+    app.token_info_cache.put(TOKEN, {"name": "Bench Alpha", "symbol": "ALPHA", "decimals": 9})
+    monkeypatch.setattr(app.bnb_price_series, "price_at", lambda timestamp: 600.0)
+
+
+def topic(address):
+    return "0x" + "0" * 24 + address[2:]
+
+
+def transfer_log(token, from_addr, to_addr, raw_amount):
+    return {"address": token, "topics": [app.BEP20_TRANSFER_EVENT_SIGNATURE, topic(from_addr), topic(to_addr)],
+            "data": raw_amount if isinstance(raw_amount, str) else "0x" + format(raw_amount, "064x")}
+
+
+def describe_one(logs, tx_hash="0xaa"):
+    batch = app.TransferLogBatch.from_receipts(WALLET, [tx_hash], {tx_hash: {"blockNumber": "0x10", "logs": logs}})
+    return batch.describe(tx_hash, 1714608000, None)
+
+
+def test_buy_with_usdt():
+    transfers, classification, value, complete = describe_one([
+        transfer_log(app.USDT_ADDRESS, WALLET, POOL, 100 * 10**18),
+        transfer_log(TOKEN, POOL, WALLET, 5 * 10**9),
+    ])
+
+    assert classification == {"type": "Buy", "main_token_symbol": "ALPHA", "main_token_quantity": 5.0,
+                              "main_token_address": TOKEN, "main_token_raw_quantity": str(5 * 10**9),
+                              "main_token_decimals": 9}
+    assert value == {"amount": "100.0", "currency": "USDT", "basis": "Sent 100.0000 USDT"}
+    assert complete
+    assert [(t["token_symbol"], t["from"], t["to"], t["human_readable_amount"]) for t in transfers] == [
+        ("USDT", WALLET, POOL, "100"), ("ALPHA", POOL, WALLET, "5")]
+
+
+def test_sell_for_wbnb_is_valued_at_the_bnb_price():
+    _, classification, value, complete = describe_one([
+        transfer_log(TOKEN, WALLET, POOL, 2 * 10**9),
+        transfer_log(app.WBNB_ADDRESS, POOL, WALLET, 5 * 10**17),
+    ])
+
+    assert classification["type"] == "Sell"
+    assert classification["main_token_quantity"] == 2.0
+    assert value == {"amount": "300.0", "currency": "USDT (from WBNB)", "basis": "Received 0.5000 WBNB @ $600.00"}
+    assert complete
+
+
+def test_missing_bnb_price_marks_the_valuation_incomplete(monkeypatch):
+    monkeypatch.setattr(app.bnb_price_series, "price_at", lambda timestamp: None)
+    _, classification, value, complete = describe_one([
+        transfer_log(TOKEN, WALLET, POOL, 2 * 10**9),
+        transfer_log(app.WBNB_ADDRESS, POOL, WALLET, 5 * 10**17),
+    ])
+
+    assert classification["type"] == "Sell"
+    assert value == {"amount": None, "currency": None, "basis": "Received 0.5000 WBNB, BNB price N/A"}
+    assert not complete
+
+
+def test_placeholder_token_metadata_marks_the_valuation_incomplete(monkeypatch):
+    unknown_token = "0x4444444444444444444444444444444444444444"
+    placeholder = {"name": "Token (4444)", "symbol": "TKN-4444", "decimals": 18}
+    monkeypatch.setattr(app, "fetch_token_metadata_onchain_server", lambda address, key: (placeholder, True))
+    transfers, classification, _, complete = describe_one([transfer_log(unknown_token, OTHER, WALLET, 10**18)])
+
+    assert classification["type"] == "Receive"
+    assert transfers[0]["token_symbol"] == "TKN-4444"
+    assert not complete
+
+
+@pytest.mark.parametrize("logs, tx_type", [
+    ([transfer_log(TOKEN, WALLET, OTHER, 1)], "Send"),
+    ([transfer_log(TOKEN, OTHER, WALLET, 1)], "Receive"),
+    ([transfer_log(TOKEN, WALLET, OTHER, 1), transfer_log(TOKEN, OTHER, WALLET, 1)], "Other"),
+    ([transfer_log(TOKEN, OTHER, POOL, 1)], "Other"), # The wallet is on neither side
+    ([], "Interaction / Native Tx"),
+])
+def test_simple_classifications(logs, tx_type):
+    assert describe_one(logs)[1]["type"] == tx_type
+
+
+def test_non_transfer_logs_are_skipped():
+    approval = dict(transfer_log(TOKEN, WALLET, POOL, 1), topics=[APPROVAL_EVENT_SIGNATURE, topic(WALLET), topic(POOL)])
+    nft_transfer = dict(transfer_log(TOKEN, OTHER, WALLET, 1))
+    nft_transfer["topics"] = nft_transfer["topics"] + ["0x" + "0" * 63 + "7"] # ERC-721 Transfer: tokenId is indexed
+    transfers, classification, _, _ = describe_one([approval, nft_transfer])
+
+    assert transfers == []
+    assert classification["type"] == "Interaction / Native Tx"
+
+
+def test_undecodable_amount():
+    transfers, _, _, _ = describe_one([transfer_log(TOKEN, OTHER, WALLET, "0xnothex")])
+
+    assert transfers[0]["raw_amount"] == "N/A"
+    assert transfers[0]["human_readable_amount"] == "Error"
+
+
+def test_tx_without_receipt_is_other_and_unknown_hash_has_no_transfers():
+    batch = app.TransferLogBatch.from_receipts(WALLET, ["0xaa"], {})
+
+    transfers, classification, _, _ = batch.describe("0xaa", 0, None)
+    assert (transfers, classification["type"]) == ([], "Other")
+    transfers, classification, value, complete = batch.describe("0xbb", 0, None)
+    assert (transfers, classification["type"], value["amount"], complete) == ([], "Interaction / Native Tx", None, True)
+
+
+def test_txs_added_after_classify_are_classified_on_describe():
+    batch = app.TransferLogBatch(WALLET)
+    batch.add_receipt("0xaa", {"logs": [transfer_log(TOKEN, WALLET, OTHER, 1)]})
+    batch.classify()
+    batch.add_receipt("0xbb", {"logs": [transfer_log(TOKEN, OTHER, WALLET, 1)]})
+
+    assert batch.describe("0xaa", 0, None)[1]["type"] == "Send"
+    assert batch.describe("0xbb", 0, None)[1]["type"] == "Receive"
+    assert [batch.transfer_count(tx_id) for tx_id in range(2)] == [1, 1]
+
+
+def tokentx_row(tx_hash, log_index, token, from_addr, to_addr, value, decimals="9", symbol="ALPHA"):
+    return {"hash": tx_hash, "logIndex": str(log_index), "contractAddress": token, "from": from_addr, "to": to_addr,
+            "value": str(value), "tokenName": symbol.title(), "tokenSymbol": symbol, "tokenDecimal": decimals}
+
+
+def test_tokentx_rows_are_deduplicated_and_put_in_log_order():
+    buy_quote = tokentx_row("0xAA", 1, app.USDT_ADDRESS, WALLET, POOL, 50 * 10**18, decimals="18", symbol="USDT")
+    buy_main = tokentx_row("0xaa", 3, TOKEN, POOL, WALLET, 10**9)
+    # Overlapping shards return some rows twice
+    batch = app.TransferLogBatch.from_tokentx_rows(WALLET, [buy_main, buy_quote, dict(buy_main), dict(buy_quote)])
+    transfers, classification, value, _ = batch.describe("0xaa", 0, None)
+
+    assert [t["token_symbol"] for t in transfers] == ["USDT", "ALPHA"]
+    assert classification["type"] == "Buy"
+    assert value["amount"] == "50.0"
+
+
+def test_identical_tokentx_rows_without_log_index_are_separate_transfers():
+    payment = tokentx_row("0xaa", 0, app.USDT_ADDRESS, WALLET, POOL, 10 * 10**18, decimals="18", symbol="USDT")
+    received = tokentx_row("0xaa", 0, TOKEN, POOL, WALLET, 10**9)
+    for row in (payment, received): del row["logIndex"]
+    batch = app.TransferLogBatch.from_tokentx_rows(WALLET, [payment, received, dict(received)])
+    transfers, classification, _, _ = batch.describe("0xaa", 0, None)
+
+    assert [t["token_symbol"] for t in transfers] == ["USDT", "ALPHA", "ALPHA"]
+    assert classification["type"] == "Buy"
+
+
+def test_tokentx_rows_seed_the_token_metadata_cache():
+    new_token = "0x5555555555555555555555555555555555555555"
+    row = tokentx_row("0xcc", 0, new_token, OTHER, WALLET, 3 * 10**6, decimals="6", symbol="GAMMA")
+    batch = app.TransferLogBatch.from_tokentx_rows(WALLET, [row])
+
+    assert app.token_info_cache.get(new_token, allow_placeholder=False) == {"name": "Gamma", "symbol": "GAMMA", "decimals": 6}
+    assert batch.describe("0xcc", 0, None)[0][0]["numeric_amount"] == 3.0
+
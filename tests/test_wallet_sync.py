@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+import app
+
+WALLET = "0x5a11000000000000000000000000000000000001"
+
+
+@pytest.fixture
+def checkpoints(monkeypatch):
+    checkpoints = app.WalletSyncCheckpoints(10)
+    monkeypatch.setattr(app, "wallet_sync_checkpoints", checkpoints)
+    return checkpoints
+
+
+@pytest.fixture
+def synced_states(monkeypatch):
+    # Stands in for the chain sync: records which state each poll applied its txs to
+    states = []
+
+    def sync_wallet_analysis_state(state, bsc_api_key, start_timestamp_unix_utc, end_timestamp_unix_utc):
+        states.append(state)
+        state.last_synced_block = (state.last_synced_block or 0) + 1
+        return 0
+    monkeypatch.setattr(app, "sync_wallet_analysis_state", sync_wallet_analysis_state)
+    return states
+
+
+def incremental_params(**window):
+    params, error_message = app.parse_wallet_analysis_request(dict(wallet_address=WALLET, bsc_api_key="key", incremental=True, **window))
+    assert error_message is None
+    return params
+
+
+def test_open_ended_range_polls_resume_one_checkpoint(checkpoints, synced_states):
+    start_time = int(time.time()) - 3600
+    app.run_wallet_analysis_job(incremental_params(start_time=start_time))
+    time.sleep(1.1) # The clamped window end moves on between polls
+    app.run_wallet_analysis_job(incremental_params(start_time=start_time))
+
+    assert len(checkpoints.entries) == 1
+    assert synced_states[0] is synced_states[1]
+
+
+def test_ranges_sharing_a_start_keep_separate_checkpoints(checkpoints, synced_states):
+    start_time = int(time.time()) - 7200
+    app.run_wallet_analysis_job(incremental_params(start_time=start_time))
+    app.run_wallet_analysis_job(incremental_params(start_time=start_time, end_time=start_time + 3600))
+
+    assert len(checkpoints.entries) == 2
+    assert synced_states[0] is not synced_states[1]
+
+
+def test_results_do_not_share_lists_with_the_checkpoint():
+    state = app.WalletAnalysisState(WALLET, 0)
+    state.begin_request()
+    state.record_transaction({"hash": "0xaa", "classification_details": {"type": "Send"}})
+    state.realized_trades_log.append({"buy_tx_hash": "0xb1"})
+    window = app.get_analysis_window_server(app.datetime.now(app.dt_timezone.utc), int(time.time()) - 60)
+    result = state.build_result(*window)
+
+    state.record_transaction({"hash": "0xbb", "classification_details": {"type": "Send"}}) # The next incremental sync
+    state.realized_trades_log.append({"buy_tx_hash": "0xb2"})
+    assert [tx["hash"] for tx in result["transactions_in_time_window"]] == ["0xaa"]
+    assert len(result["realized_trades_log_fifo"]) == 1